@@ -0,0 +1,88 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Asyncio LIMS interface. Requires Python 3.7 or later.
+
+The HTTP calls of the synchronous Lims are run on a bounded pool of
+worker threads sharing the connection pool of the requests session,
+so that many of them can be awaited concurrently from a coroutine.
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from genologics.lims import Lims
+from genologics.transport import Transport
+
+
+class AsyncLims(Lims):
+    """LIMS interface with awaitable variants of the HTTP calls.
+
+    Entities obtained through an AsyncLims are the usual entities of
+    genologics.entities and can be used synchronously as well.
+    """
+
+    def __init__(self, baseuri, username, password, version=Lims.VERSION, max_workers=16, **kwargs):
+        """max_workers: The maximum number of requests in flight at once.
+        Other arguments as for Lims; the default transport keeps one
+        pooled connection per worker.
+        """
+        if kwargs.get('transport') is None:
+            kwargs['transport'] = Transport(pool_size=max_workers)
+        super(AsyncLims, self).__init__(baseuri, username, password, version=version, **kwargs)
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def close(self):
+        "Shut down the worker pool and release the pooled connections."
+        self.executor.shutdown(wait=True)
+        self.transport.close()
+
+    def _run(self, func, *args, **kwargs):
+        "Run the blocking call on the worker pool. Return an awaitable."
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def aget(self, uri, params=dict()):
+        "Awaitable GET. Return the response XML as an ElementTree."
+        return await self._run(self.get, uri, params=params)
+
+    async def aput(self, uri, data, params=dict()):
+        "Awaitable PUT. Return the response XML as an ElementTree."
+        return await self._run(self.put, uri, data, params=params)
+
+    async def apost(self, uri, data, params=dict()):
+        "Awaitable POST. Return the response XML as an ElementTree."
+        return await self._run(self.post, uri, data, params=params)
+
+    async def adelete(self, uri, params=dict()):
+        "Awaitable DELETE."
+        return await self._run(self.delete, uri, params=params)
+
+    async def acall(self, func, *args, **kwargs):
+        """Await any blocking method, e.g. lims.get_samples or
+        entity.put, on the worker pool."""
+        return await self._run(func, *args, **kwargs)
+
+    async def aget_entity(self, instance, force=False):
+        """Await the XML data for the given entity instance, as by
+        instance.get(force=force). Return the instance."""
+        await self._run(instance.get, force=force)
+        return instance
+
+    async def aget_entities(self, instances, force=False):
+        """Fetch the XML data of the instances concurrently, one GET each.
+        Useful for entities without a batch endpoint.
+        Return the list of instances in the given order.
+        """
+        return await asyncio.gather(*[self.aget_entity(i, force=force) for i in instances])
+
+    async def _aget_instances(self, klass, add_info=None, params=dict()):
+        "Awaitable variant of Lims._get_instances."
+        return await self._run(self._get_instances, klass, add_info=add_info, params=params)
+
+    async def aget_batch(self, instances, force=False, **kwargs):
+        """Awaitable variant of Lims.get_batch, taking the same arguments.
+        Return the list of instances."""
+        result = await self._run(self.get_batch, instances, force=force, **kwargs)
+        return list(result)
@@ -0,0 +1,254 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Offline benchmarks of the client-side code paths: list page parsing,
+assignment of get_batch responses, descriptor access, put_batch
+serialization and SampleHistory construction, each at several data sizes
+and with each XML backend given.
+
+The data is generated by genologics.synthetic and served by a
+StandInServer called in process, without sockets. Each response is
+rendered once, in an untimed first run of the benchmark, and its bytes
+are served again from then on, so the timings cover the client code. The results are written
+as JSON, and may be compared with those of an earlier run:
+
+    python -m genologics.benchmark --sizes 100 1000 --output new.json --compare old.json
+    python -m genologics.benchmark --backends stdlib lxml --only parse_batch put_batch_serialize
+"""
+
+import gc
+import json
+import platform
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from timeit import default_timer
+from xml.etree import ElementTree
+
+from genologics.constants import nsmap
+from genologics.entities import Artifact, Process, Sample, SampleHistory
+from genologics.lims import Lims
+from genologics.standin import StandInServer, InProcessTransport
+from genologics.synthetic import DatasetGenerator
+from genologics.version import __version__
+from genologics.xmlbackend import BACKENDS, SubElement
+
+BASEURI = 'http://benchmark.example.com/'
+
+
+class Prerendered(object):
+    """Stand-in server answering each distinct read request once and
+    serving the same bytes again for it from then on."""
+
+    def __init__(self, server):
+        self.server = server
+        self.responses = dict()
+        self._lock = threading.Lock()
+
+    def respond(self, method, uri, body, headers):
+        if method != 'GET' and not uri.endswith('/batch/retrieve'):
+            return self.server.respond(method, uri, body, headers)
+        key = (method, uri, body, headers.get('Accept-Encoding'), headers.get('If-None-Match'))
+        with self._lock:
+            response = self.responses.get(key)
+        if response is None:
+            response = self.server.respond(method, uri, body, headers)
+            with self._lock:
+                self.responses[key] = response
+        return response
+
+
+class Fixture(object):
+    """Synthetic dataset of size samples, served in process: one project
+    going through two steps, with result files and without pooling."""
+
+    def __init__(self, size, xml_backend='stdlib'):
+        self.size = size
+        self.xml_backend = xml_backend
+        generator = DatasetGenerator(BASEURI, samples_per_project=size, steps=2, pool_size=0)
+        dataset = generator.generate()
+        self.lineages = generator.lineages
+        self.server = StandInServer(compress_min_size=None)
+        self.server.load(dataset, baseuri=BASEURI)
+        self.prerendered = Prerendered(self.server)
+        links = ElementTree.Element(nsmap('ri:links'))
+        for ids in self.lineages.values():
+            ElementTree.SubElement(links, 'link', uri=self.server.api_root + 'artifacts/' + ids[0])
+        # The batch/retrieve response for the root analytes
+        self.batch_xml = self.server.handle('POST', self.server.api_root + 'artifacts/batch/retrieve',
+                                            ElementTree.tostring(links), {})[1]
+
+    def lims(self):
+        "Return a new Lims, with empty caches, using the server."
+        return Lims(self.server.baseuri, 'benchmark', 'benchmark', transport=InProcessTransport(self.prerendered),
+                    xml_backend=self.xml_backend)
+
+    def close(self):
+        self.server.stop()
+
+
+# The benchmarks prepare their state from the fixture and return the
+# function to time. They are called anew for every repetition.
+
+def list_pages(fixture):
+    "Parse the pages of the sample list."
+    lims = fixture.lims()
+    return lambda: lims.get_samples()
+
+
+def parse_batch(fixture):
+    "Parse a batch/retrieve response of size artifacts."
+    lims = fixture.lims()
+    return lambda: lims.xml.fromstring(fixture.batch_xml)
+
+
+def get_batch_assign(fixture):
+    "Retrieve the root analytes with batch calls, attaching the XML."
+    lims = fixture.lims()
+    artifacts = [Artifact(lims, id=ids[0]) for ids in fixture.lineages.values()]
+    return lambda: lims.get_batch(artifacts)
+
+
+def udf_access(fixture):
+    "Read every UDF of an artifact with size UDFs, and set one."
+    lims = fixture.lims()
+    artifact = Artifact(lims, id=next(iter(fixture.lineages.values()))[0])
+    artifact.get()
+    for number in range(fixture.size):
+        field = SubElement(artifact.root, nsmap('udf:field'), name='Field %s' % number, type='Numeric')
+        field.text = str(number)
+
+    def run():
+        udf = artifact.udf
+        for number in range(fixture.size):
+            udf['Field %s' % number]
+        udf['Field 0'] = 1.5
+    return run
+
+
+def input_output_maps(fixture):
+    "Build the input-output maps of the first step, 2 per sample."
+    lims = fixture.lims()
+    process = Process(lims, id='24-1')
+    process.get()
+    return lambda: process.input_output_maps
+
+
+def put_batch_serialize(fixture):
+    "Serialize the root analytes into a batch update body."
+    lims = fixture.lims()
+    artifacts = [Artifact(lims, id=ids[0]) for ids in fixture.lineages.values()]
+    lims.get_batch(artifacts)
+
+    def run():
+        root = artifacts[0].root.makeelement(nsmap('art:details'), {})
+        for artifact in artifacts:
+            root.append(artifact.root)
+        data = lims.tostring(ElementTree.ElementTree(root))
+        del root[:]
+        return data
+    return run
+
+
+def sample_history(fixture):
+    "Build the history of the last analyte of a sample."
+    lims = fixture.lims()
+    sample_id, ids = sorted(fixture.lineages.items())[-1]
+    name = Sample(lims, id=sample_id).name
+    return lambda: SampleHistory(sample_name=name, output_artifact=ids[-1], lims=lims)
+
+
+BENCHMARKS = [list_pages, parse_batch, get_batch_assign, udf_access, input_output_maps,
+              put_batch_serialize, sample_history]
+
+
+def measure(benchmark, fixture, repeat):
+    """Return the result of the benchmark on the fixture: the times of
+    every repetition after a first untimed one, their minimum and median,
+    or the error raised."""
+    result = dict(name=benchmark.__name__, size=fixture.size, backend=fixture.xml_backend,
+                  times=[], error=None)
+    try:
+        # Untimed, renders the responses of the server
+        benchmark(fixture)()
+        for i in range(repeat):
+            run = benchmark(fixture)
+            gc.collect()
+            gc.disable()
+            try:
+                start = default_timer()
+                run()
+                result['times'].append(default_timer() - start)
+            finally:
+                gc.enable()
+    except Exception as e:
+        result['error'] = '%s: %s' % (e.__class__.__name__, e)
+    times = sorted(result['times'])
+    result['min'] = times[0] if times else None
+    result['median'] = times[len(times) // 2] if times else None
+    return result
+
+
+def run(sizes=(100, 1000), repeat=5, only=None, backends=('stdlib',)):
+    """Run the benchmarks, all or those named in only, with each XML
+    backend, and return the report."""
+    benchmarks = [b for b in BENCHMARKS if not only or b.__name__ in only]
+    results = []
+    for size in sizes:
+        for backend in backends:
+            fixture = Fixture(size, xml_backend=backend)
+            try:
+                for benchmark in benchmarks:
+                    results.append(measure(benchmark, fixture, repeat))
+            finally:
+                fixture.close()
+    return dict(version=__version__, python=platform.python_version(),
+                platform=platform.platform(), date=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                repeat=repeat, results=results)
+
+
+def compare(report, baseline, out=None):
+    "Write the ratio of the median times of the report to those of the baseline."
+    if out is None:
+        out = sys.stderr
+    medians = dict(((r['name'], r['size'], r.get('backend', 'stdlib')), r['median'])
+                   for r in baseline['results'])
+    out.write("%-22s %8s %8s %12s %12s %8s\n" % (
+        'benchmark', 'size', 'backend', 'baseline s', 'median s', 'ratio'))
+    for result in report['results']:
+        old = medians.get((result['name'], result['size'], result['backend']))
+        new = result['median']
+        ratio = '%.2f' % (new / old) if old and new is not None else '-'
+        out.write("%-22s %8d %8s %12s %12s %8s\n" % (
+            result['name'], result['size'], result['backend'], '-' if old is None else '%.6f' % old,
+            result['error'] and 'error' or '%.6f' % new, ratio))
+
+
+def main(args=None):
+    parser = ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000],
+                        help='Numbers of samples of the datasets')
+    parser.add_argument('--repeat', type=int, default=5, help='Repetitions of each benchmark')
+    parser.add_argument('--only', nargs='+', choices=[b.__name__ for b in BENCHMARKS],
+                        help='Benchmarks to run, by default all')
+    parser.add_argument('--backends', nargs='+', default=['stdlib'], choices=sorted(BACKENDS),
+                        help='XML backends to run the benchmarks with')
+    parser.add_argument('--output', help='JSON file of the results, by default stdout')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    args = parser.parse_args(args)
+
+    report = run(sizes=args.sizes, repeat=args.repeat, only=args.only, backends=args.backends)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+    return report
+
+
+if __name__ == '__main__':
+    main()
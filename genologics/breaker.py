@@ -0,0 +1,99 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Circuit breaker failing requests fast while the LIMS is unhealthy.
+"""
+
+import logging
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    "The request was not sent because the circuit breaker is open."
+
+
+class CircuitBreaker(object):
+    """Stops sending requests after failure_threshold consecutive timeouts,
+    connection errors or 5xx responses. While open, requests fail at once
+    with CircuitOpenError; after cooldown seconds a single probe request is
+    let through (half-open), which closes the circuit on success and opens
+    it again on failure.
+    """
+
+    def __init__(self, failure_threshold=5, cooldown=30, on_state_change=None):
+        """failure_threshold: Consecutive failures opening the circuit.
+        cooldown: Seconds the circuit stays open before a probe.
+        on_state_change: Called as on_state_change(breaker, old, new) on
+                         every transition, outside the breaker's lock.
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.on_state_change = on_state_change
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        "Change the state; return the (old, new) pair to notify, or None."
+        old = self.state
+        if old == state:
+            return None
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.time()
+        logger.warning("LIMS circuit breaker %s -> %s", old, state)
+        return old, state
+
+    def _notify(self, change):
+        if change is not None and self.on_state_change is not None:
+            self.on_state_change(self, *change)
+
+    def before(self):
+        "Called before a request; raise CircuitOpenError if it may not be sent."
+        change = None
+        with self._lock:
+            if self.state == OPEN and time.time() - self.opened_at >= self.cooldown:
+                change = self._transition(HALF_OPEN)
+            if self.state == OPEN or (self.state == HALF_OPEN and self._probing):
+                retry_in = max(0.0, self.opened_at + self.cooldown - time.time())
+                raise CircuitOpenError("LIMS circuit breaker is %s, retry in %.0f seconds"
+                                       % (self.state, retry_in))
+            if self.state == HALF_OPEN:
+                self._probing = True
+        self._notify(change)
+
+    def success(self):
+        "Called after a request the server handled."
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            change = self._transition(CLOSED)
+        self._notify(change)
+
+    def failure(self):
+        "Called after a timeout, connection error or 5xx response."
+        change = None
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self._probing = False
+                change = self._transition(OPEN)
+                if change is None:
+                    # Already open: restart the cooldown
+                    self.opened_at = time.time()
+        self._notify(change)
+
+    def cancel(self):
+        "Called when a request failed for reasons unrelated to the server."
+        with self._lock:
+            self._probing = False
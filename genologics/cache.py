@@ -0,0 +1,340 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Caches of entity data for the LIMS interface.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from genologics.entities import Artifact, Container, Containertype, Process, Processtype, Protocol, \
+    ReagentType, Sample, Step, Udfconfig, Workflow
+
+logger = logging.getLogger(__name__)
+
+# Time to live of in-memory entity data
+FOREVER = None
+NEVER = 0
+
+# Suggested in-memory time to live, in seconds, for long-running services:
+# configuration rarely changes, while samples and steps move constantly.
+SERVICE_CACHE_TTLS = {
+    Processtype: FOREVER,
+    Protocol: FOREVER,
+    Workflow: FOREVER,
+    Containertype: FOREVER,
+    Udfconfig: FOREVER,
+    ReagentType: FOREVER,
+    Sample: 300,
+    Container: 60,
+    Process: 60,
+    Artifact: 10,
+    Step: NEVER,
+}
+
+# Seconds the XML of an entity class is kept in the persistent cache;
+# None keeps it until it is overwritten. Unlisted classes are not cached.
+DEFAULT_PERSISTENT_TTLS = {
+    'Containertype': 24 * 3600,
+    'Processtype': 24 * 3600,
+    'Udfconfig': 24 * 3600,
+    'Protocol': 24 * 3600,
+    'Workflow': 24 * 3600,
+    'ReagentType': 24 * 3600,
+    'ReagentKit': 24 * 3600,
+    'Instrument': 24 * 3600,
+    'Researcher': 3600,
+    'Lab': 3600,
+}
+
+
+# Approximate memory used by an element and by an attribute, in bytes
+ELEMENT_OVERHEAD = 250
+ATTRIBUTE_OVERHEAD = 100
+
+
+def estimate_size(root):
+    "Rough estimate of the memory held by an ElementTree, in bytes."
+    size = 0
+    for node in root.iter():
+        size += ELEMENT_OVERHEAD + len(node.tag) + len(node.text or '') + len(node.tail or '')
+        for key, value in node.attrib.items():
+            size += ATTRIBUTE_OVERHEAD + len(key) + len(value)
+    return size
+
+
+def _count(stats, entity, key, amount=1):
+    "Add to the counter of the class of the entity."
+    name = entity.__class__.__name__
+    try:
+        counters = stats[name]
+    except KeyError:
+        counters = stats[name] = dict(hits=0, misses=0, evictions=0, bytes=0)
+    counters[key] += amount
+
+
+class IdentityMap(dict):
+    """The default identity map of a Lims: one entity instance per URI,
+    kept for the life of the Lims. Counts hits and misses per class.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(IdentityMap, self).__init__(*args, **kwargs)
+        self.stats = dict()
+
+    def __getitem__(self, uri):
+        entity = dict.__getitem__(self, uri)
+        _count(self.stats, entity, 'hits')
+        return entity
+
+    def __setitem__(self, uri, entity):
+        dict.__setitem__(self, uri, entity)
+        _count(self.stats, entity, 'misses')
+
+    def touch(self, entity):
+        "Called when the data of the entity is used."
+        pass
+
+    def loaded(self, entity):
+        "Called when the entity gets new XML data."
+        pass
+
+
+class LRUIdentityMap(object):
+    """Identity map bounding the entity data held in memory.
+
+    Entities are held through weak references, so an instance is kept as
+    long as it is in use and stubs are freed once unused. The XML data of
+    the least recently used entities is released when there are more than
+    max_entities of them loaded, or their estimated size exceeds max_bytes;
+    it is fetched again when next needed. The data of entities with unsaved
+    changes is not released, nor that of the entity each thread used last,
+    which a descriptor may be reading.
+    """
+
+    def __init__(self, max_entities=None, max_bytes=None):
+        self.max_entities = max_entities
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.stats = dict()
+        self._entities = weakref.WeakValueDictionary()
+        # URI: (entity, size) of the entities holding data, oldest first
+        self._loaded = OrderedDict()
+        # URI of the entity last used by each thread
+        self._in_use = weakref.WeakKeyDictionary()
+        self._lock = threading.RLock()
+
+    def __getitem__(self, uri):
+        entity = self._entities[uri]
+        _count(self.stats, entity, 'hits')
+        return entity
+
+    def __setitem__(self, uri, entity):
+        self._entities[uri] = entity
+        _count(self.stats, entity, 'misses')
+
+    def __delitem__(self, uri):
+        with self._lock:
+            del self._entities[uri]
+            self._release(uri)
+
+    def __contains__(self, uri):
+        return uri in self._entities
+
+    def __len__(self):
+        return len(self._entities)
+
+    def __iter__(self):
+        return iter(list(self._entities.keys()))
+
+    def get(self, uri, default=None):
+        try:
+            return self[uri]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self._entities.keys())
+
+    def values(self):
+        return list(self._entities.values())
+
+    def items(self):
+        return list(self._entities.items())
+
+    def clear(self):
+        with self._lock:
+            self._entities.clear()
+            self._loaded.clear()
+            self.bytes = 0
+            for counters in self.stats.values():
+                counters['bytes'] = 0
+
+    def touch(self, entity):
+        """Mark the entity as the most recently used, and as in use by the
+        current thread: its data is not released until the thread uses
+        another entity."""
+        uri = entity._uri
+        with self._lock:
+            self._in_use[threading.current_thread()] = uri
+            item = self._loaded.pop(uri, None)
+            if item is not None:
+                self._loaded[uri] = item
+
+    def loaded(self, entity):
+        "Account for the new XML data of the entity, evicting if needed."
+        uri = getattr(entity, '_uri', None)
+        if uri is None: return
+        size = estimate_size(entity.root)
+        with self._lock:
+            self._in_use[threading.current_thread()] = uri
+            self._release(uri)
+            self._loaded[uri] = (entity, size)
+            self.bytes += size
+            _count(self.stats, entity, 'bytes', size)
+            self._evict()
+
+    def _release(self, uri):
+        "Stop accounting for the data of the entity at the URI."
+        item = self._loaded.pop(uri, None)
+        if item is not None:
+            entity, size = item
+            self.bytes -= size
+            _count(self.stats, entity, 'bytes', -size)
+        return item
+
+    def _over_budget(self):
+        if self.max_entities is not None and len(self._loaded) > self.max_entities:
+            return True
+        return self.max_bytes is not None and self.bytes > self.max_bytes
+
+    def _evict(self):
+        pinned = []
+        in_use = set(self._in_use.values())
+        # The entity loaded last is always kept
+        while self._over_budget() and len(self._loaded) > 1:
+            uri, (entity, size) = self._loaded.popitem(last=False)
+            if entity._dirty or uri in in_use:
+                pinned.append((uri, (entity, size)))
+                continue
+            self.bytes -= size
+            _count(self.stats, entity, 'bytes', -size)
+            _count(self.stats, entity, 'evictions')
+            # Bypass the root setter, the data is fetched again lazily
+            entity._root = None
+            entity.lims.discard_validators(uri)
+        for uri, item in pinned:
+            self._loaded[uri] = item
+
+
+class CachePolicy(object):
+    """Registry of how long the XML data of each entity class stays valid
+    in memory, keyed by class and inherited by subclasses.
+
+    A time to live is a number of seconds, FOREVER or NEVER. Data older
+    than its time to live is revalidated with the LIMS the next time it
+    is used; with NEVER, on every use.
+    """
+
+    def __init__(self, ttls=None, default=FOREVER):
+        """ttls: dictionary of times to live by entity class.
+        default: The time to live of the classes not in ttls.
+        """
+        self.ttls = dict(ttls or {})
+        self.default = default
+        self._resolved = dict()
+
+    def set(self, klass, ttl):
+        "Set the time to live of the entity class."
+        self.ttls[klass] = ttl
+        self._resolved = dict()
+
+    def ttl(self, klass):
+        "Return the time to live of the entity class."
+        try:
+            return self._resolved[klass]
+        except KeyError:
+            pass
+        ttl = self.default
+        for base in klass.__mro__:
+            if base in self.ttls:
+                ttl = self.ttls[base]
+                break
+        self._resolved[klass] = ttl
+        return ttl
+
+    def is_fresh(self, instance):
+        "Whether the data of the instance may be used without revalidation."
+        ttl = self.ttl(instance.__class__)
+        if ttl is FOREVER:
+            return True
+        return time.time() - instance._fetched < ttl
+
+
+class PersistentCache(object):
+    """On-disk cache of the raw entity XML keyed by URI, shared by all the
+    scripts using the same directory. Stored in an SQLite database.
+    """
+
+    FILENAME = 'entities.sqlite'
+
+    def __init__(self, directory=None, ttls=None):
+        """directory: Where the database is kept, by default ~/.genologics_cache
+        ttls: dictionary of seconds to keep the XML by entity class name,
+              replacing DEFAULT_PERSISTENT_TTLS.
+        """
+        if directory is None:
+            directory = os.path.expanduser(os.path.join('~', '.genologics_cache'))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.ttls = dict(DEFAULT_PERSISTENT_TTLS if ttls is None else ttls)
+        self.path = os.path.join(directory, self.FILENAME)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS entities "
+                                     "(uri TEXT PRIMARY KEY, class TEXT, xml BLOB, stored REAL)")
+
+    def caches(self, klass):
+        "Whether the XML of the entity class name is cached."
+        return klass in self.ttls
+
+    def get(self, uri, klass):
+        "Return the XML stored for the URI, or None if missing or expired."
+        if not self.caches(klass):
+            return None
+        with self._lock:
+            row = self._connection.execute("SELECT xml, stored FROM entities WHERE uri = ?",
+                                           (uri,)).fetchone()
+        if row is None:
+            return None
+        ttl = self.ttls[klass]
+        if ttl is not None and time.time() - row[1] > ttl:
+            return None
+        return bytes(row[0])
+
+    def put(self, uri, klass, xml):
+        "Store the XML for the URI, if the entity class name is cached."
+        if not self.caches(klass):
+            return
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?)",
+                                     (uri, klass, sqlite3.Binary(xml), time.time()))
+
+    def discard(self, uri):
+        "Remove the XML stored for the URI, if any."
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM entities WHERE uri = ?", (uri,))
+
+    def clear(self):
+        "Remove everything from the cache."
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM entities")
+
+    def close(self):
+        self._connection.close()
@@ -7,6 +7,7 @@ Copyright (C) 2012 Per Kraulis
 """
 
 from genologics.constants import nsmap
+from genologics.xmlbackend import SubElement
 
 try:
     from urllib.parse import urlsplit, urlparse, parse_qs, urlunparse
@@ -16,13 +17,21 @@ except ImportError:
 from decimal import Decimal
 import datetime
 import time
-from xml.etree import ElementTree
 
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def modified(instance):
+    """Mark the instance as changed locally, and record it with the unit
+    of work of its LIMS, if any."""
+    instance._dirty = True
+    lims = getattr(instance, 'lims', None)
+    if lims is not None and hasattr(lims, '_modified'):
+        lims._modified(instance)
+
+
 class BaseDescriptor(object):
     "Abstract base descriptor for an instance attribute."
 
@@ -63,9 +72,9 @@ class StringDescriptor(TagDescriptor):
         node = self.get_node(instance)
         if node is None:
             # create the new tag
-            node = ElementTree.Element(self.tag)
-            instance.root.append(node)
+            node = SubElement(instance.root, self.tag)
         node.text = str(value)
+        modified(instance)
 
 
 class StringAttributeDescriptor(TagDescriptor):
@@ -80,6 +89,7 @@ class StringAttributeDescriptor(TagDescriptor):
     def __set__(self, instance, value):
         instance.get()
         instance.root.attrib[self.tag] = value
+        modified(instance)
 
 
 class StringListDescriptor(TagDescriptor):
@@ -105,7 +115,7 @@ class StringDictionaryDescriptor(TagDescriptor):
         result = dict()
         node = instance.root.find(self.tag)
         if node is not None:
-            for node2 in node.getchildren():
+            for node2 in node:
                 result[node2.tag] = node2.text
         return result
 
@@ -159,6 +169,7 @@ class UdfDictionary(object):
         self._udt = kwargs.pop('udt', False)
         self.rootkeys = args
         self._rootnode = None
+        self._root = None
         self._update_elems()
         self._prepare_lookup()
         self.location = 0
@@ -166,7 +177,7 @@ class UdfDictionary(object):
     @property
     def rootnode(self):
         if self._rootnode is None:
-            self._rootnode = self.instance.root
+            self._rootnode = self._root = self.instance.root
             for rootkey in self.rootkeys:
                 self._rootnode = self._rootnode.find(rootkey)
         return self._rootnode
@@ -181,6 +192,7 @@ class UdfDictionary(object):
         assert isinstance(name, str)
         if not self._udt:
             raise AttributeError('cannot set name for a UDF dictionary')
+        self._rebind()
         self._udt = name
         elem = self.rootnode.find(nsmap('udf:type'))
         assert elem is not None
@@ -197,7 +209,7 @@ class UdfDictionary(object):
                 self._elems = elem.findall(nsmap('udf:field'))
         else:
             tag = nsmap('udf:field')
-            for elem in self.rootnode.getchildren():
+            for elem in self.rootnode:
                 if elem.tag == tag:
                     self._elems.append(elem)
 
@@ -226,10 +238,26 @@ class UdfDictionary(object):
             return False
         return True
 
+    def _rebind(self):
+        "Follow the data of the instance before an edit, since it may have changed."
+        root = self.instance.root
+        if root is None:
+            # Released by the identity map: keep editing this data
+            self.instance.root = self._root
+        elif root is not self._root:
+            # Reloaded: edit the new data, not the old tree
+            self._rootnode = None
+            self._update_elems()
+            self._prepare_lookup()
+
+    def _modified(self):
+        modified(self.instance)
+
     def __getitem__(self, key):
         return self._lookup[key]
 
     def __setitem__(self, key, value):
+        self._rebind()
         self._lookup[key] = value
         for node in self._elems:
             if node.attrib['name'] != key: continue
@@ -288,10 +316,10 @@ class UdfDictionary(object):
                 root = self.rootnode.find(nsmap('udf:type'))
             else:
                 root = self.rootnode
-            elem = ElementTree.SubElement(root,
-                                          nsmap('udf:field'),
-                                          type=vtype,
-                                          name=key)
+            elem = SubElement(root,
+                              nsmap('udf:field'),
+                              type=vtype,
+                              name=key)
             if not isinstance(value, str):
                 if not self._is_string(value):
                     value = str(value).encode('UTF-8')
@@ -301,21 +329,26 @@ class UdfDictionary(object):
             #update the internal elements and lookup with new values
             self._update_elems()
             self._prepare_lookup()
+        self._modified()
 
     def __delitem__(self, key):
+        self._rebind()
         del self._lookup[key]
         for node in self._elems:
             if node.attrib['name'] == key:
                 self.rootnode.remove(node)
                 break
+        self._modified()
 
     def items(self):
         return list(self._lookup.items())
 
     def clear(self):
+        self._rebind()
         for elem in self._elems:
             self.rootnode.remove(elem)
         self._update_elems()
+        self._modified()
 
     def __iter__(self):
         return self
@@ -414,11 +447,11 @@ class EntityDescriptor(TagDescriptor):
         node = self.get_node(instance)
         if node is None:
             # create the new tag
-            node = ElementTree.Element(self.tag)
-            instance.root.append(node)
+            node = SubElement(instance.root, self.tag)
         node.attrib['uri'] = value.uri
         if value._TAG in ['project', 'sample', 'artifact', 'container']:
             node.attrib['limsid'] = value.id
+        modified(instance)
 
 
 class EntityListDescriptor(EntityDescriptor):
@@ -453,6 +486,7 @@ class NestedBooleanDescriptor(TagDescriptor):
         for rootkey in self.rootkeys:
             rootnode = rootnode.find(rootkey)
         rootnode.find(self.tag).text = str(value).lower()
+        modified(instance)
 
 class NestedStringDescriptor(TagDescriptor):
     def __init__(self, tag, *args):
@@ -473,6 +507,7 @@ class NestedStringDescriptor(TagDescriptor):
         for rootkey in self.rootkeys:
             rootnode = rootnode.find(rootkey)
         rootnode.find(self.tag).text = value
+        modified(instance)
 
 class NestedAttributeListDescriptor(StringAttributeDescriptor):
     """An instance yielding a list of dictionnaries of attributes
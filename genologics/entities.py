@@ -7,13 +7,14 @@ Copyright (C) 2012 Per Kraulis
 """
 
 from genologics.constants import nsmap
+from genologics.xmlbackend import SubElement
 from genologics.descriptors import StringDescriptor, StringDictionaryDescriptor, UdfDictionaryDescriptor, \
     UdtDictionaryDescriptor, ExternalidListDescriptor, EntityDescriptor, BooleanDescriptor, EntityListDescriptor, \
     StringAttributeDescriptor, StringListDescriptor, DimensionDescriptor, IntegerDescriptor, \
     PlacementDictionaryDescriptor, InputOutputMapList, LocationDescriptor, ReagentLabelList, NestedEntityListDescriptor, \
     NestedStringListDescriptor, NestedAttributeListDescriptor, IntegerAttributeDescriptor, NestedStringDescriptor, \
     NestedBooleanDescriptor, MultiPageNestedEntityListDescriptor, ProcessTypeParametersDescriptor, \
-    ProcessTypeProcessInputDescriptor, ProcessTypeProcessOutputDescriptor, NamedStringDescriptor
+    ProcessTypeProcessInputDescriptor, ProcessTypeProcessOutputDescriptor, NamedStringDescriptor, modified
 
 try:
     from urllib.parse import urlsplit, urlparse, parse_qs, urlunparse
@@ -23,6 +24,7 @@ except ImportError:
 from xml.etree import ElementTree
 
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -237,6 +239,14 @@ class Entity(object):
     _TAG = None
     _URI = None
     _PREFIX = None
+    # Whether the LIMS has batch/retrieve and batch/update endpoints for this class
+    _BATCH_RETRIEVE = False
+    _BATCH_UPDATE = False
+    _root = None
+    # When the data was last obtained from the LIMS
+    _fetched = None
+    # Whether the data was changed through the descriptors since then
+    _dirty = False
 
     def __new__(cls, lims, uri=None, id=None, _create_new=False):
         if not uri:
@@ -267,6 +277,24 @@ class Entity(object):
     def __str__(self):
         return "%s(%s)" % (self.__class__.__name__, self.id)
 
+    @property
+    def root(self):
+        "The XML data of the instance as an ElementTree, or None if not loaded yet."
+        return self._root
+
+    @root.setter
+    def root(self, value):
+        changed = value is not self._root
+        if value is not None and changed:
+            # Keep other threads from releasing the data being replaced
+            self.lims.cache.touch(self)
+        self._root = value
+        if value is not None:
+            self._fetched = time.time()
+            self._dirty = False
+            if changed:
+                self.lims.cache.loaded(self)
+
     def __repr__(self):
         return "%s(%s)" % (self.__class__.__name__, self.uri)
 
@@ -284,23 +312,52 @@ class Entity(object):
         return parts.path.split('/')[-1]
 
     def get(self, force=False):
-        "Get the XML data for this instance."
-        if not force and self.root is not None: return
-        self.root = self.lims.get(self.uri)
+        """Get the XML data for this instance.
+        When forced, or when the data is older than the time to live of
+        the class in the cache policy of the LIMS, the data is obtained
+        again; the data already held is revalidated and only downloaded
+        and parsed again if it has changed. Data with unsaved changes is
+        not revalidated: it is kept unless forced, and forcing discards
+        the changes."""
+        if not force and self._root is not None:
+            if self._dirty or self.lims.cache_policy.is_fresh(self):
+                self.lims.cache.touch(self)
+                # Unless another thread released the data meanwhile
+                if self._root is not None:
+                    return
+            else:
+                force = True
+        current = None if self._dirty else self._root
+        tracer = self.lims.tracer
+        if tracer is None:
+            self.root = self.lims.get_root(self, current=current, force=force)
+            return
+        name = self.__class__.__name__
+        with tracer.span(name + '.get', entity=name, id=self.id, lazy=self._root is None and not force):
+            self.root = self.lims.get_root(self, current=current, force=force)
 
     def put(self):
         "Save this instance by doing PUT of its serialized XML."
-        data = self.lims.tostring(ElementTree.ElementTree(self.root))
+        data = self._serialize()
         self.lims.put(self.uri, data)
+        self._dirty = False
 
     def post(self):
         "Save this instance with POST"
-        data = self.lims.tostring(ElementTree.ElementTree(self.root))
+        data = self._serialize()
         self.lims.post(self.uri, data)
+        self._dirty = False
 
     def xml(self):
+        self.get()
         return self.lims.tostring(ElementTree.ElementTree(self.root))
 
+    def _serialize(self):
+        "Return the XML data to save, which must have been loaded."
+        if self._root is None:
+            raise ValueError("%r has no data to save: it was never loaded or has been released" % self)
+        return self.lims.tostring(ElementTree.ElementTree(self._root))
+
     @classmethod
     def _create(cls, lims, creation_tag=None, udfs=None, **kwargs):
         """Create an instance from attributes and return it"""
@@ -444,6 +501,8 @@ class Sample(Entity):
     _URI = 'samples'
     _TAG = 'sample'
     _PREFIX = 'smp'
+    _BATCH_RETRIEVE = True
+    _BATCH_UPDATE = True
 
     name           = StringDescriptor('name')
     date_received  = StringDescriptor('date-received')
@@ -468,9 +527,9 @@ class Sample(Entity):
             raise TypeError('%s is not of type Container'%container)
         instance = super(Sample, cls)._create(lims, creation_tag='samplecreation',udfs=udfs, **kwargs)
 
-        location = ElementTree.SubElement(instance.root, 'location')
-        ElementTree.SubElement(location, 'container', dict(uri=container.uri))
-        position_element = ElementTree.SubElement(location, 'value')
+        location = SubElement(instance.root, 'location')
+        SubElement(location, 'container', dict(uri=container.uri))
+        position_element = SubElement(location, 'value')
         position_element.text = position
         data = lims.tostring(ElementTree.ElementTree(instance.root))
         instance.root = lims.post(uri=lims.get_uri(cls._URI), data=data)
@@ -498,6 +557,8 @@ class Container(Entity):
     _URI = 'containers'
     _TAG = 'container'
     _PREFIX = 'con'
+    _BATCH_RETRIEVE = True
+    _BATCH_UPDATE = True
 
     name           = StringDescriptor('name')
     type           = EntityDescriptor('type', Containertype)
@@ -678,6 +739,8 @@ class Artifact(Entity):
     _URI = 'artifacts'
     _TAG = 'artifact'
     _PREFIX = 'art'
+    _BATCH_RETRIEVE = True
+    _BATCH_UPDATE = True
 
     name           = StringDescriptor('name')
     type           = StringDescriptor('type')
@@ -775,9 +838,10 @@ class StepPools(Entity):
         available_inputs_root = self.root.find("available-inputs")
         available_inputs_root.clear()
         for input_art in available_inputs:
-            current_elem = ElementTree.SubElement(available_inputs_root, "input")
+            current_elem = SubElement(available_inputs_root, "input")
             current_elem.attrib['uri'] = input_art.uri
             current_elem.attrib['replicates'] = str(available_inputs[input_art]['replicates'])
+        modified(self)
         self._available_inputs = available_inputs
 
     def get_available_inputs(self):
@@ -814,14 +878,15 @@ class StepPools(Entity):
         pool_root = self.root.find("pooled-inputs")
         pool_root.clear()
         for idx, pool_obj in enumerate(pools):
-            current_pool = ElementTree.SubElement(pool_root, 'pool')
+            current_pool = SubElement(pool_root, 'pool')
             if pool_obj.get('output', False):
                 current_pool.attrib['output-uri'] = pool_obj['output'].uri
             current_pool.attrib['name'] = pool_obj.get('name', 'Pool #{0}'.format(idx+1))
             for input_art in pool_obj.get('inputs', []):
-                current_input = ElementTree.SubElement(current_pool, 'input')
+                current_input = SubElement(current_pool, 'input')
                 current_input.attrib['uri'] = input_art.uri
                 self._remove_available_inputs(input_art)
+        modified(self)
 
         self._pools = pools
 
@@ -869,16 +934,17 @@ class StepPlacements(Entity):
                             value_el = node.find('location').find('value')
                             value_el.text = well
                         else:
-                            loc_el = ElementTree.SubElement(node, 'location')
-                            cont_el = ElementTree.SubElement(loc_el, 'container',
-                                                             {'uri': workset.uri, 'limsid': workset.id})
-                            well_el = ElementTree.SubElement(loc_el, 'value')
+                            loc_el = SubElement(node, 'location')
+                            cont_el = SubElement(loc_el, 'container',
+                                                 {'uri': workset.uri, 'limsid': workset.id})
+                            well_el = SubElement(loc_el, 'value')
                             well_el.text = well  # not supported in the constructor
         # Handle selected containers
         sc = self.root.find("selected-containers")
         sc.clear()
         for cont in containers:
-            ElementTree.SubElement(sc, 'container', uri=cont.uri)
+            SubElement(sc, 'container', uri=cont.uri)
+        modified(self)
         self._placementslist = value
 
     placement_list = property(get_placement_list, set_placement_list)
@@ -953,6 +1019,7 @@ class StepActions(Entity):
             art_uri = node.attrib.get('artifact-uri')
             action = [action for action in actions if action['artifact'].uri == art_uri][0]
             if 'action' in action: node.attrib['action'] = action.get('action')
+        modified(self)
 
     next_actions = property(get_next_actions, set_next_actions)
 
@@ -1086,7 +1153,7 @@ class ReagentType(Entity):
     def __init__(self, lims, uri=None, id=None):
         super(ReagentType, self).__init__(lims, uri, id)
         assert self.uri is not None
-        self.root = lims.get(self.uri)
+        self.get()
         self.sequence = None
         for t in self.root.findall('special-type'):
             if t.attrib.get("name") == "Index":
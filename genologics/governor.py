@@ -0,0 +1,139 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Client-side limits on the load a script puts on the LIMS server.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket: on average at most rate acquisitions per
+    second, with bursts of up to capacity."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self):
+        "Take a token, waiting for one if needed. Return the seconds waited."
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill(time.time())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class Governor(object):
+    """Limits the requests sent through a Transport: a requests per second
+    rate shared by all verbs, and a maximum number of concurrent requests
+    per verb. Requests wait until they are allowed.
+
+    With a p95_target, the rate adapts to the server latency: it is halved
+    when the 95th percentile latency of the last window of requests is
+    above the target, and raised by a tenth of the initial rate when it is
+    below half of it, between min_rate and the initial rate. Failed
+    requests, timeouts included, count with the time they took.
+    """
+
+    def __init__(self, rate=None, burst=None, concurrency=None, p95_target=None,
+                 window=50, min_rate=1.0):
+        """rate: The maximum requests per second; None for no limit.
+        burst: The requests that may be sent at once after an idle period;
+               by default one second worth of requests.
+        concurrency: The maximum number of concurrent requests, either for
+                     every verb, or as a dictionary by verb.
+        p95_target: Seconds of 95th percentile latency above which the rate
+                    is lowered; None does not adapt the rate.
+        window: The number of requests over which the latency is measured.
+        min_rate: The lowest rate the adaptation goes to.
+        """
+        if p95_target is not None and rate is None:
+            raise ValueError("an adaptive governor needs an initial rate")
+        self.max_rate = rate
+        self.bucket = TokenBucket(rate, burst) if rate is not None else None
+        self.concurrency = concurrency
+        self._semaphores = dict()
+        self.p95_target = p95_target
+        self.window = window
+        self.min_rate = min_rate
+        self.latencies = deque(maxlen=window)
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        "The current requests per second limit, or None."
+        return self.bucket.rate if self.bucket is not None else None
+
+    def _semaphore(self, method):
+        limit = self.concurrency
+        if isinstance(limit, dict):
+            limit = limit.get(method)
+        if limit is None:
+            return None
+        with self._lock:
+            try:
+                return self._semaphores[method]
+            except KeyError:
+                semaphore = self._semaphores[method] = threading.BoundedSemaphore(limit)
+                return semaphore
+
+    @contextmanager
+    def slot(self, method):
+        "Context in which one request of the verb may be sent."
+        semaphore = self._semaphore(method)
+        start = time.time()
+        sent = None
+        if semaphore is not None:
+            semaphore.acquire()
+        try:
+            if self.bucket is not None:
+                self.bucket.acquire()
+            with self._lock:
+                self.waited += time.time() - start
+            sent = time.time()
+            yield
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+            # Failed requests count too: timeouts are the clearest sign of overload
+            if sent is not None:
+                self.record(time.time() - sent)
+
+    def record(self, latency):
+        "Account for the latency of a request, completed or failed."
+        if self.p95_target is None:
+            return
+        with self._lock:
+            self.latencies.append(latency)
+            if len(self.latencies) < self.window:
+                return
+            p95 = sorted(self.latencies)[int(0.95 * (len(self.latencies) - 1))]
+            bucket = self.bucket
+            if p95 > self.p95_target:
+                bucket.rate = max(self.min_rate, bucket.rate / 2)
+            elif p95 < self.p95_target / 2:
+                bucket.rate = min(self.max_rate, bucket.rate + self.max_rate / 10.0)
+            else:
+                return
+            logger.info("p95 latency %.3f s, request rate now %.1f/s", p95, bucket.rate)
+            # Measure the new rate afresh
+            self.latencies.clear()
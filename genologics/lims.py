@@ -8,10 +8,17 @@ Copyright (C) 2012 Per Kraulis
 
 __all__ = ['Lab', 'Researcher', 'Project', 'Sample',
            'Containertype', 'Container', 'Processtype', 'Process',
-           'Artifact', 'Lims']
+           'Artifact', 'Lims', 'BatchResult', 'BatchError', 'UnitOfWork', 'DownloadError']
 
+import hashlib
+import logging
 import os
 import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
 from io import BytesIO
 import requests
 
@@ -21,12 +28,21 @@ from sys import version_info
 if version_info[0] == 2:
     from urlparse import urljoin
     from urllib import urlencode
+    import Queue as queue
 else:
     from urllib.parse import urljoin
     from urllib.parse import urlencode
+    import queue
 
 
 from .entities import *
+from .transport import Transport, TIMEOUT
+from .cache import IdentityMap, CachePolicy
+from .metrics import RequestEvent, uri_template, entity_name
+from .tracing import traced
+from .xmlbackend import get_backend, iter_children
+
+logger = logging.getLogger(__name__)
 
 # Python 2.6 support work-arounds
 # - Exception ElementTree.ParseError does not exist
@@ -41,7 +57,157 @@ if version_info[:2] < (2,7):
         p26_write(self, file, encoding=encoding)
     ElementTree.ElementTree.write = write_with_xml_declaration
 
-TIMEOUT = 16
+
+class DownloadError(requests.exceptions.RequestException):
+    "A file download did not complete with the size announced by the server."
+
+
+class BatchResult(object):
+    "Outcome of a batch update: the instances saved and those that failed."
+
+    def __init__(self):
+        self.succeeded = []
+        # Tuples (instance, exception)
+        self.failed = []
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    def __repr__(self):
+        return "%s(%s succeeded, %s failed)" % (self.__class__.__name__, len(self.succeeded), len(self.failed))
+
+
+class BatchError(requests.exceptions.HTTPError):
+    """Some instances of a batch update were not saved; see the BatchResult
+    in result. The response is that of the first failure, if any."""
+
+    def __init__(self, message, result):
+        response = getattr(result.failed[0][1], 'response', None) if result.failed else None
+        super(BatchError, self).__init__(message, response=response)
+        self.result = result
+
+
+# Statuses rejecting the data of some entity of a request, rather than the
+# request as a whole like 401, 403, 404 or 429
+REJECTED_STATUS_CODES = frozenset([400, 409, 422])
+
+
+def _rejected(error):
+    "Whether the error is the rejection of the data of the request by the server."
+    response = getattr(error, 'response', None)
+    return (isinstance(error, requests.exceptions.HTTPError) and response is not None
+            and response.status_code in REJECTED_STATUS_CODES)
+
+
+def _position(out):
+    "The current position of the file object, or None if it cannot seek."
+    try:
+        if hasattr(out, 'seekable') and not out.seekable():
+            return None
+        return out.tell()
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _range_validator(headers):
+    """The validator of a response to send in If-Range: its strong ETag,
+    else its Last-Modified date, or None."""
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('Last-Modified')
+
+
+class UnitOfWork(object):
+    """Context manager recording the entities modified through their
+    descriptors or UDF dictionaries, and saving them all on exit.
+
+    Only the modifications made on the thread that entered the unit are
+    recorded. Modified instances are grouped by class. Classes with a
+    batch endpoint are saved with Lims.put_batch, the others with
+    concurrent PUTs. Nothing is saved if the block raises. The outcome of
+    all the flushes is kept in results, a dictionary of BatchResult by
+    class; BatchError is raised on exit if any instance was not saved.
+    """
+
+    def __init__(self, lims):
+        self.lims = lims
+        self.modified = []
+        self.results = {}
+        self._seen = set()
+        self._lock = threading.Lock()
+        self._previous = None
+
+    def add(self, instance):
+        "Record a modified instance. New, unsaved instances are ignored."
+        if getattr(instance, '_uri', None) is None: return
+        with self._lock:
+            if id(instance) in self._seen: return
+            self._seen.add(id(instance))
+            self.modified.append(instance)
+
+    def __enter__(self):
+        self._previous = self.lims._unit_of_work
+        self.lims._unit_of_work = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.lims._unit_of_work = self._previous
+        if exc_type is None:
+            self.flush()
+            failed = self.failed
+            if failed:
+                result = BatchResult()
+                for klass_result in self.results.values():
+                    result.succeeded.extend(klass_result.succeeded)
+                    result.failed.extend(klass_result.failed)
+                raise BatchError("Update of %s instance(s) failed: %s" % (len(failed), failed[0][1]),
+                                 result)
+
+    def __contains__(self, instance):
+        return id(instance) in self._seen
+
+    @property
+    def failed(self):
+        "List of tuples (instance, exception) for the instances not saved."
+        return [failure for result in self.results.values() for failure in result.failed]
+
+    def flush(self):
+        "Save the modified instances with the fewest requests."
+        with self._lock:
+            modified, self.modified = self.modified, []
+            self._seen = set()
+        by_class = {}
+        for instance in modified:
+            by_class.setdefault(instance.__class__, []).append(instance)
+        for klass, instances in by_class.items():
+            if klass._BATCH_UPDATE:
+                flushed = self.lims.put_batch(instances, raise_errors=False)
+            else:
+                flushed = self._put_each(instances)
+            # Keep the outcome of the earlier flushes of the unit
+            result = self.results.setdefault(klass, BatchResult())
+            result.succeeded.extend(flushed.succeeded)
+            result.failed.extend(flushed.failed)
+        return self.results
+
+    def _put_each(self, instances):
+        "Save the instances with one PUT each, concurrently."
+        result = BatchResult()
+        executor = ThreadPoolExecutor(max_workers=self.lims.BATCH_WORKERS)
+        try:
+            futures = dict((executor.submit(instance.put), instance) for instance in instances)
+            for future in as_completed(futures):
+                error = future.exception()
+                if error is None:
+                    result.succeeded.append(futures[future])
+                else:
+                    logger.error("Update of %s failed: %s", futures[future], error)
+                    result.failed.append((futures[future], error))
+        finally:
+            executor.shutdown(wait=True)
+        return result
 
 
 class Lims(object):
@@ -49,24 +215,93 @@ class Lims(object):
 
     VERSION = 'v2'
 
-    def __init__(self, baseuri, username, password, version=VERSION):
+    # Instances per batch request, and batch requests sent concurrently
+    BATCH_CHUNK_SIZE = 500
+    BATCH_WORKERS = 4
+    # Bounds for the adaptive chunk size of get_batch
+    BATCH_TARGET_SECONDS = 5.0
+    BATCH_MAX_CHUNK_SIZE = 5000
+    # Bytes read at a time by download_file
+    DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, baseuri, username, password, version=VERSION, page_read_ahead=0,
+                 transport=None, persistent_cache=None, cache=None, cache_policy=None, governor=None,
+                 circuit_breaker=None, metrics=None, tracer=None, xml_backend=None, stream_parse=False):
         """baseuri: Base URI for the GenoLogics server, excluding
                     the 'api' or version parts!
                     For example: https://genologics.scilifelab.se:8443/
         username: The account name of the user to login as.
         password: The password for the user account to login as.
         version: The optional LIMS API version, by default 'v2' 
+        page_read_ahead: The number of pages of a list resource that may be
+                    fetched in the background ahead of the page being
+                    processed. 0 (default) fetches the pages one at a time.
+        transport: The Transport sending the HTTP requests; by default
+                    one with a pool of 100 connections and no retries.
+        persistent_cache: An optional genologics.cache.PersistentCache
+                    holding entity XML across processes.
+        cache: The identity map of the entity instances, by default an
+                    unbounded genologics.cache.IdentityMap. See also
+                    genologics.cache.LRUIdentityMap. A plain dictionary,
+                    given or assigned to cache, is copied into an IdentityMap.
+        cache_policy: A genologics.cache.CachePolicy giving how long the
+                    data of each entity class is used before being
+                    revalidated; by default forever.
+        governor: A genologics.governor.Governor limiting the rate and
+                    concurrency of all the requests sent by the transport.
+        circuit_breaker: A genologics.breaker.CircuitBreaker failing the
+                    requests fast while the LIMS is unhealthy.
+        metrics: A genologics.metrics.MetricsRegistry recording the requests.
+        tracer: A genologics.tracing.Tracer recording spans of the operations.
+        xml_backend: The XML engine, 'stdlib' (default), 'lxml', or 'auto'
+                    for lxml when installed; see genologics.xmlbackend.
+        stream_parse: Parse the list pages and batch responses incrementally
+                    as they are received, keeping memory bounded for large
+                    responses. page_read_ahead then does not apply.
         """
         self.baseuri = baseuri.rstrip('/') + '/'
         self.username = username
         self.password = password
         self.VERSION = version
-        self.cache = dict()
-        # For optimization purposes, enables requests to persist connections
-        self.request_session = requests.Session()
-        # The connection pool has a default size of 10
-        self.adapter = requests.adapters.HTTPAdapter(pool_connections=100, pool_maxsize=100)
-        self.request_session.mount('http://', self.adapter)
+        self.xml = get_backend(xml_backend)
+        self.stream_parse = stream_parse
+        if cache is None:
+            cache = IdentityMap()
+        self.cache = cache
+        if cache_policy is None:
+            cache_policy = CachePolicy()
+        self.cache_policy = cache_policy
+        self.persistent_cache = persistent_cache
+        self.page_read_ahead = page_read_ahead
+        # State of the current thread: the active unit of work
+        self._local = threading.local()
+        # Tuples (ETag, Last-Modified, digest) of the entity data by URI,
+        # least recently obtained first; at most one per entity in the cache
+        self.validators = OrderedDict()
+        self._validators_lock = threading.Lock()
+        self.revalidation_stats = dict(requests=0, not_modified=0, unchanged=0)
+        # Futures of the GET requests being sent, by URI and parameters
+        self._in_flight = dict()
+        self._in_flight_lock = threading.Lock()
+        self.coalesced_requests = 0
+        # Timings of the pages fetched by the last list call
+        self.page_timings = []
+        if transport is None:
+            transport = Transport()
+        if governor is not None:
+            transport.governor = governor
+        if circuit_breaker is not None:
+            transport.circuit_breaker = circuit_breaker
+        self.transport = transport
+        self.request_session = transport.session
+        self.adapter = transport.adapter
+        # Functions called with a RequestEvent around each request
+        self.hooks = dict(before=[], after=[], error=[])
+        if metrics is not None:
+            metrics.attach(self)
+        self.tracer = None
+        if tracer is not None:
+            tracer.attach(self)
 
     def get_uri(self, *segments, **query):
         "Return the full URI given the path segments and optional query."
@@ -76,35 +311,343 @@ class Lims(object):
             url += '?' + urlencode(query)
         return url
 
-    def get(self, uri, params=dict()):
-        "GET data from the URI. Return the response XML as an ElementTree."
+    @property
+    def cache(self):
+        "The identity map of the entity instances."
+        return self._cache
+
+    @cache.setter
+    def cache(self, value):
+        # A plain dictionary, as assigned before identity maps, gets their interface
+        if not hasattr(value, 'loaded'):
+            value = IdentityMap(value)
+        self._cache = value
+
+    def add_hook(self, kind, func):
+        """Call func with the RequestEvent of every request sent: before it
+        is sent, after its response is handled, or when it fails.
+        kind: 'before', 'after' or 'error'.
+        """
+        self.hooks[kind].append(func)
+
+    def remove_hook(self, kind, func):
+        self.hooks[kind].remove(func)
+
+    @contextmanager
+    def _instrument(self, method, uri):
+        "Context of a request reported to the hooks. Yields its RequestEvent."
+        template = uri_template(uri, self.get_uri())
+        event = RequestEvent(method, uri, template, entity_name(template))
+        for hook in self.hooks['before']:
+            hook(event)
         try:
-            r = self.request_session.get(uri, params=params,
-                                         auth=(self.username, self.password),
-                                         headers=dict(accept='application/xml'),
-                                         timeout=TIMEOUT)
-        except requests.exceptions.Timeout as e:
-            raise type(e)("{0}, Error trying to reach {1}".format(e.message, uri))
-
+            yield event
+        except Exception as e:
+            event.error = e
+            if event.network_time is None:
+                event.network_time = time.time() - event.start
+            for hook in self.hooks['error']:
+                hook(event)
+            raise
+        for hook in self.hooks['after']:
+            hook(event)
+
+    def get(self, uri, params=dict(), current=None):
+        """GET data from the URI. Return the response XML as an ElementTree.
+        current: The root previously obtained from the URI, unmodified
+                 since. The request is then conditional on the ETag or
+                 Last-Modified validators of that response, and current is
+                 returned without parsing if the data has not changed.
+        Concurrent identical calls share a single request and its root.
+        """
+        key = (uri, repr(sorted(params.items())), id(current) if current is not None else None)
+        with self._in_flight_lock:
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = Future()
+            else:
+                self.coalesced_requests += 1
+        if not leader:
+            return call.result()
+        try:
+            root = self._get(uri, params=params, current=current)
+        except BaseException as e:
+            call.set_exception(e)
+            raise
         else:
-            return self.parse_response(r)
+            call.set_result(root)
+            return root
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[key]
+
+    def _get(self, uri, params=dict(), current=None):
+        "Send the GET request for get."
+        headers = dict(accept='application/xml')
+        validators = None
+        if current is not None and not params:
+            with self._validators_lock:
+                validators = self.validators.get(uri)
+        if validators:
+            etag, last_modified, digest = validators
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+            self._count_revalidation('requests')
+        with self._instrument('GET', uri) as event:
+            try:
+                r = self.transport.request('GET', uri, params=params,
+                                           auth=(self.username, self.password),
+                                           headers=headers)
+            except requests.exceptions.Timeout as e:
+                raise type(e)("{0}, Error trying to reach {1}".format(e, uri))
+            event.response(r)
+
+            if validators and r.status_code == 304:
+                self._count_revalidation('not_modified')
+                return current
+            if not params and uri in self.cache:
+                # Keep the validators of entity data, with a digest of the
+                # content for servers that send neither ETag nor Last-Modified
+                self.validate_response(r)
+                digest = self._digest(r.content)
+                self._keep_validators(uri, (r.headers.get('ETag'), r.headers.get('Last-Modified'), digest))
+                if validators and digest == validators[2]:
+                    self._count_revalidation('unchanged')
+                    return current
+            with event.parsing():
+                return self.parse_response(r)
+
+    def get_root(self, instance, current=None, force=False):
+        """Return the XML data of the entity instance as an ElementTree,
+        from the persistent cache if it has a fresh copy, else from the LIMS.
+        current: The root the instance already has, see get.
+        force: Do not use the persistent cache.
+        """
+        cache = self.persistent_cache
+        klass = instance.__class__.__name__
+        if cache is not None and current is None and not force:
+            data = cache.get(instance.uri, klass)
+            if data is not None:
+                return self.xml.fromstring(data)
+        root = self.get(instance.uri, current=current)
+        if cache is not None and root is not current and cache.caches(klass):
+            cache.put(instance.uri, klass, self.tostring(ElementTree.ElementTree(root)))
+        return root
 
-    def get_file_contents(self, id=None, uri=None):
-        """Returns the contents of the file of <ID> or <uri>"""
+    def _keep_validators(self, uri, validators):
+        "Record the validators of the entity data, bounded by the size of the cache."
+        with self._validators_lock:
+            self.validators.pop(uri, None)
+            self.validators[uri] = validators
+            while len(self.validators) > max(len(self.cache), 1):
+                self.validators.popitem(last=False)
+
+    def discard_validators(self, uri):
+        "Forget the validators of the entity data at the URI, e.g. once released."
+        with self._validators_lock:
+            self.validators.pop(uri, None)
+
+    def _count_revalidation(self, key):
+        with self._validators_lock:
+            self.revalidation_stats[key] += 1
+
+    def _digest(self, content):
+        "Return a digest of the response content."
+        if not isinstance(content, bytes):
+            content = content.encode('utf-8')
+        return hashlib.sha1(content).hexdigest()
+
+    @property
+    def revalidation_hit_rate(self):
+        "Fraction of the conditional GETs for which the cached root was reused."
+        stats = self.revalidation_stats
+        if not stats['requests']:
+            return 0.0
+        return float(stats['not_modified'] + stats['unchanged']) / stats['requests']
+
+    def _file_url(self, id=None, uri=None):
+        "Return the download URL of the file of <ID> or <uri>."
         if id:
             segments = ['api', self.VERSION, 'files', id, 'download']
         elif uri:
             segments = [uri, 'download']
         else:
             raise ValueError("id or uri required")
-        url = urljoin(self.baseuri, '/'.join(segments))
-        r = self.request_session.get(url, auth=(self.username, self.password), timeout=TIMEOUT, stream=True)
-        self.validate_response(r)
+        return urljoin(self.baseuri, '/'.join(segments))
+
+    @traced
+    def get_file_contents(self, id=None, uri=None):
+        """Returns the contents of the file of <ID> or <uri>: the text for
+        text content types, else the raw response stream.
+        See download_file for large files."""
+        url = self._file_url(id=id, uri=uri)
+        with self._instrument('GET', url) as event:
+            r = self.transport.request('GET', url, auth=(self.username, self.password), stream=True)
+            event.response(r, stream=True)
+            self.validate_response(r)
         if 'text' in r.headers['Content-Type']:
             return r.text
         else:
             return r.raw
 
+    @traced
+    def download_file(self, destination, id=None, uri=None, chunk_size=None, retries=3):
+        """Download the content of the file of <ID> or <uri> to the
+        destination, a path or a file object opened for binary writing,
+        chunk_size bytes at a time (by default DOWNLOAD_CHUNK_SIZE).
+        Return the size of the content.
+
+        An interrupted download is resumed with an HTTP Range request, at
+        most retries times, and its size is checked against the one given
+        by the server; DownloadError is raised if they differ. A resumed
+        request sends the ETag or Last-Modified date of the first response
+        in If-Range, so that content changed since is downloaded again from
+        the start. A path is written as <path>.part, renamed once complete;
+        the validator is kept in <path>.part.validator so that the .part
+        file left by an interrupted call is resumed, or restarted when its
+        validator is unknown. A file object is written from its current
+        position; restarting truncates it back to that position, and raises
+        DownloadError if it cannot seek.
+        """
+        url = self._file_url(id=id, uri=uri)
+        chunk_size = chunk_size or self.DOWNLOAD_CHUNK_SIZE
+        if hasattr(destination, 'write'):
+            return self._download(url, destination, chunk_size, retries, start=_position(destination))
+        partial = destination + '.part'
+        validator_path = partial + '.validator'
+        validator = None
+        if os.path.exists(validator_path):
+            with open(validator_path) as f:
+                validator = f.read() or None
+
+        def remember(value):
+            with open(validator_path, 'w') as f:
+                f.write(value or '')
+
+        with open(partial, 'ab') as out:
+            size = self._download(url, out, chunk_size, retries, offset=out.tell(),
+                                  validator=validator, remember=remember)
+        os.rename(partial, destination)
+        os.remove(validator_path)
+        return size
+
+    def _download(self, url, out, chunk_size, retries, offset=0, validator=None, remember=None, start=0):
+        """Write the content at the URL to the file object, which holds
+        offset bytes of the content with the given validator already.
+        remember: Function called with the validator of the content when
+                  it is downloaded from the start.
+        start: The position of the file object where the content begins,
+               or None if it cannot seek; the download cannot restart then.
+        """
+        state = dict(written=offset, validator=validator, remember=remember, start=start)
+        attempt = 0
+        while True:
+            try:
+                total = self._download_part(url, out, chunk_size, state)
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout) as e:
+                error = e
+            else:
+                written = state['written']
+                if total is None or written == total:
+                    return written
+                if written > total:
+                    raise DownloadError("Download of %s gave %s bytes, expected %s" % (url, written, total))
+                error = DownloadError("Download of %s stopped at %s of %s bytes" % (url, written, total))
+            if attempt >= retries:
+                raise error
+            delay = self.transport.backoff(attempt)
+            logger.info("Resuming download of %s at %s bytes in %.2f seconds", url, state['written'], delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def _download_part(self, url, out, chunk_size, state):
+        """Send one GET of the download, appending the content received to
+        the file object. state holds the size written so far and the
+        validator of the content, and is kept up to date as it is received.
+        Return the total size expected, or None if unknown."""
+        written = state['written']
+        headers = {'Accept-Encoding': 'identity'}
+        if written and state['validator']:
+            # Resume, unless the content changed since
+            headers['Range'] = 'bytes=%s-' % written
+            headers['If-Range'] = state['validator']
+        with self._instrument('GET', url) as event:
+            r = self.transport.request('GET', url, auth=(self.username, self.password),
+                                       headers=headers, stream=True)
+            event.response(r, stream=True)
+            try:
+                if r.status_code == 416 and 'Range' in headers:
+                    # Complete already
+                    total = r.headers.get('Content-Range', '').split('/')[-1]
+                    if total.isdigit() and int(total) == written:
+                        return written
+                self.validate_response(r, accept_status_codes=[200, 206])
+                length = r.headers.get('Content-Length')
+                total = int(length) if length and length.isdigit() else None
+                if r.status_code == 206:
+                    content_range = r.headers.get('Content-Range', '')
+                    match = re.match(r'bytes (\d+)-\d+/(\d+)', content_range)
+                    if match is None or int(match.group(1)) != written:
+                        raise DownloadError("Unexpected range %s for %s" % (content_range, url))
+                    total = int(match.group(2))
+                else:
+                    if written:
+                        # Not resumed, or the server ignored the range: start again
+                        if state['start'] is None:
+                            raise DownloadError("Download of %s cannot restart: the file object cannot seek"
+                                                % url)
+                        out.seek(state['start'])
+                        out.truncate()
+                        written = state['written'] = 0
+                    state['validator'] = _range_validator(r.headers)
+                    if state['remember'] is not None:
+                        state['remember'](state['validator'])
+                start = written
+                try:
+                    for chunk in r.iter_content(chunk_size):
+                        out.write(chunk)
+                        written += len(chunk)
+                        state['written'] = written
+                finally:
+                    event.bytes = event.wire_bytes = written - start
+            finally:
+                r.close()
+        return total
+
+    @traced
+    def download_files(self, files, directory, chunk_size=None, retries=3, max_workers=None):
+        """Download the content of the File instances into the directory,
+        max_workers at a time (by default BATCH_WORKERS), see download_file.
+        Each is written as <file id>_<name of its original location>.
+        Return a BatchResult of the files downloaded and those that failed.
+        """
+        result = BatchResult()
+        max_workers = max_workers or self.BATCH_WORKERS
+
+        def download(file):
+            name = os.path.basename(file.original_location or '')
+            path = os.path.join(directory, '%s_%s' % (file.id, name) if name else file.id)
+            self.download_file(path, id=file.id, chunk_size=chunk_size, retries=retries)
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            futures = dict((executor.submit(download, file), file) for file in files)
+            for future in as_completed(futures):
+                error = future.exception()
+                if error is None:
+                    result.succeeded.append(futures[future])
+                else:
+                    logger.error("Download of %s failed: %s", futures[future], error)
+                    result.failed.append((futures[future], error))
+        finally:
+            executor.shutdown(wait=True)
+        return result
+
+    @traced
     def upload_new_file(self, entity, file_to_upload):
         """Upload a file and attach it to the provided entity."""
         file_to_upload = os.path.abspath(file_to_upload)
@@ -132,54 +675,101 @@ class Lims(object):
 
         # Actually upload the file
         uri = self.get_uri('files', file.id, 'upload')
-        r = requests.post(uri, files={'file': (file_to_upload, open(file_to_upload, 'rb'))},
-                          auth=(self.username, self.password))
-        self.validate_response(r)
+        with self._instrument('POST', uri) as event, open(file_to_upload, 'rb') as f:
+            r = self.transport.request('POST', uri, files={'file': (file_to_upload, f)},
+                                       auth=(self.username, self.password))
+            event.response(r)
+            self.validate_response(r)
         return file
 
     def put(self, uri, data, params=dict()):
         """PUT the serialized XML to the given URI.
         Return the response XML as an ElementTree.
         """
-        r = requests.put(uri, data=data, params=params,
-                         auth=(self.username, self.password),
-                         headers={'content-type': 'application/xml',
-                                  'accept': 'application/xml'})
-        return self.parse_response(r)
-
-    def post(self, uri, data, params=dict()):
+        if self.persistent_cache is not None:
+            self.persistent_cache.discard(uri)
+        with self._instrument('PUT', uri) as event:
+            r = self.transport.request('PUT', uri, data=data, params=params,
+                                       auth=(self.username, self.password),
+                                       headers={'content-type': 'application/xml',
+                                                'accept': 'application/xml'})
+            event.response(r, data=data)
+            with event.parsing():
+                return self.parse_response(r)
+
+    def post(self, uri, data, params=dict(), idempotent=False, compress=False):
         """POST the serialized XML to the given URI.
         Return the response XML as an ElementTree.
+        idempotent: Whether the POST may be retried, e.g. a batch retrieve.
+        compress: Whether the data may be gzipped, see Transport.
         """
-        r = requests.post(uri, data=data, params=params,
-                          auth=(self.username, self.password),
-                          headers={'content-type': 'application/xml',
-                                   'accept': 'application/xml'})
-        return self.parse_response(r, accept_status_codes=[200, 201, 202])
+        with self._instrument('POST', uri) as event:
+            r = self.transport.request('POST', uri, data=data, params=params,
+                                       idempotent=idempotent, compress=compress,
+                                       auth=(self.username, self.password),
+                                       headers={'content-type': 'application/xml',
+                                                'accept': 'application/xml'})
+            event.response(r, data=data)
+            with event.parsing():
+                return self.parse_response(r, accept_status_codes=[200, 201, 202])
 
     def delete(self, uri, params=dict()):
         """sends a DELETE to the given URI.
         Return the response XML as an ElementTree.
         """
-        r = requests.delete(uri, params=params,
-                          auth=(self.username, self.password),
-                          headers={'content-type': 'application/xml',
-                                   'accept': 'application/xml'})
-        return self.validate_response(r, accept_status_codes=[204])
-
+        if self.persistent_cache is not None:
+            self.persistent_cache.discard(uri)
+        with self._instrument('DELETE', uri) as event:
+            r = self.transport.request('DELETE', uri, params=params,
+                                       auth=(self.username, self.password),
+                                       headers={'content-type': 'application/xml',
+                                                'accept': 'application/xml'})
+            event.response(r)
+            return self.validate_response(r, accept_status_codes=[204])
+
+    @traced
     def check_version(self):
         """Raise ValueError if the version for this interface
         does not match any of the versions given for the API.
         """
         uri = urljoin(self.baseuri, 'api')
-        r = requests.get(uri, auth=(self.username, self.password))
-        root = self.parse_response(r)
+        with self._instrument('GET', uri) as event:
+            r = self.transport.request('GET', uri, auth=(self.username, self.password))
+            event.response(r)
+            with event.parsing():
+                root = self.parse_response(r)
         tag = nsmap('ver:versions')
         assert tag == root.tag
         for node in root.findall('version'):
             if node.attrib['major'] == self.VERSION: return
         raise ValueError('version mismatch')
 
+    def _iterparse(self, method, uri, accept_status_codes=[200], **kwargs):
+        """Send the request and yield each child of the root element of the
+        response XML as soon as it is parsed, see xmlbackend.iter_children.
+        The response body is read as the children are consumed."""
+        with self._instrument(method, uri) as event:
+            r = self.transport.request(method, uri, auth=(self.username, self.password),
+                                       stream=True, **kwargs)
+            event.response(r, stream=True, data=kwargs.get('data'))
+            self.validate_response(r, accept_status_codes)
+            if hasattr(r.raw, 'decode_content'):
+                # Undo any Content-Encoding while reading
+                r.raw.decode_content = True
+            try:
+                children = iter_children(self.xml, event.reading(r))
+                while True:
+                    with event.parsing():
+                        node = next(children, None)
+                    if node is None: break
+                    try:
+                        yield node
+                    except GeneratorExit:
+                        # The caller stopped early
+                        return
+            finally:
+                r.close()
+
     def validate_response(self, response, accept_status_codes=[200]):
         """Parse the XML returned in the response.
         Raise an HTTP error if the response status is not one of the
@@ -187,7 +777,7 @@ class Lims(object):
         """
         if response.status_code not in accept_status_codes:
             try:
-                root = ElementTree.fromstring(response.content)
+                root = self.xml.fromstring(response.content)
                 node = root.find('message')
                 if node is None:
                     response.raise_for_status()
@@ -197,9 +787,9 @@ class Lims(object):
                 node = root.find('suggested-actions')
                 if node is not None:
                     message += ' ' + node.text
-            except ElementTree.ParseError:  # some error messages might not follow the xml standard
+            except self.xml.ParseError:  # some error messages might not follow the xml standard
                 message = response.content
-            raise requests.exceptions.HTTPError(message)
+            raise requests.exceptions.HTTPError(message, response=response)
         return True
 
     def parse_response(self, response, accept_status_codes=[200]):
@@ -207,10 +797,35 @@ class Lims(object):
         Raise an HTTP error if the response status is not 200.
         """
         self.validate_response(response, accept_status_codes)
-        root = ElementTree.fromstring(response.content)
+        root = self.xml.fromstring(response.content)
         return root
 
-    def get_udfs(self, name=None, attach_to_name=None, attach_to_category=None, start_index=None, add_info=False):
+    def unit_of_work(self):
+        """Return a UnitOfWork context manager; the entities modified within
+        the with block are saved with batched requests when it exits.
+
+        with lims.unit_of_work():
+            for artifact in artifacts:
+                artifact.udf['Concentration'] = 1.5
+        """
+        return UnitOfWork(self)
+
+    @property
+    def _unit_of_work(self):
+        "The unit of work active on the current thread, if any."
+        return getattr(self._local, 'unit_of_work', None)
+
+    @_unit_of_work.setter
+    def _unit_of_work(self, unit):
+        self._local.unit_of_work = unit
+
+    def _modified(self, instance):
+        "Record a modified instance with the active unit of work, if any."
+        if self._unit_of_work is not None:
+            self._unit_of_work.add(instance)
+
+    @traced
+    def get_udfs(self, name=None, attach_to_name=None, attach_to_category=None, start_index=None, add_info=False, stream=False):
         """Get a list of udfs, filtered by keyword arguments.
         name: name of udf
         attach_to_name: item in the system, to wich the udf is attached, such as 
@@ -218,24 +833,28 @@ class Lims(object):
         attach_to_category: If 'attach_to_name' is the name of a process, such as 'CaliperGX QC (DNA)',
              then you need to set attach_to_category='ProcessType'. Must not be provided otherwise.
         start_index: Page to retrieve; all if None.
+        stream: Return a generator yielding the instances page by page.
         """
         params = self._get_params(name=name,
                                   attach_to_name=attach_to_name,
                                   attach_to_category=attach_to_category,
                                   start_index=start_index)
-        return self._get_instances(Udfconfig, add_info=add_info, params=params)
+        return self._get_instances(Udfconfig, add_info=add_info, params=params, stream=stream)
 
-    def get_reagent_types(self, name=None, start_index=None):
+    @traced
+    def get_reagent_types(self, name=None, start_index=None, stream=False):
         """Get a list of reqgent types, filtered by keyword arguments.
         name: reagent type  name, or list of names.
         start_index: Page to retrieve; all if None.
+        stream: Return a generator yielding the instances page by page.
         """
         params = self._get_params(name=name,
                                   start_index=start_index)
-        return self._get_instances(ReagentType, params=params)
+        return self._get_instances(ReagentType, params=params, stream=stream)
 
+    @traced
     def get_labs(self, name=None, last_modified=None,
-                 udf=dict(), udtname=None, udt=dict(), start_index=None, add_info=False):
+                 udf=dict(), udtname=None, udt=dict(), start_index=None, add_info=False, stream=False):
         """Get a list of labs, filtered by keyword arguments.
         name: Lab name, or list of names.
         last_modified: Since the given ISO format datetime.
@@ -244,17 +863,19 @@ class Lims(object):
         udt: dictionary of UDT UDFs with 'UDTNAME.UDFNAME[OPERATOR]' as keys
              and a string or list of strings as value.
         start_index: Page to retrieve; all if None.
+        stream: Return a generator yielding the instances page by page.
         """
         params = self._get_params(name=name,
                                   last_modified=last_modified,
                                   start_index=start_index)
         params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
-        return self._get_instances(Lab, add_info=add_info, params=params)
+        return self._get_instances(Lab, add_info=add_info, params=params, stream=stream)
 
+    @traced
     def get_researchers(self, firstname=None, lastname=None, username=None,
                         last_modified=None,
                         udf=dict(), udtname=None, udt=dict(), start_index=None,
-                        add_info=False):
+                        add_info=False, stream=False):
         """Get a list of researchers, filtered by keyword arguments.
         firstname: Researcher first name, or list of names.
         lastname: Researcher last name, or list of names.
@@ -265,6 +886,7 @@ class Lims(object):
         udt: dictionary of UDT UDFs with 'UDTNAME.UDFNAME[OPERATOR]' as keys
              and a string or list of strings as value.
         start_index: Page to retrieve; all if None.
+        stream: Return a generator yielding the instances page by page.
         """
         params = self._get_params(firstname=firstname,
                                   lastname=lastname,
@@ -272,11 +894,12 @@ class Lims(object):
                                   last_modified=last_modified,
                                   start_index=start_index)
         params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
-        return self._get_instances(Researcher, add_info=add_info, params=params)
+        return self._get_instances(Researcher, add_info=add_info, params=params, stream=stream)
 
+    @traced
     def get_projects(self, name=None, open_date=None, last_modified=None,
                      udf=dict(), udtname=None, udt=dict(), start_index=None,
-                     add_info=False):
+                     add_info=False, stream=False):
         """Get a list of projects, filtered by keyword arguments.
         name: Project name, or list of names.
         open_date: Since the given ISO format date.
@@ -286,14 +909,16 @@ class Lims(object):
         udt: dictionary of UDT UDFs with 'UDTNAME.UDFNAME[OPERATOR]' as keys
              and a string or list of strings as value.
         start_index: Page to retrieve; all if None.
+        stream: Return a generator yielding the instances page by page.
         """
         params = self._get_params(name=name,
                                   open_date=open_date,
                                   last_modified=last_modified,
                                   start_index=start_index)
         params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
-        return self._get_instances(Project, add_info=add_info, params=params)
+        return self._get_instances(Project, add_info=add_info, params=params, stream=stream)
 
+    @traced
     def get_sample_number(self, name=None, projectname=None, projectlimsid=None,
                           udf=dict(), udtname=None, udt=dict(), start_index=None):
         """Gets the number of samples matching the query without fetching every
@@ -303,17 +928,14 @@ class Lims(object):
                                   projectlimsid=projectlimsid,
                                   start_index=start_index)
         params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
-        root = self.get(self.get_uri(Sample._URI), params=params)
         total = 0
-        while params.get('start-index') is None:  # Loop over all pages.
+        for root in self._get_pages(self.get_uri(Sample._URI), params=params):
             total += len(root.findall("sample"))
-            node = root.find('next-page')
-            if node is None: break
-            root = self.get(node.attrib['uri'], params=params)
         return total
 
+    @traced
     def get_samples(self, name=None, projectname=None, projectlimsid=None,
-                    udf=dict(), udtname=None, udt=dict(), start_index=None):
+                    udf=dict(), udtname=None, udt=dict(), start_index=None, stream=False):
         """Get a list of samples, filtered by keyword arguments.
         name: Sample name, or list of names.
         projectlimsid: Samples for the project of the given LIMS id.
@@ -323,20 +945,22 @@ class Lims(object):
         udt: dictionary of UDT UDFs with 'UDTNAME.UDFNAME[OPERATOR]' as keys
              and a string or list of strings as value.
         start_index: Page to retrieve; all if None.
+        stream: Return a generator yielding the instances page by page.
         """
         params = self._get_params(name=name,
                                   projectname=projectname,
                                   projectlimsid=projectlimsid,
                                   start_index=start_index)
         params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
-        return self._get_instances(Sample, params=params)
+        return self._get_instances(Sample, params=params, stream=stream)
 
+    @traced
     def get_artifacts(self, name=None, type=None, process_type=None,
                       artifact_flag_name=None, working_flag=None, qc_flag=None,
                       sample_name=None, samplelimsid=None, artifactgroup=None, containername=None,
                       containerlimsid=None, reagent_label=None,
                       udf=dict(), udtname=None, udt=dict(), start_index=None,
-                      resolve=False):
+                      resolve=False, stream=False):
         """Get a list of artifacts, filtered by keyword arguments.
         name: Artifact name, or list of names.
         type: Artifact type, or list of types.
@@ -355,6 +979,8 @@ class Lims(object):
         udt: dictionary of UDT UDFs with 'UDTNAME.UDFNAME[OPERATOR]' as keys
              and a string or list of strings as value.
         start_index: Page to retrieve; all if None.
+        resolve: Fetch the XML data of the artifacts using batch calls.
+        stream: Return a generator yielding the instances page by page.
         """
         params = self._get_params(name=name,
                                   type=type,
@@ -370,22 +996,30 @@ class Lims(object):
                                   reagent_label=reagent_label,
                                   start_index=start_index)
         params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
+        if stream:
+            instances = self._get_instances(Artifact, params=params, stream=True)
+            if resolve:
+                return self._iter_resolved(instances)
+            return instances
         if resolve:
             return self.get_batch(self._get_instances(Artifact, params=params))
         else:
             return self._get_instances(Artifact, params=params)
 
-    def get_container_types(self, name=None, start_index=None):
+    @traced
+    def get_container_types(self, name=None, start_index=None, stream=False):
         """Get a list of container types, filtered by keyword arguments.
         name: Container Type name.
-        start-index: Page to retrieve, all if None."""
+        start-index: Page to retrieve, all if None.
+        stream: Return a generator yielding the instances page by page."""
         params = self._get_params(name=name, start_index=start_index)
-        return self._get_instances(Containertype, params=params)
+        return self._get_instances(Containertype, params=params, stream=stream)
 
+    @traced
     def get_containers(self, name=None, type=None,
                        state=None, last_modified=None,
                        udf=dict(), udtname=None, udt=dict(), start_index=None,
-                       add_info=False):
+                       add_info=False, stream=False):
         """Get a list of containers, filtered by keyword arguments.
         name: Containers name, or list of names.
         type: Container type, or list of types.
@@ -396,6 +1030,7 @@ class Lims(object):
         udt: dictionary of UDT UDFs with 'UDTNAME.UDFNAME[OPERATOR]' as keys
              and a string or list of strings as value.
         start_index: Page to retrieve; all if None.
+        stream: Return a generator yielding the instances page by page.
         """
         params = self._get_params(name=name,
                                   type=type,
@@ -403,12 +1038,13 @@ class Lims(object):
                                   last_modified=last_modified,
                                   start_index=start_index)
         params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
-        return self._get_instances(Container, add_info=add_info, params=params)
+        return self._get_instances(Container, add_info=add_info, params=params, stream=stream)
 
+    @traced
     def get_processes(self, last_modified=None, type=None,
                       inputartifactlimsid=None,
                       techfirstname=None, techlastname=None, projectname=None,
-                      udf=dict(), udtname=None, udt=dict(), start_index=None):
+                      udf=dict(), udtname=None, udt=dict(), start_index=None, stream=False):
         """Get a list of processes, filtered by keyword arguments.
         last_modified: Since the given ISO format datetime.
         type: Process type, or list of types.
@@ -421,6 +1057,7 @@ class Lims(object):
         techlastname: Last name of researcher, or list of.
         projectname: Name of project, or list of.
         start_index: Page to retrieve; all if None.
+        stream: Return a generator yielding the instances page by page.
         """
         params = self._get_params(last_modified=last_modified,
                                   type=type,
@@ -430,52 +1067,61 @@ class Lims(object):
                                   projectname=projectname,
                                   start_index=start_index)
         params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
-        return self._get_instances(Process, params=params)
+        return self._get_instances(Process, params=params, stream=stream)
 
-    def get_workflows(self, name=None, add_info=False):
+    @traced
+    def get_workflows(self, name=None, add_info=False, stream=False):
         """Get the list of existing workflows on the system """
         params = self._get_params(name=name)
-        return self._get_instances(Workflow, add_info=add_info, params=params)
+        return self._get_instances(Workflow, add_info=add_info, params=params, stream=stream)
 
-    def get_process_types(self, displayname=None, add_info=False):
+    @traced
+    def get_process_types(self, displayname=None, add_info=False, stream=False):
         """Get a list of process types with the specified name."""
         params = self._get_params(displayname=displayname)
-        return self._get_instances(Processtype, add_info=add_info, params=params)
+        return self._get_instances(Processtype, add_info=add_info, params=params, stream=stream)
 
-    def get_reagent_types(self, name=None, add_info=False):
+    @traced
+    def get_reagent_types(self, name=None, add_info=False, stream=False):
         params = self._get_params(name=name)
-        return self._get_instances(ReagentType, add_info=add_info, params=params)
+        return self._get_instances(ReagentType, add_info=add_info, params=params, stream=stream)
 
-    def get_protocols(self, name=None, add_info=False):
+    @traced
+    def get_protocols(self, name=None, add_info=False, stream=False):
         """Get the list of existing protocols on the system """
         params = self._get_params(name=name)
-        return self._get_instances(Protocol, add_info=add_info, params=params)
+        return self._get_instances(Protocol, add_info=add_info, params=params, stream=stream)
 
-    def get_reagent_kits(self, name=None, start_index=None, add_info=False):
+    @traced
+    def get_reagent_kits(self, name=None, start_index=None, add_info=False, stream=False):
         """Get a list of reagent kits, filtered by keyword arguments.
         name: reagent kit  name, or list of names.
         start_index: Page to retrieve; all if None.
+        stream: Return a generator yielding the instances page by page.
         """
         params = self._get_params(name=name,
                                   start_index=start_index)
-        return self._get_instances(ReagentKit, add_info=add_info, params=params)
+        return self._get_instances(ReagentKit, add_info=add_info, params=params, stream=stream)
 
+    @traced
     def get_reagent_lots(self, name=None, kitname=None, number=None,
-                         start_index=None):
+                         start_index=None, stream=False):
         """Get a list of reagent lots, filtered by keyword arguments.
         name: reagent kit  name, or list of names.
         kitname: name of the kit this lots belong to
         number: lot number or list of lot number
         start_index: Page to retrieve; all if None.
+        stream: Return a generator yielding the instances page by page.
         """
         params = self._get_params(name=name, kitname=kitname, number=number,
                                   start_index=start_index)
-        return self._get_instances(ReagentLot, params=params)
+        return self._get_instances(ReagentLot, params=params, stream=stream)
 
-    def get_instruments(self, name=None):
+    @traced
+    def get_instruments(self, name=None, stream=False):
         """Returns a list of Instruments, can be filtered by name"""
         params = self._get_params(name=name)
-        return self._get_instances(Instrument, params=params)
+        return self._get_instances(Instrument, params=params, stream=stream)
 
     def _get_params(self, **kwargs):
         "Convert keyword arguments to a kwargs dictionary."
@@ -496,31 +1142,149 @@ class Lims(object):
             result["udt.%s" % key] = value
         return result
 
-    def _get_instances(self, klass, add_info=None, params=dict()):
-        results = []
-        additionnal_info_dicts = []
-        tag = klass._TAG
-        if tag is None:
-            tag = klass.__name__.lower()
-        root = self.get(self.get_uri(klass._URI), params=params)
-        while params.get('start-index') is None:  # Loop over all pages.
-            for node in root.findall(tag):
-                results.append(klass(self, uri=node.attrib['uri']))
-                info_dict = {}
-                for attrib_key in node.attrib:
-                    info_dict[attrib_key] = node.attrib['uri']
-                for subnode in node:
-                    info_dict[subnode.tag] = subnode.text
-                additionnal_info_dicts.append(info_dict)
+    def _get_pages(self, uri, params=dict()):
+        """Yield the root of each page of the list resource at the URI,
+        following the next-page links. Only the first page is returned
+        if a start-index is given in the params.
+
+        If page_read_ahead is set, the following pages are fetched in a
+        background thread while the caller processes the current one.
+        The timings of each page are recorded in page_timings:
+          fetch: seconds spent in the GET, including parsing.
+          wait: seconds the caller was blocked waiting for the page.
+          process: seconds the caller spent on the page.
+        """
+        self.page_timings = []
+        pages = self._fetch_pages(uri, params)
+        if self.page_read_ahead > 0:
+            pages = self._read_ahead(pages, self.page_read_ahead)
+        start = time.time()
+        for root, timing in pages:
+            timing['wait'] = time.time() - start
+            timing['process'] = None
+            self.page_timings.append(timing)
+            start = time.time()
+            yield root
+            timing['process'] = time.time() - start
+            start = time.time()
+
+    def _fetch_pages(self, uri, params):
+        "Yield each page root with its timing, one GET at a time."
+        while True:
+            start = time.time()
+            root = self.get(uri, params=params)
+            yield root, dict(uri=uri, fetch=time.time() - start)
+            if params.get('start-index') is not None: break
             node = root.find('next-page')
             if node is None: break
-            root = self.get(node.attrib['uri'], params=params)
+            uri = node.attrib['uri']
+
+    def _read_ahead(self, pages, depth):
+        """Consume the pages iterator in a background thread, keeping
+        at most depth pages waiting to be processed."""
+        pending = queue.Queue(maxsize=depth)
+        done = threading.Event()
+        end = object()
+
+        def put(item):
+            # Give up once the caller has stopped consuming
+            while not done.is_set():
+                try:
+                    pending.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for page in pages:
+                    if not put((page, None)): return
+            except Exception as e:
+                put((None, e))
+                return
+            put((end, None))
+
+        thread = threading.Thread(target=produce)
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                page, error = pending.get()
+                if error is not None: raise error
+                if page is end: break
+                yield page
+        finally:
+            done.set()
+
+    def _get_instances(self, klass, add_info=None, params=dict(), stream=False):
+        instances = self._iter_instances(klass, add_info=add_info, params=params)
+        if stream:
+            return instances
         if add_info:
+            results = []
+            additionnal_info_dicts = []
+            for instance, info_dict in instances:
+                results.append(instance)
+                additionnal_info_dicts.append(info_dict)
             return results, additionnal_info_dicts
         else:
-            return results
+            return list(instances)
 
-    def get_batch(self, instances, force=False):
+    def _iter_instances(self, klass, add_info=None, params=dict()):
+        """Yield the instances of the list resource for the class, one page
+        at a time. With add_info, yield tuples (instance, info_dict).
+        """
+        tag = klass._TAG
+        if tag is None:
+            tag = klass.__name__.lower()
+        if self.stream_parse:
+            nodes = self._stream_pages(self.get_uri(klass._URI), params)
+        else:
+            nodes = (node for root in self._get_pages(self.get_uri(klass._URI), params=params)
+                     for node in root.findall(tag))
+        for node in nodes:
+            if node.tag == tag:
+                instance = klass(self, uri=node.attrib['uri'])
+                if add_info:
+                    info_dict = {}
+                    for attrib_key in node.attrib:
+                        info_dict[attrib_key] = node.attrib['uri']
+                    for subnode in node:
+                        info_dict[subnode.tag] = subnode.text
+                    yield instance, info_dict
+                else:
+                    yield instance
+
+    def _stream_pages(self, uri, params):
+        """Yield the elements of each page of the list resource at the URI
+        as they are parsed, following the next-page links as _get_pages."""
+        while True:
+            next_page = None
+            for node in self._iterparse('GET', uri, params=params, headers=dict(accept='application/xml')):
+                if node.tag == 'next-page':
+                    next_page = node.attrib['uri']
+                else:
+                    yield node
+            if params.get('start-index') is not None or next_page is None: break
+            uri = next_page
+
+    def _iter_resolved(self, instances, chunk_size=None):
+        """Yield the instances, fetching their XML with one batch call per
+        chunk of chunk_size, by default BATCH_CHUNK_SIZE."""
+        chunk_size = chunk_size or self.BATCH_CHUNK_SIZE
+        chunk = []
+        for instance in instances:
+            chunk.append(instance)
+            if len(chunk) >= chunk_size:
+                for resolved in self.get_batch(chunk):
+                    yield resolved
+                chunk = []
+        for resolved in self.get_batch(chunk):
+            yield resolved
+
+    @traced
+    def get_batch(self, instances, force=False, chunk_size=None, max_workers=None, adaptive=False):
         """Get the content of a set of instances using the efficient batch call.
 
         Returns the list of requested instances in arbitrary order, with duplicates removed
@@ -535,50 +1299,152 @@ class Lims(object):
         The batch request API call collapses all requested Artifacts with different
         state into a single result with state equal to the state of the Artifact
         occurring at the last position in the list.
+
+        The instances are requested in chunks of chunk_size, max_workers
+        chunks at a time, and the XML data is attached to the instances as
+        each chunk completes, or as each one is parsed with stream_parse.
+        With adaptive, the size of the following chunks is adjusted to aim
+        for BATCH_TARGET_SECONDS per request.
+        Defaults are taken from BATCH_CHUNK_SIZE and BATCH_WORKERS.
         """
         if not instances:
             return []
-        root = ElementTree.Element(nsmap('ri:links'))
-        needs_request = False
         instance_map = {}
         for instance in instances:
             instance_map[instance.id] = instance
-            if force or instance.root is None:
-                ElementTree.SubElement(root, 'link', dict(uri=instance.uri,
-                                                          rel=instance.__class__._URI))
-                needs_request = True
-
-        if needs_request:
-            uri = self.get_uri(instance.__class__._URI, 'batch/retrieve')
-            data = self.tostring(ElementTree.ElementTree(root))
-            root = self.post(uri, data)
-            for node in root.getchildren():
-                instance = instance_map[node.attrib['limsid']]
-                instance.root = node
+        klass = instance.__class__
+        if self.tracer is not None:
+            self.tracer.tag(entity=klass.__name__, instances=len(instance_map))
+        pending = [i for i in instance_map.values() if force or i.root is None]
+        chunk_size = chunk_size or self.BATCH_CHUNK_SIZE
+        max_workers = max_workers or self.BATCH_WORKERS
+
+        if len(pending) <= chunk_size or max_workers == 1:
+            while pending:
+                elapsed = self._get_batch_chunk(klass, pending[:chunk_size], instance_map)
+                pending = pending[chunk_size:]
+                if adaptive:
+                    chunk_size = self._adapt_chunk_size(chunk_size, elapsed)
+            return instance_map.values()
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        running = set()
+        try:
+            while pending or running:
+                while pending and len(running) < max_workers:
+                    running.add(executor.submit(self._get_batch_chunk, klass, pending[:chunk_size],
+                                                instance_map))
+                    pending = pending[chunk_size:]
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    elapsed = future.result()
+                    if adaptive:
+                        chunk_size = self._adapt_chunk_size(chunk_size, elapsed)
+        finally:
+            # Let the chunks already running finish before returning or raising
+            for future in running:
+                future.cancel()
+            executor.shutdown(wait=True)
         return instance_map.values()
 
-    def put_batch(self, instances):
-        """Update multiple instances using a single batch request."""
-
+    def _get_batch_chunk(self, klass, instances, instance_map):
+        """Retrieve the instances with one batch call, attaching their XML
+        to the instances of the map. Return the seconds it took."""
+        root = ElementTree.Element(nsmap('ri:links'))
+        for instance in instances:
+            ElementTree.SubElement(root, 'link', dict(uri=instance.uri, rel=klass._URI))
+        uri = self.get_uri(klass._URI, 'batch/retrieve')
+        data = self.tostring(ElementTree.ElementTree(root))
+        start = time.time()
+        if self.stream_parse:
+            nodes = self._iterparse('POST', uri, data=data, idempotent=True,
+                                    headers={'content-type': 'application/xml',
+                                             'accept': 'application/xml'})
+        else:
+            response = self.post(uri, data, idempotent=True)
+            nodes = list(response)
+            # With lxml, each node would keep the whole response alive
+            del response[:]
+        for node in nodes:
+            instance_map[node.attrib['limsid']].root = node
+        return time.time() - start
+
+    def _adapt_chunk_size(self, chunk_size, elapsed):
+        "Scale the chunk size towards the target response time, at most 2-fold."
+        factor = self.BATCH_TARGET_SECONDS / max(elapsed, 0.001)
+        factor = min(2.0, max(0.5, factor))
+        return int(min(self.BATCH_MAX_CHUNK_SIZE, max(1, chunk_size * factor)))
+
+    @traced
+    def put_batch(self, instances, chunk_size=None, max_workers=None, raise_errors=True):
+        """Update multiple instances using batch requests.
+
+        The instances are sent in chunks of chunk_size, max_workers chunks
+        at a time (by default BATCH_CHUNK_SIZE and BATCH_WORKERS). A chunk
+        whose data is rejected by the server, with a 400, 409 or 422 status,
+        is split in halves and sent again until the failing instances are
+        isolated, while the other chunks are saved. A chunk failing
+        otherwise, e.g. with a 403, 429 or 5xx status or a timeout, fails
+        as a whole.
+        Return a BatchResult of the instances saved and those that failed.
+        If any failed, BatchError is raised with that result instead,
+        unless raise_errors is False.
+        """
+        result = BatchResult()
         if not instances:
-            return
-
-        root = None  # XML root element for batch request
+            return result
+        instances = list(instances)
+        chunk_size = chunk_size or self.BATCH_CHUNK_SIZE
+        max_workers = max_workers or self.BATCH_WORKERS
+        chunks = [instances[i:i + chunk_size] for i in range(0, len(instances), chunk_size)]
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        running = {}
+        try:
+            while chunks or running:
+                while chunks and len(running) < max_workers:
+                    chunk = chunks.pop(0)
+                    running[executor.submit(self._put_batch_chunk, chunk)] = chunk
+                done, not_done = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk = running.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        result.succeeded.extend(chunk)
+                        for instance in chunk:
+                            instance._dirty = False
+                    elif _rejected(error) and len(chunk) > 1:
+                        # Bisect to isolate the rejected instances
+                        half = len(chunk) // 2
+                        chunks[:0] = [chunk[:half], chunk[half:]]
+                    else:
+                        logger.error("Batch update of %s instance(s) failed: %s", len(chunk), error)
+                        result.failed.extend((instance, error) for instance in chunk)
+        finally:
+            executor.shutdown(wait=True)
+        if result.failed and raise_errors:
+            raise BatchError("Batch update of %s of %s instance(s) failed: %s" % (
+                len(result.failed), len(instances), result.failed[0][1]), result)
+        return result
 
+    def _put_batch_chunk(self, instances):
+        "Update the instances with one batch call."
+        klass = instances[0].__class__
+        # Tag is art:details, con:details, etc.
+        ns_uri = re.match("{(.*)}.*", instances[0].root.tag).group(1)
+        root = instances[0].root.makeelement("{%s}details" % (ns_uri), {})
         for instance in instances:
-            if root is None:
-                klass = instance.__class__
-                # Tag is art:details, con:details, etc.
-                example_root = instance.root
-                ns_uri = re.match("{(.*)}.*", example_root.tag).group(1)
-                root = ElementTree.Element("{%s}details" % (ns_uri))
-
             root.append(instance.root)
-
+            if self.persistent_cache is not None:
+                self.persistent_cache.discard(instance.uri)
         uri = self.get_uri(klass._URI, 'batch/update')
         data = self.tostring(ElementTree.ElementTree(root))
-        root = self.post(uri, data)
+        # lxml moved the roots into the details element: detach them again
+        del root[:]
+        # Sending the same state again is harmless
+        return self.post(uri, data, idempotent=True, compress=True)
 
+    @traced
     def route_artifacts(self, artifact_list, workflow_uri=None, stage_uri=None, unassign=False):
         root = ElementTree.Element(nsmap('rt:routing'))
         if unassign:
@@ -594,11 +1460,14 @@ class Lims(object):
             a.set('uri', artifact.uri)
 
         uri = self.get_uri('route', 'artifacts')
-        r = requests.post(uri, data=self.tostring(ElementTree.ElementTree(root)),
-                          auth=(self.username, self.password),
-                          headers={'content-type': 'application/xml',
-                                   'accept': 'application/xml'})
-        self.validate_response(r)
+        data = self.tostring(ElementTree.ElementTree(root))
+        with self._instrument('POST', uri) as event:
+            r = self.transport.request('POST', uri, data=data, compress=True,
+                                       auth=(self.username, self.password),
+                                       headers={'content-type': 'application/xml',
+                                                'accept': 'application/xml'})
+            event.response(r, data=data)
+            self.validate_response(r)
 
     def tostring(self, etree):
         "Return the ElementTree contents as a UTF-8 encoded XML string."
@@ -608,4 +1477,4 @@ class Lims(object):
 
     def write(self, outfile, etree):
         "Write the ElementTree contents as UTF-8 encoded XML to the open file."
-        etree.write(outfile, encoding='utf-8', xml_declaration=True)
+        self.xml.write(outfile, etree)
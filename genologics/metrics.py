@@ -0,0 +1,257 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Instrumentation of the requests sent by a Lims instance, and a registry
+aggregating them per endpoint.
+"""
+
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from genologics.entities import Entity
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+_entity_names = None
+
+
+def entity_name(template):
+    "Return the name of the entity class served by the URI template, or None."
+    global _entity_names
+    if _entity_names is None:
+        names = dict()
+        pending = [Entity]
+        while pending:
+            klass = pending.pop()
+            pending.extend(klass.__subclasses__())
+            if klass._URI:
+                names[klass._URI] = klass.__name__
+        _entity_names = names
+    segments = template.split('/')
+    return _entity_names.get('/'.join(segments[:2])) or _entity_names.get(segments[0])
+
+
+def uri_template(uri, prefix):
+    """Return the URI relative to the prefix, or else its path, without
+    its query and with the segments holding an id replaced by {id}."""
+    path = uri.split('?', 1)[0]
+    if path.startswith(prefix):
+        path = path[len(prefix):]
+    else:
+        path = urlsplit(path).path
+    segments = [('{id}' if any(c.isdigit() for c in segment) else segment)
+                for segment in path.strip('/').split('/')]
+    return '/'.join(segments)
+
+
+class RequestEvent(object):
+    """One request sent by a Lims, as reported to its hooks.
+
+    method, uri: The request.
+    template: The URI relative to the API root, ids replaced by {id}.
+    entity: The name of the entity class of the URI, or None.
+    status: The HTTP status of the response, None if there was none.
+    bytes: The size of the response body.
+    wire_bytes: The size of the response body as received, before any
+                Content-Encoding was undone.
+    sent_bytes, sent_wire_bytes: The size of the request body, before
+                and after any compression.
+    network_time: Seconds until the response was received.
+    parse_time: Seconds spent parsing the response XML.
+    error: The exception raised, for the error hooks.
+    """
+
+    def __init__(self, method, uri, template, entity):
+        self.method = method
+        self.uri = uri
+        self.template = template
+        self.entity = entity
+        self.status = None
+        self.bytes = 0
+        self.wire_bytes = 0
+        self.sent_bytes = 0
+        self.sent_wire_bytes = 0
+        self.network_time = None
+        self.parse_time = 0.0
+        self.error = None
+        self.start = time.time()
+
+    def response(self, response, stream=False, data=None):
+        """Record the response received, and the size of the request body
+        data. The body of a stream response is counted as it is read, see
+        reading."""
+        self.network_time = time.time() - self.start
+        self.status = response.status_code
+        if data is not None:
+            self.sent_bytes = self.sent_wire_bytes = len(data)
+            body = getattr(getattr(response, 'request', None), 'body', None)
+            if isinstance(body, bytes):
+                self.sent_wire_bytes = len(body)
+        if stream:
+            self.bytes = self.wire_bytes = int(response.headers.get('Content-Length') or 0)
+        else:
+            self.bytes = len(response.content or b'')
+            self.wire_bytes = wire_size(response, self.bytes)
+
+    def reading(self, response):
+        """Return a file object reading the body of the stream response,
+        counting the bytes read."""
+        return _CountingReader(self, response)
+
+    @contextmanager
+    def parsing(self):
+        "Context in which the response XML is parsed."
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.parse_time += time.time() - start
+
+    def __repr__(self):
+        return "<RequestEvent %s %s %s>" % (self.method, self.template, self.status)
+
+
+def wire_size(response, default):
+    """Return the size of the body of the response as received, before
+    any Content-Encoding was undone, or default if not encoded."""
+    headers = response.headers
+    if not headers.get('Content-Encoding') or headers.get('Content-Encoding') == 'identity':
+        return default
+    length = headers.get('Content-Length')
+    if length is not None and str(length).isdigit():
+        return int(length)
+    # Chunked: the bytes urllib3 read from the socket
+    tell = getattr(getattr(response, 'raw', None), 'tell', None)
+    if tell is not None:
+        try:
+            size = tell()
+        except (IOError, ValueError):
+            size = None
+        if isinstance(size, int) and size > 0:
+            return size
+    return default
+
+
+class _CountingReader(object):
+    "Reader of the raw stream of a response updating the byte counts of the event."
+
+    def __init__(self, event, response):
+        self.event = event
+        self.response = response
+        event.bytes = 0
+
+    def read(self, size=-1):
+        data = self.response.raw.read(size)
+        self.event.bytes += len(data)
+        self.event.wire_bytes = wire_size(self.response, self.event.bytes)
+        return data
+
+
+class MetricsRegistry(object):
+    """Counts, bytes and latency histograms of the requests of one or more
+    Lims instances, per method and URI template.
+
+    registry = MetricsRegistry()
+    lims = Lims(BASEURI, USERNAME, PASSWORD, metrics=registry)
+    ...
+    registry.dump()
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.endpoints = dict()
+        self._lock = threading.Lock()
+
+    def attach(self, lims):
+        "Record the requests of the Lims instance."
+        lims.add_hook('after', self.record)
+        lims.add_hook('error', self.record)
+
+    def record(self, event):
+        "Account for a completed or failed request."
+        key = (event.method, event.template)
+        latency = event.network_time or 0.0
+        with self._lock:
+            try:
+                endpoint = self.endpoints[key]
+            except KeyError:
+                endpoint = self.endpoints[key] = dict(
+                    entity=event.entity, count=0, errors=0, statuses=dict(), bytes=0, wire_bytes=0,
+                    sent_bytes=0, sent_wire_bytes=0,
+                    network_time=0.0, parse_time=0.0, max_time=0.0,
+                    histogram=[0] * len(self.buckets))
+            endpoint['count'] += 1
+            if event.error is not None:
+                endpoint['errors'] += 1
+            if event.status is not None:
+                endpoint['statuses'][event.status] = endpoint['statuses'].get(event.status, 0) + 1
+            endpoint['bytes'] += event.bytes
+            endpoint['wire_bytes'] += event.wire_bytes
+            endpoint['sent_bytes'] += event.sent_bytes
+            endpoint['sent_wire_bytes'] += event.sent_wire_bytes
+            endpoint['network_time'] += latency
+            endpoint['parse_time'] += event.parse_time
+            endpoint['max_time'] = max(endpoint['max_time'], latency)
+            for index, bound in enumerate(self.buckets):
+                if latency <= bound:
+                    endpoint['histogram'][index] += 1
+                    break
+
+    def percentile(self, key, fraction):
+        """Upper bound of the histogram bucket holding the given fraction of
+        the requests to the (method, template) endpoint."""
+        endpoint = self.endpoints[key]
+        threshold = fraction * endpoint['count']
+        seen = 0
+        for bound, count in zip(self.buckets, endpoint['histogram']):
+            seen += count
+            if seen >= threshold:
+                return bound
+        return self.buckets[-1]
+
+    def snapshot(self):
+        "Return the metrics as a JSON serializable dictionary."
+        with self._lock:
+            result = []
+            for (method, template), endpoint in sorted(self.endpoints.items()):
+                item = dict(endpoint, method=method, template=template,
+                            statuses=dict((str(k), v) for k, v in endpoint['statuses'].items()),
+                            histogram=[[bound if bound != float('inf') else None, count]
+                                       for bound, count in zip(self.buckets, endpoint['histogram'])],
+                            histogram_p95=self.percentile((method, template), 0.95))
+                if item['histogram_p95'] == float('inf'):
+                    item['histogram_p95'] = None
+                result.append(item)
+        totals = dict((key, sum(item[key] for item in result))
+                      for key in ('count', 'bytes', 'wire_bytes', 'sent_bytes', 'sent_wire_bytes'))
+        return dict(endpoints=result, totals=totals)
+
+    def dump(self, out=None, format='text'):
+        """Write the metrics to the file, by default stderr, as text or json.
+        The file may be a text stream, such as io.StringIO, on Python 2 too."""
+        if out is None:
+            out = sys.stderr
+        if format == 'json':
+            out.write(u'%s\n' % json.dumps(self.snapshot(), indent=2, sort_keys=True))
+            return
+        snapshot = self.snapshot()
+        out.write(u"%-7s %-40s %7s %6s %12s %12s %10s %10s %8s\n" % (
+            'method', 'endpoint', 'count', 'errors', 'bytes', 'wire bytes', 'network s', 'parse s',
+            'p95 <='))
+        for item in snapshot['endpoints']:
+            p95 = item['histogram_p95']
+            out.write(u"%-7s %-40s %7d %6d %12d %12d %10.3f %10.3f %8s\n" % (
+                item['method'], item['template'], item['count'], item['errors'], item['bytes'],
+                item['wire_bytes'], item['network_time'], item['parse_time'],
+                'inf' if p95 is None else p95))
+        totals = snapshot['totals']
+        out.write(u"received %d bytes, %d on the wire; sent %d bytes, %d on the wire\n" % (
+            totals['bytes'], totals['wire_bytes'], totals['sent_bytes'], totals['sent_wire_bytes']))
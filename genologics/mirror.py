@@ -0,0 +1,183 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Local mirror of LIMS entities, kept up to date by incremental syncs.
+"""
+
+import calendar
+import datetime
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+
+from genologics.cache import CachePolicy
+from genologics.entities import Project, Lab, Researcher, Container, Process
+from genologics.lims import Lims
+
+logger = logging.getLogger(__name__)
+
+
+class LimsMirror(object):
+    """Copy of the entities of a LIMS in a local SQLite database.
+
+    Each sync lists the entities modified since the watermark of their
+    class using the last_modified filter of the list call, fetches their
+    XML and stores it; the watermark then moves to the start of the sync,
+    minus an overlap absorbing clock differences with the server. The
+    first sync of a class copies all its entities, unless since is given.
+    Reads are answered from the database without contacting the LIMS.
+
+    The mirror lists and fetches the entities through a Lims of its own,
+    sharing the transport, hooks and tracer of the one given, so that the
+    instances of the latter and their unsaved changes are left alone.
+    Reads return new instances, detached from any identity map, whose data
+    never expires whatever the cache policy of the Lims given.
+    """
+
+    # Entity classes whose list call takes a last_modified filter
+    LIST_METHODS = {
+        Project: 'get_projects',
+        Lab: 'get_labs',
+        Researcher: 'get_researchers',
+        Container: 'get_containers',
+        Process: 'get_processes',
+    }
+    TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.000Z'
+
+    def __init__(self, lims, path, classes=None, overlap=300, max_workers=8):
+        """lims: The Lims to mirror.
+        path: The SQLite database file.
+        classes: The entity classes to mirror; all of LIST_METHODS by default.
+        overlap: Seconds subtracted from the start of a sync for the next watermark.
+        max_workers: Concurrent GETs for classes without a batch endpoint.
+        """
+        self.lims = lims
+        self.reader = Lims(lims.baseuri, lims.username, lims.password, version=lims.VERSION,
+                           transport=lims.transport, cache_policy=CachePolicy(), xml_backend=lims.xml)
+        # Report the sync requests to the metrics and tracer of the Lims
+        self.reader.hooks = lims.hooks
+        self.reader.tracer = lims.tracer
+        self.path = path
+        self.classes = list(classes or self.LIST_METHODS)
+        for klass in self.classes:
+            if klass not in self.LIST_METHODS:
+                raise ValueError("%s cannot be listed by modification date" % klass.__name__)
+        self.overlap = overlap
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS entities "
+                                     "(uri TEXT PRIMARY KEY, class TEXT, limsid TEXT, xml BLOB, synced TEXT)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS entities_class ON entities (class, limsid)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS watermarks "
+                                     "(class TEXT PRIMARY KEY, last_modified TEXT)")
+
+    def watermark(self, klass):
+        "Return the last_modified value of the next sync of the class, or None."
+        with self._lock:
+            row = self._connection.execute("SELECT last_modified FROM watermarks WHERE class = ?",
+                                           (klass.__name__,)).fetchone()
+        return row[0] if row else None
+
+    def sync(self, classes=None, since=None):
+        """Copy the entities modified since the last sync of their class.
+        since: ISO format datetime used for classes never synced before.
+        Return a dictionary of the number of entities stored by class name.
+        """
+        result = dict()
+        for klass in classes or self.classes:
+            start = datetime.datetime.utcnow()
+            last_modified = self.watermark(klass) or since
+            list_method = getattr(self.reader, self.LIST_METHODS[klass])
+            count = 0
+            chunk = []
+            for instance in list_method(last_modified=last_modified, stream=True):
+                chunk.append(instance)
+                if len(chunk) >= self.reader.BATCH_CHUNK_SIZE:
+                    count += self._sync_chunk(klass, chunk, start)
+                    chunk = []
+            if chunk:
+                count += self._sync_chunk(klass, chunk, start)
+            self._move_watermark(klass, start)
+            result[klass.__name__] = count
+            logger.info("Mirrored %s %s modified since %s", count, klass.__name__, last_modified)
+        return result
+
+    def _sync_chunk(self, klass, instances, start):
+        "Fetch and store the instances, then let them go. Return their number."
+        self._fetch(klass, instances)
+        self._store(klass, instances, start)
+        for instance in instances:
+            self.reader.cache.pop(instance.uri, None)
+        return len(instances)
+
+    def _fetch(self, klass, instances):
+        "Get the current XML data of the instances."
+        if klass._BATCH_RETRIEVE:
+            self.reader.get_batch(instances, force=True)
+            return
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            list(executor.map(lambda instance: instance.get(force=True), instances))
+        finally:
+            executor.shutdown(wait=True)
+
+    def _store(self, klass, instances, start):
+        "Save the XML of the instances."
+        synced = start.strftime(self.TIME_FORMAT)
+        rows = [(instance.uri, klass.__name__, instance.id,
+                 sqlite3.Binary(self.reader.tostring(ElementTree.ElementTree(instance.root))), synced)
+                for instance in instances]
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?, ?)", rows)
+
+    def _move_watermark(self, klass, start):
+        "Set the watermark of the class once all its entities are stored."
+        watermark = (start - datetime.timedelta(seconds=self.overlap)).strftime(self.TIME_FORMAT)
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO watermarks VALUES (?, ?)",
+                                     (klass.__name__, watermark))
+
+    def _instance(self, klass, uri, xml, synced):
+        """Return a new instance for the URI, outside of any identity map,
+        with the data from the mirror as obtained at the time of the sync."""
+        instance = klass(self.reader, _create_new=True)
+        instance._uri = uri
+        # Bypass the root setter, which would date the data from now
+        instance._root = self.reader.xml.fromstring(bytes(xml))
+        instance._fetched = calendar.timegm(time.strptime(synced, self.TIME_FORMAT))
+        return instance
+
+    def get(self, klass, id=None, uri=None):
+        "Return the mirrored instance of the class by LIMS id or URI, or None."
+        if uri is not None:
+            query, value = "SELECT uri, xml, synced FROM entities WHERE uri = ?", (uri,)
+        elif id is not None:
+            query, value = ("SELECT uri, xml, synced FROM entities WHERE class = ? AND limsid = ?",
+                            (klass.__name__, id))
+        else:
+            raise ValueError("id or uri required")
+        with self._lock:
+            row = self._connection.execute(query, value).fetchone()
+        if row is None:
+            return None
+        return self._instance(klass, *row)
+
+    def all(self, klass):
+        "Return the list of the mirrored instances of the class."
+        with self._lock:
+            rows = self._connection.execute("SELECT uri, xml, synced FROM entities WHERE class = ?",
+                                            (klass.__name__,)).fetchall()
+        return [self._instance(klass, *row) for row in rows]
+
+    def count(self, klass):
+        "Return the number of mirrored instances of the class."
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM entities WHERE class = ?",
+                                            (klass.__name__,)).fetchone()[0]
+
+    def close(self):
+        self._connection.close()
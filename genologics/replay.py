@@ -0,0 +1,132 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Transports recording the HTTP traffic of a Lims to a file, and serving it
+back offline, e.g. to benchmark client changes against real traffic.
+
+    lims = Lims(BASEURI, USERNAME, PASSWORD, transport=RecordingTransport('traffic.jsonl.gz'))
+    ...
+    lims.transport.close()
+
+    lims = Lims(BASEURI, USERNAME, PASSWORD, transport=ReplayTransport('traffic.jsonl.gz'))
+"""
+
+import base64
+import gzip
+import hashlib
+import json
+import threading
+import time
+from io import BytesIO
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from genologics.transport import Transport
+
+# Response headers kept in the recordings
+RECORDED_HEADERS = ('Content-Type', 'Content-Length', 'Content-Encoding', 'ETag', 'Last-Modified')
+
+
+class ReplayError(requests.exceptions.RequestException):
+    "No response was recorded for the request."
+
+
+def request_key(method, uri, params=None, data=None, files=None):
+    """Return the key identifying a request in a recording: the method,
+    the full URL and a digest of the body."""
+    url = requests.Request(method=method, url=uri, params=params).prepare().url
+    if files:
+        body = 'files'
+    elif data:
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        body = hashlib.sha1(data).hexdigest()
+    else:
+        body = ''
+    return '%s %s %s' % (method, url, body)
+
+
+class RecordingTransport(Transport):
+    """Transport sending the requests to the LIMS and appending every
+    request and response, with its timing, to a gzipped JSON lines file.
+    Other arguments as for Transport.
+    """
+
+    def __init__(self, path, **kwargs):
+        super(RecordingTransport, self).__init__(**kwargs)
+        self.path = path
+        self._file = gzip.open(path, 'ab')
+        self._lock = threading.Lock()
+
+    def _send(self, method, uri, **kwargs):
+        start = time.time()
+        response = super(RecordingTransport, self)._send(method, uri, **kwargs)
+        elapsed = time.time() - start
+        content = response.content
+        if kwargs.get('stream'):
+            # The content was consumed from the stream
+            response.raw = BytesIO(content)
+        if not isinstance(content, bytes):
+            content = content.encode('utf-8')
+        record = dict(key=request_key(method, uri, kwargs.get('params'), kwargs.get('data'),
+                                      kwargs.get('files')),
+                      status=response.status_code, elapsed=round(elapsed, 6),
+                      headers=dict((k, response.headers[k]) for k in RECORDED_HEADERS
+                                   if k in response.headers),
+                      body=base64.b64encode(content).decode('ascii'))
+        line = (json.dumps(record, sort_keys=True) + '\n').encode('utf-8')
+        with self._lock:
+            self._file.write(line)
+        return response
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        super(RecordingTransport, self).close()
+
+
+class ReplayTransport(Transport):
+    """Transport answering the requests from a recording, without network.
+
+    Responses to the same request are served in the recorded order, the
+    last one being repeated. With latency, each response is delayed by
+    its recorded time multiplied by latency. Other arguments as for
+    Transport, whose governor, circuit breaker and retries still apply.
+    """
+
+    def __init__(self, path, latency=0, **kwargs):
+        super(ReplayTransport, self).__init__(**kwargs)
+        self.path = path
+        self.latency = latency
+        self.index = dict()
+        self._served = dict()
+        self._lock = threading.Lock()
+        with gzip.open(path, 'rb') as f:
+            for line in f:
+                record = json.loads(line.decode('utf-8'))
+                self.index.setdefault(record['key'], []).append(record)
+
+    def _send(self, method, uri, **kwargs):
+        key = request_key(method, uri, kwargs.get('params'), kwargs.get('data'), kwargs.get('files'))
+        with self._lock:
+            records = self.index.get(key)
+            if not records:
+                raise ReplayError("No recorded response for %s" % key)
+            position = self._served.get(key, 0)
+            self._served[key] = position + 1
+        record = records[min(position, len(records) - 1)]
+        if self.latency:
+            time.sleep(record['elapsed'] * self.latency)
+        return self._response(uri, record)
+
+    def _response(self, uri, record):
+        "Build the requests Response of the record."
+        content = base64.b64decode(record['body'])
+        response = requests.models.Response()
+        response.status_code = record['status']
+        response.headers = CaseInsensitiveDict(record['headers'])
+        response.url = uri
+        response.encoding = 'utf-8'
+        response._content = content
+        response.raw = BytesIO(content)
+        return response
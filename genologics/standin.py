@@ -0,0 +1,528 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Local stand-in for the Clarity API server, serving entity XML from memory
+over HTTP on localhost, for load and scale tests of the LIMS interface.
+
+    with StandInServer(page_size=100, latency=0.05) as server:
+        server.load(xml_dict)
+        lims = Lims(server.baseuri, 'user', 'password')
+        ...
+
+Implemented: list resources with next-page paging and the filters in
+StandInServer.FILTERS, entity GET, PUT, POST and DELETE, batch/retrieve,
+batch/update, route/artifacts, glsstorage and files with upload and
+download, and any nested resource such as steps/{id}/details served
+from its XML.
+
+File downloads honour Range requests of the form bytes=start-, and
+If-Range with their ETag.
+
+StandInServer.transport() returns a transport calling the server in
+process, without HTTP, for benchmarks of the client code alone.
+"""
+
+import hashlib
+from io import BytesIO
+import itertools
+import logging
+import random
+import threading
+import time
+import zlib
+from xml.etree import ElementTree
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from sys import version_info
+
+if version_info[0] == 2:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlsplit, parse_qs
+    from urllib import urlencode
+else:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlsplit, parse_qs, urlencode
+
+from genologics.constants import nsmap, _NSMAP
+from genologics.entities import Entity
+from genologics.metrics import uri_template
+from genologics.transport import Transport, gzip_compress
+
+logger = logging.getLogger(__name__)
+
+VERSION = 'v2'
+
+
+def _entity_classes():
+    "Return the entity classes by the first segments of their URI."
+    classes = dict()
+    pending = [Entity]
+    while pending:
+        klass = pending.pop()
+        pending.extend(klass.__subclasses__())
+        if klass._URI:
+            classes[klass._URI] = klass
+    return classes
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class StandInServer(object):
+    """In-memory Clarity API stand-in, served from a background thread.
+
+    entities: dictionary of XML by path below the API root, e.g. 'samples/S1'.
+    latency: Seconds added to every response, or a (min, max) range.
+    page_size: Items per page of the list resources.
+    error_rate: Fraction of the requests answered with error_status.
+    compress_min_size: Size from which responses are gzipped for clients
+                       accepting it; None never compresses.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, page_size=500,
+                 error_rate=0, error_status=503, seed=None, compress_min_size=2048):
+        self.latency = latency
+        self.page_size = page_size
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.compress_min_size = compress_min_size
+        self.entities = dict()
+        self.files = dict()
+        self.routed = []
+        self.request_counts = dict()
+        self._classes = _entity_classes()
+        self._injected = []
+        self._parsed = dict()
+        self._ids = itertools.count(1)
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._httpd = _Server((host, port), _Handler)
+        self._httpd.standin = self
+        self._thread = None
+
+    @property
+    def baseuri(self):
+        host, port = self._httpd.server_address[:2]
+        return 'http://%s:%s/' % (host, port)
+
+    @property
+    def api_root(self):
+        return self.baseuri + 'api/' + VERSION + '/'
+
+    def start(self):
+        "Serve in a daemon thread."
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def load(self, xml_dict, baseuri=None):
+        """Add the entity XML of the dictionary keyed by URI, as used by
+        genologics.test_utils. URIs starting with baseuri are rewritten
+        to point at this server."""
+        with self._lock:
+            for uri, xml in xml_dict.items():
+                if not isinstance(xml, bytes):
+                    xml = xml.encode('utf-8')
+                if baseuri:
+                    old = baseuri.rstrip('/') + '/'
+                    xml = xml.replace(old.encode('utf-8'), self.baseuri.encode('utf-8'))
+                    uri = uri.replace(old, self.baseuri)
+                self.entities[self._path(uri)] = xml
+
+    def add(self, path, xml):
+        "Add the entity XML at the path below the API root."
+        if not isinstance(xml, bytes):
+            xml = xml.encode('utf-8')
+        with self._lock:
+            self.entities[path] = xml
+
+    def inject_errors(self, count, status=503):
+        "Answer the next count requests with the status."
+        with self._lock:
+            self._injected.extend([status] * count)
+
+    def _path(self, uri):
+        "Return the path of the URI below the API root, without query."
+        path = urlsplit(uri).path
+        prefix = '/api/' + VERSION + '/'
+        if path.startswith(prefix):
+            path = path[len(prefix):]
+        return path.strip('/')
+
+    def _count(self, method, path):
+        key = '%s %s' % (method, uri_template(path, ''))
+        with self._lock:
+            self.request_counts[key] = self.request_counts.get(key, 0) + 1
+
+    def _delay(self):
+        latency = self.latency
+        if isinstance(latency, (tuple, list)):
+            latency = self._random.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+
+    def _error(self):
+        "Return the status of an injected error for this request, or None."
+        with self._lock:
+            if self._injected:
+                return self._injected.pop(0)
+            if self.error_rate and self._random.random() < self.error_rate:
+                return self.error_status
+        return None
+
+    def _class(self, path):
+        segments = path.split('/')
+        return self._classes.get('/'.join(segments[:2])) or self._classes.get(segments[0])
+
+    def _new_id(self, resource):
+        return '%s-%s' % (resource.replace('/', '-').upper()[:3], next(self._ids))
+
+    def _uri(self, path):
+        return self.api_root + path
+
+    def transport(self, **kwargs):
+        """Return a Transport answering from this server in the calling
+        thread, without sockets; the server need not be started.
+        Arguments as for Transport."""
+        return InProcessTransport(self, **kwargs)
+
+    def respond(self, method, uri, body, headers):
+        """Answer the request, honouring If-None-Match, Content-Encoding
+        and Accept-Encoding. Return the status, the response headers and
+        the content."""
+        if body and headers.get('Content-Encoding') == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        status, content = self.handle(method, uri, body, headers)
+        response_headers = {'Content-Type': 'application/xml'}
+        if urlsplit(uri).path.endswith('/download'):
+            response_headers['Content-Type'] = 'application/octet-stream'
+        if method == 'GET' and status == 200:
+            etag = '"%s"' % hashlib.sha1(content).hexdigest()
+            response_headers['ETag'] = etag
+            if headers.get('If-None-Match') == etag:
+                status, content = 304, b''
+        range = headers.get('Range')
+        if (range and status == 200 and urlsplit(uri).path.endswith('/download')
+                and headers.get('If-Range') in (None, response_headers['ETag'])):
+            status, content = self._range(range, content, response_headers)
+        if (self.compress_min_size is not None and len(content) >= self.compress_min_size
+                and 'gzip' in headers.get('Accept-Encoding', '')):
+            content = gzip_compress(content)
+            response_headers['Content-Encoding'] = 'gzip'
+        response_headers['Content-Length'] = str(len(content))
+        return status, response_headers, content
+
+    def _range(self, range, content, response_headers):
+        "Answer a request for the bytes=start- range of the content."
+        start = int(range.split('=')[1].split('-')[0])
+        total = len(content)
+        if start >= total:
+            response_headers['Content-Range'] = 'bytes */%s' % total
+            return 416, b''
+        response_headers['Content-Range'] = 'bytes %s-%s/%s' % (start, total - 1, total)
+        return 206, content[start:]
+
+    # Request handling; each method returns (status, body bytes)
+
+    def handle(self, method, uri, body, headers):
+        path = self._path(uri)
+        query = parse_qs(urlsplit(uri).query)
+        self._count(method, path)
+        self._delay()
+        status = self._error()
+        if status is not None:
+            return status, self._exception('Injected error')
+        if path in ('', 'api'):
+            return self._versions()
+        try:
+            if path.endswith('batch/retrieve'):
+                return self._batch_retrieve(body)
+            if path.endswith('batch/update'):
+                return self._batch_update(body)
+            if path == 'route/artifacts':
+                with self._lock:
+                    self.routed.append(body)
+                return 200, b''
+            if path.startswith('files/') and path.endswith('/upload'):
+                return self._upload(path, body, headers)
+            if path.startswith('files/') and path.endswith('/download'):
+                return self._download(path)
+            if method == 'GET':
+                if path in self.entities:
+                    return 200, self.entities[path]
+                return self._list(path, query)
+            if method == 'PUT':
+                return self._put(path, body)
+            if method == 'POST':
+                return self._post(path, body)
+            if method == 'DELETE':
+                with self._lock:
+                    if self.entities.pop(path, None) is None:
+                        return 404, self._exception('Not found: %s' % path)
+                return 204, b''
+        except (ElementTree.ParseError, KeyError) as e:
+            return 400, self._exception('Bad request: %s' % e)
+        return 405, self._exception('Method not allowed')
+
+    def _exception(self, message):
+        root = ElementTree.Element(nsmap('exc:exception'))
+        ElementTree.SubElement(root, 'message').text = message
+        return ElementTree.tostring(root)
+
+    def _versions(self):
+        root = ElementTree.Element(nsmap('ver:versions'))
+        ElementTree.SubElement(root, 'version', major=VERSION, uri=self.api_root.rstrip('/'))
+        return 200, ElementTree.tostring(root)
+
+    def _list(self, path, query):
+        klass = self._class(path)
+        if klass is None or path != klass._URI:
+            return 404, self._exception('Not found: %s' % path)
+        tag = klass._TAG or klass.__name__.lower()
+        filters = [(self.FILTERS[k], v) for k, v in query.items() if k in self.FILTERS]
+        items = []
+        with self._lock:
+            keys = sorted(k for k in self.entities
+                          if k.startswith(path + '/') and '/' not in k[len(path) + 1:])
+        for key in keys:
+            node = self._node(key)
+            if node is None:
+                continue
+            if all(any(test(self, node, value) for value in values) for test, values in filters):
+                items.append((key, node))
+        start = int(query.get('start-index', ['0'])[0])
+        page = items[start:start + self.page_size]
+        prefix = klass._PREFIX if klass._PREFIX in _NSMAP else 'ri'
+        root = ElementTree.Element(nsmap(prefix + ':' + path.split('/')[-1]))
+        for key, node in page:
+            attrib = dict(uri=self._uri(key))
+            if 'limsid' in node.attrib:
+                attrib['limsid'] = node.attrib['limsid']
+            item = ElementTree.SubElement(root, tag, attrib)
+            name = node.findtext('name')
+            if name is not None:
+                ElementTree.SubElement(item, 'name').text = name
+        if start + self.page_size < len(items):
+            params = dict((k, v) for k, v in query.items() if k != 'start-index')
+            params['start-index'] = [str(start + self.page_size)]
+            ElementTree.SubElement(root, 'next-page',
+                                   uri=self._uri(path) + '?' + urlencode(params, doseq=True))
+        return 200, ElementTree.tostring(root)
+
+    def _node(self, path):
+        "Return the parsed XML of the entity at the path, or None."
+        with self._lock:
+            xml = self.entities.get(path)
+            if xml is None:
+                return None
+            cached = self._parsed.get(path)
+            if cached is not None and cached[0] is xml:
+                return cached[1]
+        node = ElementTree.fromstring(xml)
+        with self._lock:
+            self._parsed[path] = (xml, node)
+        return node
+
+    def _linked(self, node, tag, resource):
+        "Return the parsed entities linked from the node by tag elements."
+        result = []
+        for link in node.iter(tag):
+            linked = self._node(resource + '/' + link.attrib.get('limsid', ''))
+            if linked is None and 'uri' in link.attrib:
+                linked = self._node(self._path(link.attrib['uri']))
+            if linked is not None:
+                result.append(linked)
+        return result
+
+    def _name_is(self, node, value):
+        return (node.findtext('name') or node.attrib.get('name')) == value
+
+    # Supported list filters, by query parameter
+    FILTERS = {
+        'name': lambda self, node, value: self._name_is(node, value),
+        'type': lambda self, node, value: node.findtext('type') == value,
+        'samplelimsid': lambda self, node, value: any(
+            s.attrib.get('limsid') == value for s in node.findall('sample')),
+        'sample-name': lambda self, node, value: any(
+            self._name_is(s, value) for s in self._linked(node, 'sample', 'samples')),
+        'projectlimsid': lambda self, node, value: any(
+            p.attrib.get('limsid') == value for p in node.findall('project')),
+        'projectname': lambda self, node, value: any(
+            self._name_is(p, value) for p in self._linked(node, 'project', 'projects')),
+        'containername': lambda self, node, value: any(
+            self._name_is(c, value) for c in self._linked(node, 'container', 'containers')),
+        'inputartifactlimsid': lambda self, node, value: any(
+            i.attrib.get('limsid') == value for i in node.iter('input')),
+    }
+
+    # Action sub-resources of an entity, POSTed to <entity path>/<action>
+    ACTIONS = ('advance',)
+
+    def _put(self, path, body):
+        with self._lock:
+            if path not in self.entities:
+                return 404, self._exception('Not found: %s' % path)
+            ElementTree.fromstring(body)
+            self.entities[path] = body
+        return 200, body
+
+    def _post(self, path, body):
+        "Create an entity in the list resource, or act on an existing one."
+        with self._lock:
+            if path in self.entities:
+                return 200, self.entities[path]
+        root = ElementTree.fromstring(body)
+        parent, _, action = path.rpartition('/')
+        if action in self.ACTIONS:
+            return self._act(parent, root, body)
+        if path == 'glsstorage':
+            location = ElementTree.SubElement(root, 'content-location')
+            location.text = 'sftp://standin/%s' % self._new_id('file')
+            return 201, ElementTree.tostring(root)
+        id = self._new_id(path)
+        key = path + '/' + id
+        root.set('uri', self._uri(key))
+        root.set('limsid', id)
+        xml = ElementTree.tostring(root)
+        with self._lock:
+            self.entities[key] = xml
+        return 201, xml
+
+    def _act(self, path, root, body):
+        """Act on the entity at the path, e.g. advance a step, with the
+        posted XML of the entity: stored as its new state and returned."""
+        with self._lock:
+            if path not in self.entities:
+                return 404, self._exception('Not found: %s' % path)
+            if self._path(root.attrib.get('uri', '')) == path:
+                self.entities[path] = body
+            return 200, self.entities[path]
+
+    def _batch_retrieve(self, body):
+        links = ElementTree.fromstring(body)
+        details = None
+        with self._lock:
+            for link in links.findall('link'):
+                node = ElementTree.fromstring(self.entities[self._path(link.attrib['uri'])])
+                if details is None:
+                    details = ElementTree.Element(node.tag.split('}')[0] + '}details')
+                details.append(node)
+        if details is None:
+            details = ElementTree.Element(nsmap('ri:details'))
+        return 200, ElementTree.tostring(details)
+
+    def _batch_update(self, body):
+        details = ElementTree.fromstring(body)
+        links = ElementTree.Element(nsmap('ri:links'))
+        with self._lock:
+            for node in details:
+                path = self._path(node.attrib['uri'])
+                if path not in self.entities:
+                    return 400, self._exception('Unknown entity: %s' % node.attrib['uri'])
+            for node in details:
+                path = self._path(node.attrib['uri'])
+                self.entities[path] = ElementTree.tostring(node)
+                ElementTree.SubElement(links, 'link', uri=node.attrib['uri'], rel=path.split('/')[0])
+        return 200, ElementTree.tostring(links)
+
+    def _upload(self, path, body, headers):
+        "Store the first part of the multipart body as the file content."
+        content = body
+        content_type = headers.get('Content-Type', '')
+        if 'boundary=' in content_type:
+            boundary = content_type.split('boundary=')[1].strip('"').encode('ascii')
+            part = body.split(b'--' + boundary)[1]
+            content = part.split(b'\r\n\r\n', 1)[1]
+            if content.endswith(b'\r\n'):
+                content = content[:-2]
+        with self._lock:
+            self.files[path.split('/')[1]] = content
+        return 200, b''
+
+    def _download(self, path):
+        id = path.split('/')[1]
+        with self._lock:
+            if id not in self.files:
+                return 404, self._exception('No content for file %s' % id)
+            return 200, self.files[id]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    "Hands the requests over to the StandInServer."
+
+    protocol_version = 'HTTP/1.1'
+
+    def _handle(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        status, headers, content = self.server.standin.respond(method, self.path, body, self.headers)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if content:
+            self.wfile.write(content)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class InProcessTransport(Transport):
+    """Transport handing the requests directly to a StandInServer, e.g.
+    for benchmarks of the client free of socket and HTTP overhead."""
+
+    def __init__(self, standin, **kwargs):
+        super(InProcessTransport, self).__init__(**kwargs)
+        self.standin = standin
+
+    def _send(self, method, uri, params=None, data=None, files=None, headers=None, **kwargs):
+        request = self.session.prepare_request(requests.Request(
+            method=method, url=uri, params=params, data=data, files=files, headers=headers))
+        body = request.body or b''
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        status, response_headers, content = self.standin.respond(method, request.url, body,
+                                                                 request.headers)
+        response = requests.models.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(response_headers)
+        response.url = request.url
+        response.request = request
+        response.encoding = 'utf-8'
+        if response.headers.get('Content-Encoding') == 'gzip':
+            content = zlib.decompress(content, 16 + zlib.MAX_WBITS)
+        response._content = content
+        response.raw = BytesIO(content)
+        return response
@@ -0,0 +1,489 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Generator of synthetic, internally consistent LIMS datasets shaped like
+production data, for benchmarks and tests.
+
+The dataset is a dictionary of entity XML by URI, the format of
+genologics.test_utils.XML_DICT, which StandInServer.load also accepts:
+
+    dataset = generate_dataset('http://localhost:8080/', projects=2, samples_per_project=10000)
+    server.load(dataset, baseuri='http://localhost:8080/')
+"""
+
+import random
+import string
+from collections import OrderedDict
+from xml.etree import ElementTree
+
+from genologics.constants import nsmap
+
+VERSION = 'v2'
+
+# Rows and columns of the container types
+PLATE_LAYOUTS = {96: (8, 12), 384: (16, 24)}
+
+
+def well_names(wells):
+    "Return the well names of a plate, row by row, e.g. A:1, A:2..."
+    rows, columns = PLATE_LAYOUTS[wells]
+    return ['%s:%s' % (string.ascii_uppercase[row], column + 1)
+            for row in range(rows) for column in range(columns)]
+
+
+class DatasetGenerator(object):
+    """Builds the XML of a synthetic LIMS.
+
+    Every project has samples_per_project samples, each with a root
+    analyte placed in plates of container_wells wells. The analytes go
+    through a chain of steps processes, each producing replicates output
+    analytes per input, in new plates, and a per-input result file. The
+    outputs of the last step get reagent labels and, with pool_size, are
+    pooled by a final process into analytes labelled with the indexes of
+    all their inputs. Each process has its step, with details, actions,
+    placements, program status, reagent lots and, for the pooling, pools.
+    Each project has a file attached, and its first sample a note. The
+    configuration entities referenced (lab, researchers, container types,
+    process types, protocol and its steps, workflow and its stages, empty
+    queues, reagent kits, lots and types, instrument, UDFs) are generated
+    too. Every URI in the dataset refers to an entity of the dataset.
+
+    After generate, lineages holds the ids of the analytes of each sample
+    id, from its root analyte on, excluding pools.
+    """
+
+    def __init__(self, baseuri, projects=1, samples_per_project=96, container_wells=96,
+                 steps=3, replicates=1, pool_size=4, result_files=True, seed=0):
+        if container_wells not in PLATE_LAYOUTS:
+            raise ValueError("container_wells must be one of %s" % sorted(PLATE_LAYOUTS))
+        self.api = baseuri.rstrip('/') + '/api/' + VERSION + '/'
+        self.projects = projects
+        self.samples_per_project = samples_per_project
+        self.container_wells = container_wells
+        self.steps = steps
+        self.replicates = replicates
+        self.pool_size = pool_size
+        self.result_files = result_files
+        self.random = random.Random(seed)
+        self.xml = dict()
+        self.lineages = dict()
+        self._counters = dict()
+
+    def _id(self, prefix):
+        number = self._counters.get(prefix, 0) + 1
+        self._counters[prefix] = number
+        return '%s%s' % (prefix, number)
+
+    def uri(self, path):
+        return self.api + path
+
+    def _add(self, path, root):
+        "Store the entity XML at the path below the API root."
+        self.xml[self.uri(path)] = ElementTree.tostring(root, encoding='utf-8')
+
+    def _entity(self, tag, path, limsid=None, **attrib):
+        "Return the root element of an entity."
+        attrib['uri'] = self.uri(path)
+        if limsid is not None:
+            attrib['limsid'] = limsid
+        return ElementTree.Element(nsmap(tag), attrib)
+
+    def _text(self, parent, tag, text, **attrib):
+        node = ElementTree.SubElement(parent, tag, attrib)
+        node.text = text
+        return node
+
+    def _link(self, parent, tag, path, limsid=None):
+        attrib = dict(uri=self.uri(path))
+        if limsid is not None:
+            attrib['limsid'] = limsid
+        return ElementTree.SubElement(parent, tag, attrib)
+
+    def _udf(self, parent, name, value, type='Numeric'):
+        return self._text(parent, nsmap('udf:field'), str(value), name=name, type=type)
+
+    def _date(self):
+        return '2020-%02d-%02d' % (self.random.randint(1, 12), self.random.randint(1, 28))
+
+    def generate(self):
+        "Build the dataset and return it, a dictionary of XML by URI."
+        self._configuration()
+        for number in range(1, self.projects + 1):
+            self._project(number)
+        return self.xml
+
+    # Configuration entities
+
+    def _configuration(self):
+        root = self._entity('lab:lab', 'labs/1')
+        self._text(root, 'name', 'Sequencing Lab')
+        self._text(root, 'website', 'http://lab.example.com')
+        self._add('labs/1', root)
+
+        for number, (first, last) in enumerate([('Ada', 'Admin'), ('Tess', 'Technician')], 1):
+            root = self._entity('res:researcher', 'researchers/%s' % number)
+            self._text(root, 'first-name', first)
+            self._text(root, 'last-name', last)
+            self._text(root, 'email', '%s@example.com' % first.lower())
+            self._text(root, 'initials', first[0] + last[0])
+            self._link(root, 'lab', 'labs/1')
+            credentials = ElementTree.SubElement(root, 'credentials')
+            self._text(credentials, 'username', first.lower())
+            self._text(credentials, 'account-locked', 'false')
+            self._add('researchers/%s' % number, root)
+
+        for number, wells in enumerate(sorted(PLATE_LAYOUTS), 1):
+            rows, columns = PLATE_LAYOUTS[wells]
+            root = self._entity('ctp:container-type', 'containertypes/%s' % number,
+                                name='%s well plate' % wells)
+            for tag, size, alpha in (('x-dimension', columns, 'false'), ('y-dimension', rows, 'true')):
+                dimension = ElementTree.SubElement(root, tag)
+                self._text(dimension, 'is-alpha', alpha)
+                self._text(dimension, 'offset', '1' if alpha == 'false' else '0')
+                self._text(dimension, 'size', str(size))
+            self._add('containertypes/%s' % number, root)
+        self.container_type = 'containertypes/%s' % (sorted(PLATE_LAYOUTS).index(self.container_wells) + 1)
+
+        for number, name in enumerate(['Concentration', 'Volume'], 1):
+            root = self._entity('cnf:field', 'configuration/udfs/%s' % number, type='Numeric')
+            self._text(root, 'name', name)
+            self._text(root, 'attach-to-name', 'Analyte')
+            self._text(root, 'show-in-lablink', 'true')
+            self._text(root, 'is-editable', 'true')
+            self._add('configuration/udfs/%s' % number, root)
+
+        root = self._entity('inst:instrument', 'instruments/1', limsid='55-1')
+        self._text(root, 'name', 'Sequencer 1')
+        self._text(root, 'type', 'NovaSeq')
+        self._text(root, 'serial-number', 'SN0001')
+        self._text(root, 'archived', 'false')
+        self._add('instruments/1', root)
+
+        self.process_types = []
+        names = ['Step %s' % (number + 1) for number in range(self.steps)]
+        if self.pool_size:
+            names.append('Pooling')
+        for number, name in enumerate(names, 1):
+            path = 'processtypes/%s' % number
+            root = self._entity('ptp:process-type', path, name=name)
+            self._link(root, 'field-definition', 'configuration/udfs/1').set('name', 'Concentration')
+            self._text(root, 'process-type-attribute', 'Analyte', name='OutputType')
+            self._add(path, root)
+            self.process_types.append((path, name))
+
+        # The protocol step path of each process type
+        self.protocol_steps = dict()
+        root = self._entity('protcnf:protocol', 'configuration/protocols/1', name='Library prep', index='1')
+        steps = ElementTree.SubElement(root, 'steps')
+        for number, (path, name) in enumerate(self.process_types, 1):
+            step_path = 'configuration/protocols/1/steps/%s' % number
+            self.protocol_steps[path] = step_path
+            step = self._link(steps, 'step', step_path)
+            step.set('name', name)
+            self._link(step, 'process-type', path).text = name
+            self._protocol_step(step_path, number, path, name)
+        self._add('configuration/protocols/1', root)
+
+        root = self._entity('wkfcnf:workflow', 'configuration/workflows/1', name='Sequencing', status='ACTIVE')
+        self._link(ElementTree.SubElement(root, 'protocols'), 'protocol', 'configuration/protocols/1')
+        stages = ElementTree.SubElement(root, 'stages')
+        for number, (path, name) in enumerate(self.process_types, 1):
+            stage_path = 'configuration/workflows/1/stages/%s' % number
+            self._link(stages, 'stage', stage_path).set('name', name)
+            stage = self._entity('stg:stage', stage_path, name=name, index=str(number))
+            self._link(stage, 'workflow', 'configuration/workflows/1')
+            self._link(stage, 'protocol', 'configuration/protocols/1')
+            self._link(stage, 'step', self.protocol_steps[path])
+            self._add(stage_path, stage)
+        self._add('configuration/workflows/1', root)
+
+        root = self._entity('kit:reagent-kit', 'reagentkits/1')
+        self._text(root, 'name', 'Index kit')
+        self._text(root, 'supplier', 'Supplier Inc.')
+        self._text(root, 'archived', 'false')
+        self._add('reagentkits/1', root)
+        root = self._entity('lot:reagent-lot', 'reagentlots/1', limsid='RL1')
+        self._link(root, 'reagent-kit', 'reagentkits/1')
+        self._text(root, 'name', 'Index kit lot 1')
+        self._text(root, 'lot-number', 'LOT0001')
+        self._text(root, 'status', 'ACTIVE')
+        self._text(root, 'usage-count', '0')
+        self._link(root, 'created-by', 'researchers/1')
+        self._add('reagentlots/1', root)
+
+        # One index per well of a plate, so that pools have distinct labels
+        self.indexes = []
+        for number in range(1, self.container_wells + 1):
+            name = 'Index %03d' % number
+            sequence = ''.join(self.random.choice('ACGT') for i in range(8))
+            root = self._entity('rtp:reagent-type', 'reagenttypes/%s' % number, name=name)
+            self._text(root, 'reagent-category', 'Index')
+            special = ElementTree.SubElement(root, 'special-type', name='Index')
+            ElementTree.SubElement(special, 'attribute', name='Sequence', value=sequence)
+            self._add('reagenttypes/%s' % number, root)
+            self.indexes.append(name)
+
+    def _protocol_step(self, path, number, type_path, name):
+        "Write the XML of a protocol step, and of its queue, empty."
+        root = self._entity('protstepcnf:step', path, name=name,
+                            **{'protocol-uri': self.uri('configuration/protocols/1')})
+        self._text(root, 'protocol-step-index', str(number))
+        self._link(root, 'process-type', type_path).text = name
+        self._text(ElementTree.SubElement(root, 'container-types'), 'container-type',
+                   '%s well plate' % self.container_wells)
+        for tag in ('queue-fields', 'step-fields', 'sample-fields', 'step-properties', 'epp-triggers'):
+            ElementTree.SubElement(root, tag)
+        self._link(root, 'queue', 'queues/%s' % number)
+        self._add(path, root)
+
+        root = self._entity('ri:queue', 'queues/%s' % number, name=name,
+                            **{'protocol-step-uri': self.uri(path)})
+        ElementTree.SubElement(root, 'artifacts')
+        self._add('queues/%s' % number, root)
+
+    # Samples and genealogy
+
+    def _project(self, number):
+        project_id = 'P%s' % number
+        root = self._entity('prj:project', 'projects/%s' % project_id, limsid=project_id)
+        self._text(root, 'name', 'Project %s' % number)
+        self._text(root, 'open-date', self._date())
+        self._link(root, 'researcher', 'researchers/1')
+        self._udf(root, 'Application', 'Sequencing', type='String')
+        file_id = self._id('40-')
+        self._link(root, nsmap('file:file'), 'files/%s' % file_id, limsid=file_id)
+        self._add('projects/%s' % project_id, root)
+
+        root = self._entity('file:file', 'files/%s' % file_id, limsid=file_id)
+        self._text(root, 'attached-to', self.uri('projects/%s' % project_id))
+        self._text(root, 'content-location', 'sftp://lims.example.com/files/%s/samplesheet.csv' % project_id)
+        self._text(root, 'original-location', '/data/%s/samplesheet.csv' % project_id)
+        self._text(root, 'is-published', 'false')
+        self._add('files/%s' % file_id, root)
+
+        analytes = []
+        placer = self._plates()
+        for index in range(1, self.samples_per_project + 1):
+            sample_id = 'ADM%sA%s' % (number, index)
+            artifact_id = '%sPA1' % sample_id
+            root = self._entity('smp:sample', 'samples/%s' % sample_id, limsid=sample_id)
+            self._text(root, 'name', 'P%s_%s' % (number, index))
+            self._text(root, 'date-received', self._date())
+            self._link(root, 'project', 'projects/%s' % project_id, limsid=project_id)
+            self._link(root, 'submitter', 'researchers/1')
+            self._link(root, 'artifact', 'artifacts/%s' % artifact_id, limsid=artifact_id)
+            self._udf(root, 'Concentration', round(self.random.uniform(1, 100), 2))
+            if index == 1:
+                note_path = 'notes/%s' % self._id('')
+                self._link(root, 'note', note_path)
+                note = self._entity('ri:note', note_path)
+                note.text = 'Received with low volume'
+                self._add(note_path, note)
+            self._add('samples/%s' % sample_id, root)
+            analytes.append(dict(id=artifact_id, name='P%s_%s' % (number, index),
+                                 samples=[sample_id], labels=[], parent=None))
+            self._artifact(analytes[-1], placer)
+        self._flush_plates(placer)
+
+        for step, (type_path, type_name) in enumerate(self.process_types[:self.steps]):
+            last = step == self.steps - 1
+            analytes = self._process(type_path, analytes, label=last and bool(self.pool_size))
+        if self.pool_size:
+            self._pool(self.process_types[-1][0], analytes)
+
+    def _plates(self):
+        "Return a new placer filling plates of the configured type in order."
+        return dict(container=None, wells=[], placements=[])
+
+    def _place(self, placer, artifact_id):
+        "Return the (container id, well) of the next free well."
+        if not placer['wells']:
+            self._flush_plates(placer)
+            placer['container'] = self._id('27-')
+            placer['wells'] = well_names(self.container_wells)
+            placer['placements'] = []
+        well = placer['wells'].pop(0)
+        placer['placements'].append((artifact_id, well))
+        return placer['container'], well
+
+    def _flush_plates(self, placer):
+        "Write the XML of the plate being filled."
+        container_id = placer['container']
+        if container_id is None:
+            return
+        root = self._entity('con:container', 'containers/%s' % container_id, limsid=container_id)
+        self._text(root, 'name', 'Plate %s' % container_id)
+        self._link(root, 'type', self.container_type).set('name', '%s well plate' % self.container_wells)
+        self._text(root, 'occupied-wells', str(len(placer['placements'])))
+        for artifact_id, well in placer['placements']:
+            placement = self._link(root, 'placement', 'artifacts/%s' % artifact_id, limsid=artifact_id)
+            self._text(placement, 'value', well)
+        self._text(root, 'state', 'Populated')
+        self._add('containers/%s' % container_id, root)
+        placer['container'] = None
+
+    def _artifact(self, analyte, placer=None, type='Analyte', output_type='Analyte'):
+        "Write the XML of an artifact."
+        root = self._entity('art:artifact', 'artifacts/%s' % analyte['id'], limsid=analyte['id'])
+        self._text(root, 'name', analyte['name'])
+        self._text(root, 'type', type)
+        self._text(root, 'output-type', output_type)
+        if analyte['parent']:
+            self._link(root, 'parent-process', 'processes/%s' % analyte['parent'], limsid=analyte['parent'])
+        self._text(root, 'qc-flag', 'UNKNOWN')
+        if placer is not None:
+            container_id, well = self._place(placer, analyte['id'])
+            analyte['location'] = (container_id, well)
+            location = ElementTree.SubElement(root, 'location')
+            self._link(location, 'container', 'containers/%s' % container_id, limsid=container_id)
+            self._text(location, 'value', well)
+        self._text(root, 'working-flag', 'true')
+        for sample_id in analyte['samples']:
+            self._link(root, 'sample', 'samples/%s' % sample_id, limsid=sample_id)
+        for label in analyte['labels']:
+            ElementTree.SubElement(root, 'reagent-label', name=label)
+        if type == 'Analyte':
+            self._udf(root, 'Concentration', round(self.random.uniform(1, 100), 2))
+            if len(analyte['samples']) == 1:
+                self.lineages.setdefault(analyte['samples'][0], []).append(analyte['id'])
+        self._add('artifacts/%s' % analyte['id'], root)
+
+    def _process(self, type_path, inputs, label=False):
+        "Write a process with per-input outputs. Return its output analytes."
+        process_id = self._id('24-')
+        maps = []
+        outputs = []
+        placer = self._plates()
+        for position, analyte in enumerate(inputs):
+            for replicate in range(self.replicates):
+                output = dict(id=self._id('2-'), name=analyte['name'], samples=analyte['samples'],
+                              labels=[], parent=process_id)
+                if label:
+                    output['labels'] = [self.indexes[position % len(self.indexes)]]
+                self._artifact(output, placer)
+                outputs.append(output)
+                maps.append((analyte, output, 'Analyte', 'PerInput'))
+            if self.result_files:
+                result = dict(id=self._id('92-'), name=analyte['name'], samples=analyte['samples'],
+                              labels=[], parent=process_id)
+                self._artifact(result, type='ResultFile', output_type='ResultFile')
+                maps.append((analyte, result, 'ResultFile', 'PerInput'))
+        self._flush_plates(placer)
+        self._process_xml(process_id, type_path, maps)
+        return outputs
+
+    def _pool(self, type_path, inputs):
+        "Write a process pooling the inputs by pool_size."
+        process_id = self._id('24-')
+        maps = []
+        placer = self._plates()
+        for start in range(0, len(inputs), self.pool_size):
+            members = inputs[start:start + self.pool_size]
+            pool = dict(id=self._id('2-'), name='Pool %s' % (start // self.pool_size + 1),
+                        samples=[s for member in members for s in member['samples']],
+                        labels=[l for member in members for l in member['labels']], parent=process_id)
+            self._artifact(pool, placer)
+            maps.extend((member, pool, 'Analyte', 'PerAllInputs') for member in members)
+        self._flush_plates(placer)
+        self._process_xml(process_id, type_path, maps)
+
+    def _process_xml(self, process_id, type_path, maps):
+        "Write the XML of the process, and of its step."
+        root = self._entity('prc:process', 'processes/%s' % process_id, limsid=process_id)
+        type_name = dict(self.process_types)[type_path]
+        self._link(root, 'type', type_path).text = type_name
+        self._text(root, 'date-run', self._date())
+        self._link(root, 'technician', 'researchers/2')
+        self._link(root, 'instrument', 'instruments/1')
+        self._process_maps(root, process_id, maps)
+        self._udf(root, 'Run number', self.random.randint(1, 1000))
+        self._add('processes/%s' % process_id, root)
+
+        path = 'steps/%s' % process_id
+        configuration = self.protocol_steps[type_path]
+        pools = OrderedDict()
+        for input, output, output_type, generation in maps:
+            if generation == 'PerAllInputs':
+                pools.setdefault(output['id'], (output, []))[1].append(input)
+        tags = ['actions', 'placements', 'details', 'reagent-lots', 'program-status']
+        if pools:
+            tags.append('pools')
+        root = self._entity('stp:step', path, limsid=process_id, **{'current-state': 'Completed'})
+        self._link(root, 'configuration', configuration).text = type_name
+        for tag in tags:
+            self._link(root, tag, '%s/%s' % (path, tag))
+        self._add(path, root)
+
+        outputs = OrderedDict((output['id'], output) for input, output, output_type, generation in maps
+                              if output_type == 'Analyte')
+        last = type_path == self.process_types[-1][0]
+        root = self._step_part('stp:actions', path, 'actions', configuration)
+        next_actions = ElementTree.SubElement(root, 'next-actions')
+        for output_id in outputs:
+            ElementTree.SubElement(next_actions, 'next-action', {
+                'artifact-uri': self.uri('artifacts/%s' % output_id),
+                'action': 'complete' if last else 'nextstep'})
+        self._add('%s/actions' % path, root)
+
+        root = self._step_part('stp:placements', path, 'placements', configuration)
+        selected = ElementTree.SubElement(root, 'selected-containers')
+        placements = ElementTree.SubElement(root, 'output-placements')
+        containers = []
+        for output_id, output in outputs.items():
+            container_id, well = output['location']
+            if container_id not in containers:
+                containers.append(container_id)
+                self._link(selected, 'container', 'containers/%s' % container_id)
+            placement = self._link(placements, 'output-placement', 'artifacts/%s' % output_id)
+            location = ElementTree.SubElement(placement, 'location')
+            self._link(location, 'container', 'containers/%s' % container_id, limsid=container_id)
+            self._text(location, 'value', well)
+        self._add('%s/placements' % path, root)
+
+        root = self._step_part('stp:program-status', path, 'program-status', configuration)
+        self._text(root, 'status', 'OK')
+        self._text(root, 'message', 'Completed')
+        self._add('%s/program-status' % path, root)
+
+        if pools:
+            root = self._step_part('stp:pools', path, 'pools', configuration)
+            pooled = ElementTree.SubElement(root, 'pooled-inputs')
+            for output, members in pools.values():
+                pool = ElementTree.SubElement(pooled, 'pool', {
+                    'output-uri': self.uri('artifacts/%s' % output['id']), 'name': output['name']})
+                for member in members:
+                    self._link(pool, 'input', 'artifacts/%s' % member['id'], limsid=member['id'])
+            ElementTree.SubElement(root, 'available-inputs')
+            self._add('%s/pools' % path, root)
+
+        root = self._entity('stp:details', '%s/details' % path)
+        self._process_maps(ElementTree.SubElement(root, 'input-output-maps'), process_id, maps)
+        ElementTree.SubElement(root, 'fields')
+        self._add('%s/details' % path, root)
+
+        root = self._entity('stp:lots', '%s/reagent-lots' % path)
+        self._link(ElementTree.SubElement(root, 'reagent-lots'), 'reagent-lot', 'reagentlots/1', limsid='RL1')
+        self._add('%s/reagent-lots' % path, root)
+
+    def _step_part(self, tag, step_path, name, configuration):
+        "Return the root element of a resource of the step."
+        root = self._entity(tag, '%s/%s' % (step_path, name))
+        self._link(root, 'step', step_path)
+        self._link(root, 'configuration', configuration)
+        return root
+
+    def _process_maps(self, parent, process_id, maps):
+        for input, output, output_type, generation in maps:
+            node = ElementTree.SubElement(parent, 'input-output-map')
+            source = self._link(node, 'input', 'artifacts/%s' % input['id'], limsid=input['id'])
+            source.set('post-process-uri', self.uri('artifacts/%s' % input['id']))
+            if input['parent']:
+                self._link(source, 'parent-process', 'processes/%s' % input['parent'], limsid=input['parent'])
+            target = self._link(node, 'output', 'artifacts/%s' % output['id'], limsid=output['id'])
+            target.set('output-type', output_type)
+            target.set('output-generation-type', generation)
+
+
+def generate_dataset(baseuri, **kwargs):
+    """Return a synthetic dataset, a dictionary of entity XML by URI.
+    Keyword arguments as for DatasetGenerator."""
+    return DatasetGenerator(baseuri, **kwargs).generate()
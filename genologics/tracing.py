@@ -0,0 +1,191 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Tracing of the high-level operations of a Lims instance as nested spans,
+exported in the Chrome trace-event format (chrome://tracing, Perfetto).
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+import types
+from contextlib import contextmanager
+
+
+class Span(object):
+    "A timed operation, nested in the span open when it started on its thread."
+
+    def __init__(self, name, tags, parent=None):
+        self.name = name
+        self.tags = tags
+        self.parent = parent
+        self.thread = threading.current_thread().ident
+        self.start = time.time()
+        self.duration = None
+
+    def __repr__(self):
+        return "<Span %s %s>" % (self.name, self.tags)
+
+
+class Tracer(object):
+    """Collects the spans opened by the Lims methods, entity loads and the
+    HTTP requests of the Lims instances it is attached to.
+
+    tracer = Tracer()
+    lims = Lims(BASEURI, USERNAME, PASSWORD, tracer=tracer)
+    ...
+    tracer.export('trace.json')
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def attach(self, lims):
+        "Trace the operations and HTTP requests of the Lims instance."
+        lims.tracer = self
+        lims.add_hook('before', self._request_started)
+        lims.add_hook('after', self._request_ended)
+        lims.add_hook('error', self._request_ended)
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            stack = self._local.stack = []
+            return stack
+
+    def open(self, name, **tags):
+        "Start a span on the current thread and return it."
+        stack = self._stack()
+        span = Span(name, tags, parent=stack[-1] if stack else None)
+        stack.append(span)
+        return span
+
+    def suspend(self, span):
+        """Take the span, and the spans still open within it, off the stack
+        of the current thread; they stay open. Return them for resume."""
+        stack = self._stack()
+        for index, open_span in enumerate(stack):
+            if open_span is span:
+                suspended = stack[index:]
+                del stack[index:]
+                return suspended
+        return []
+
+    def resume(self, spans):
+        "Put the spans returned by suspend back on the stack of the current thread."
+        self._stack().extend(spans)
+
+    def close(self, span):
+        "End the span, which must be the innermost one open on the thread."
+        span.duration = time.time() - span.start
+        stack = self._stack()
+        if stack and stack[-1] is span:
+            stack.pop()
+        with self._lock:
+            self.spans.append(span)
+
+    def tag(self, **tags):
+        "Add tags to the innermost span open on the current thread, if any."
+        stack = self._stack()
+        if stack:
+            stack[-1].tags.update(tags)
+
+    @contextmanager
+    def span(self, name, **tags):
+        "Context of a span. Exceptions are recorded in the error tag."
+        span = self.open(name, **tags)
+        try:
+            yield span
+        except Exception as e:
+            span.tags['error'] = repr(e)
+            raise
+        finally:
+            self.close(span)
+
+    def _request_started(self, event):
+        event.span = self.open('%s %s' % (event.method, event.template),
+                               entity=event.entity, uri=event.uri)
+
+    def _request_ended(self, event):
+        span = getattr(event, 'span', None)
+        if span is None:
+            return
+        span.tags.update(status=event.status, bytes=event.bytes,
+                         parse_time=round(event.parse_time, 6))
+        if event.error is not None:
+            span.tags['error'] = repr(event.error)
+        self.close(span)
+
+    def chrome_trace(self):
+        "Return the spans as a Chrome trace-event dictionary."
+        pid = os.getpid()
+        with self._lock:
+            spans = list(self.spans)
+        events = []
+        for span in spans:
+            events.append(dict(name=span.name, cat='genologics', ph='X', pid=pid, tid=span.thread,
+                               ts=int(span.start * 1e6), dur=int(span.duration * 1e6),
+                               args=dict((k, v) for k, v in span.tags.items() if v is not None)))
+        events.sort(key=lambda e: (e['ts'], -e['dur']))
+        return dict(traceEvents=events, displayTimeUnit='ms')
+
+    def export(self, path):
+        "Write the spans to the file as a Chrome trace-event JSON document."
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f, default=str)
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+
+
+def traced(func):
+    """Decorator of Lims methods, opening a span named after the method.
+    The span of a method returning a generator, e.g. a list call with
+    stream=True, lasts until the generator is exhausted or closed, and
+    holds the requests sent while it is advanced."""
+    name = 'Lims.' + func.__name__
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        tracer = self.tracer
+        if tracer is None:
+            return func(self, *args, **kwargs)
+        span = tracer.open(name)
+        try:
+            result = func(self, *args, **kwargs)
+        except Exception as e:
+            span.tags['error'] = repr(e)
+            tracer.close(span)
+            raise
+        if isinstance(result, types.GeneratorType):
+            # Nothing was done yet, the span is carried on by the generator
+            span.tags['stream'] = True
+            return _traced_generator(tracer, span, tracer.suspend(span), result)
+        tracer.close(span)
+        return result
+    return wrapper
+
+
+def _traced_generator(tracer, span, suspended, generator):
+    "Yield the items of the generator, nesting in the span what it does."
+    try:
+        while True:
+            tracer.resume(suspended)
+            try:
+                item = next(generator)
+            except StopIteration:
+                return
+            except Exception as e:
+                span.tags['error'] = repr(e)
+                raise
+            finally:
+                suspended = tracer.suspend(span)
+            yield item
+    finally:
+        generator.close()
+        tracer.close(span)
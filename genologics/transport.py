@@ -0,0 +1,184 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+HTTP transport through which all the requests of a Lims instance are sent.
+"""
+
+import logging
+import random
+import time
+import zlib
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT = 16
+
+# Seconds before a request of the given verb times out; None waits forever.
+DEFAULT_TIMEOUTS = dict(GET=TIMEOUT, HEAD=TIMEOUT, PUT=None, POST=None, DELETE=None)
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+# Response encodings advertised to the server, which requests decodes
+ACCEPT_ENCODING = 'gzip, deflate'
+
+
+def gzip_compress(data, level=6):
+    "Return the data compressed in the gzip format."
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def not_sent(error):
+    "Whether the request failing with the error never reached the server."
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    # requests wraps the urllib3 error in a MaxRetryError
+    reason = getattr(reason, 'reason', reason)
+    return isinstance(reason, NewConnectionError)
+
+
+def streamed(kwargs):
+    """Whether the body of the request keyword arguments is read from a
+    file object, so that it cannot be sent again: files uploads or file
+    data."""
+    return bool(kwargs.get('files')) or hasattr(kwargs.get('data'), 'read')
+
+
+class Transport(object):
+    """Pooled HTTP transport for every verb, over both http and https.
+
+    Failed requests are retried with exponential backoff and jitter.
+    Only idempotent requests are retried after a read timeout, a broken
+    connection or a retryable status code; any request is retried when
+    the connection could not be established at all: timed out or refused.
+
+    Compressed responses are requested, and request bodies sent with
+    compress=True are gzipped when at least compress_min_size bytes.
+    """
+
+    def __init__(self, pool_size=100, timeouts=None, retries=0, backoff_factor=0.5,
+                 backoff_max=30, retry_status_codes=(502, 503, 504), governor=None,
+                 circuit_breaker=None, accept_encoding=ACCEPT_ENCODING, compress_min_size=None):
+        """pool_size: The number of connections kept open per host.
+        timeouts: dictionary of timeouts in seconds by verb, overriding
+                  DEFAULT_TIMEOUTS.
+        retries: The number of times a failed request is retried.
+        backoff_factor: Seconds to wait before the first retry; doubled
+                        on each following one, with full jitter.
+        backoff_max: Upper bound of the wait between two retries.
+        retry_status_codes: HTTP statuses on which to retry.
+        governor: An optional genologics.governor.Governor limiting the
+                  rate and concurrency of the requests.
+        circuit_breaker: An optional genologics.breaker.CircuitBreaker
+                  failing the requests fast while the LIMS is unhealthy.
+        accept_encoding: The Accept-Encoding header sent; 'identity' asks
+                  for uncompressed responses.
+        compress_min_size: Size in bytes from which the request bodies
+                  sent with compress=True are gzipped; None (default)
+                  never compresses, as not every server accepts it.
+        """
+        self.pool_size = pool_size
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        if timeouts:
+            self.timeouts.update(timeouts)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.retry_status_codes = retry_status_codes
+        self.governor = governor
+        self.circuit_breaker = circuit_breaker
+        self.compress_min_size = compress_min_size
+        # For optimization purposes, enables requests to persist connections
+        self.session = requests.Session()
+        # The connection pool has a default size of 10
+        self.adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        self.session.headers['Accept-Encoding'] = accept_encoding
+
+    def request(self, method, uri, idempotent=None, compress=False, **kwargs):
+        """Send the request and return the response.
+        idempotent: Whether the request may be safely repeated; by default
+                    decided from the method. The batch retrieve POST is.
+        compress: Whether the body may be gzipped, see compress_min_size.
+        The other keyword arguments are passed on to requests. A request
+        whose body is read from a file, see streamed, is never retried.
+        """
+        method = method.upper()
+        if compress:
+            self._compress(kwargs)
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        if 'timeout' not in kwargs:
+            kwargs['timeout'] = self.timeouts.get(method)
+        # A body read from a file is sent empty on a second attempt
+        retries = 0 if streamed(kwargs) else self.retries
+        attempt = 0
+        while True:
+            try:
+                response = self.send(method, uri, **kwargs)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                if attempt >= retries or not (idempotent or not_sent(e)): raise
+            else:
+                if (response.status_code not in self.retry_status_codes
+                        or not idempotent or attempt >= retries):
+                    return response
+                # Give the connection of a streamed response back to the pool
+                response.close()
+            delay = self.backoff(attempt)
+            logger.info("Retrying %s %s in %.2f seconds", method, uri, delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def _compress(self, kwargs):
+        "Gzip the data of the request keyword arguments if large enough."
+        data = kwargs.get('data')
+        if isinstance(data, str) and not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        if (self.compress_min_size is None or not isinstance(data, bytes)
+                or len(data) < self.compress_min_size):
+            return
+        kwargs['data'] = gzip_compress(data)
+        kwargs['headers'] = dict(kwargs.get('headers') or {}, **{'Content-Encoding': 'gzip'})
+
+    def send(self, method, uri, **kwargs):
+        """Send the request once over the pooled session, when the governor
+        and the circuit breaker allow."""
+        breaker = self.circuit_breaker
+        if breaker is not None:
+            breaker.before()
+        try:
+            if self.governor is None:
+                response = self._send(method, uri, **kwargs)
+            else:
+                with self.governor.slot(method):
+                    response = self._send(method, uri, **kwargs)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+            if breaker is not None:
+                breaker.failure()
+            raise
+        except Exception:
+            if breaker is not None:
+                breaker.cancel()
+            raise
+        if breaker is not None:
+            if response.status_code >= 500:
+                breaker.failure()
+            else:
+                breaker.success()
+        return response
+
+    def _send(self, method, uri, **kwargs):
+        "Send the request over the session."
+        return getattr(self.session, method.lower())(uri, **kwargs)
+
+    def backoff(self, attempt):
+        "Seconds to wait before the given retry, with full jitter."
+        return random.uniform(0, min(self.backoff_max, self.backoff_factor * (2 ** attempt)))
+
+    def close(self):
+        "Release the pooled connections."
+        self.session.close()
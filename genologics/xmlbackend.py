@@ -0,0 +1,121 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+XML engines parsing and serializing the LIMS data: the standard library
+ElementTree, or lxml when installed, which is several times faster on
+large responses. The engine is chosen per Lims instance:
+
+    lims = Lims(BASEURI, USERNAME, PASSWORD, xml_backend='auto')
+
+Both produce elements with the ElementTree API the descriptors use.
+Code adding elements to the XML of entities should do it by the parent
+element, e.g. with SubElement here, so as to work with either engine.
+"""
+
+from xml.etree import ElementTree
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+
+def SubElement(parent, tag, attrib={}, **extra):
+    """As ElementTree.SubElement, for the elements of any backend: the
+    new element is made by the parent."""
+    attrib = dict(attrib, **extra)
+    element = parent.makeelement(tag, attrib)
+    parent.append(element)
+    return element
+
+
+def _root(etree):
+    "Return the root element of the ElementTree, or the element given."
+    if hasattr(etree, 'getroot'):
+        return etree.getroot()
+    return etree
+
+
+def iter_children(backend, source):
+    """Yield each child of the root element of the XML read from the file
+    object as soon as its end tag is parsed. The child is removed from
+    the root when the caller resumes, so the tree held by the parser
+    stays the size of one child however large the document."""
+    root = None
+    depth = 0
+    for event, element in backend.iterparse(source, ('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = element
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1:
+            yield element
+            root.remove(element)
+
+
+class StdlibBackend(object):
+    "The xml.etree.ElementTree engine of the standard library."
+
+    name = 'stdlib'
+    ParseError = ElementTree.ParseError
+
+    def fromstring(self, data):
+        return ElementTree.fromstring(data)
+
+    def iterparse(self, source, events):
+        return ElementTree.iterparse(source, events=events)
+
+    def write(self, outfile, etree):
+        "Write the ElementTree or element as UTF-8 encoded XML to the open file."
+        ElementTree.ElementTree(_root(etree)).write(outfile, encoding='utf-8', xml_declaration=True)
+
+
+class LxmlBackend(object):
+    """The lxml engine. Elements built with xml.etree, e.g. by
+    Entity.create, are serialized by the standard library."""
+
+    name = 'lxml'
+
+    def __init__(self):
+        if lxml_etree is None:
+            raise ImportError("the lxml XML backend requires the lxml package")
+        self.ParseError = lxml_etree.XMLSyntaxError
+        # No entity expansion or network access; no limit on text size
+        self._parser = lxml_etree.XMLParser(resolve_entities=False, no_network=True, huge_tree=True)
+        self._stdlib = StdlibBackend()
+
+    def fromstring(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        return lxml_etree.fromstring(data, self._parser)
+
+    def iterparse(self, source, events):
+        return lxml_etree.iterparse(source, events=events, resolve_entities=False, no_network=True,
+                                    huge_tree=True)
+
+    def write(self, outfile, etree):
+        "Write the ElementTree or element as UTF-8 encoded XML to the open file."
+        root = _root(etree)
+        if not isinstance(root, lxml_etree._Element):
+            return self._stdlib.write(outfile, root)
+        outfile.write(lxml_etree.tostring(root, encoding='utf-8', xml_declaration=True, with_tail=False))
+
+
+BACKENDS = dict(stdlib=StdlibBackend, lxml=LxmlBackend)
+
+
+def get_backend(backend=None):
+    """Return the XML backend given by name, 'stdlib' (the default) or
+    'lxml', or 'auto' for lxml when installed and stdlib otherwise.
+    A backend instance is returned as is."""
+    if backend is None:
+        backend = 'stdlib'
+    if backend == 'auto':
+        backend = 'lxml' if lxml_etree is not None else 'stdlib'
+    if not isinstance(backend, str):
+        return backend
+    try:
+        return BACKENDS[backend]()
+    except KeyError:
+        raise ValueError("unknown XML backend '%s', not one of %s" % (backend, sorted(BACKENDS)))
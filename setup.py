@@ -42,8 +42,12 @@ setup(name='genologics',
       include_package_data=True,
       zip_safe=False,
       install_requires=[
-          "requests"
+          "requests",
+          "futures; python_version < '3.0'"
       ],
+      extras_require={
+          "lxml": ["lxml"],
+      },
       entry_points="""
       # -*- Entry points: -*-
       """,
@@ -0,0 +1,93 @@
+import sys
+
+import pytest
+
+if sys.version_info < (3, 7):
+    pytest.skip('AsyncLims requires Python 3.7 or later', allow_module_level=True)
+
+import asyncio
+from unittest import TestCase
+from unittest.mock import patch, Mock
+
+from genologics.async_lims import AsyncLims
+from genologics.entities import Artifact, Sample
+from genologics.tracing import Tracer
+
+
+class TestAsyncLims(TestCase):
+    url = 'http://testgenologics.com:4040'
+    samples_xml = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<smp:samples xmlns:smp="http://genologics.com/ri/sample">
+    <sample uri="{url}/api/v2/samples/s1" limsid="s1"/>
+    <sample uri="{url}/api/v2/samples/s2" limsid="s2"/>
+</smp:samples>
+""".format(url=url)
+    artifact_xml = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<art:artifact xmlns:art="http://genologics.com/ri/artifact" uri="{url}/api/v2/artifacts/a1" limsid="a1">
+<name>test_artifact</name>
+</art:artifact>
+""".format(url=url)
+    batch_xml = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<art:details xmlns:art="http://genologics.com/ri/artifact">
+<art:artifact uri="{url}/api/v2/artifacts/a1" limsid="a1"><name>art1</name></art:artifact>
+<art:artifact uri="{url}/api/v2/artifacts/a2" limsid="a2"><name>art2</name></art:artifact>
+</art:details>
+""".format(url=url)
+
+    def setUp(self):
+        self.lims = AsyncLims(self.url, username='test', password='password', max_workers=4)
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        self.lims.close()
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    @patch('requests.Session.get')
+    def test_aget(self, mocked_get):
+        mocked_get.return_value = Mock(content=self.artifact_xml, status_code=200)
+        root = self.run_async(self.lims.aget(self.url + '/api/v2/artifacts/a1'))
+        assert root.find('name').text == 'test_artifact'
+        assert mocked_get.call_count == 1
+
+    @patch('requests.Session.get')
+    def test_aget_instances(self, mocked_get):
+        mocked_get.return_value = Mock(content=self.samples_xml, status_code=200)
+        samples = self.run_async(self.lims._aget_instances(Sample))
+        assert [s.id for s in samples] == ['s1', 's2']
+        # A given start index is a single page, as with get_samples
+        samples = self.run_async(self.lims._aget_instances(Sample, params={'start-index': 3}))
+        assert [s.id for s in samples] == ['s1', 's2']
+        assert mocked_get.call_args[1]['params'] == {'start-index': 3}
+
+    @patch('requests.Session.get')
+    def test_aget_entities(self, mocked_get):
+        mocked_get.return_value = Mock(content=self.artifact_xml, status_code=200)
+        artifacts = [Artifact(self.lims, id='a%s' % i) for i in range(5)]
+        result = self.run_async(self.lims.aget_entities(artifacts))
+        assert result == artifacts
+        assert mocked_get.call_count == 5
+        assert all(a.root is not None for a in artifacts)
+
+    @patch('requests.Session.get')
+    def test_aget_entity_uses_entity_get(self, mocked_get):
+        mocked_get.return_value = Mock(content=self.artifact_xml, status_code=200, headers={})
+        tracer = Tracer()
+        tracer.attach(self.lims)
+        artifact = Artifact(self.lims, id='a1')
+        assert self.run_async(self.lims.aget_entity(artifact)) is artifact
+        assert artifact.name == 'test_artifact'
+        self.run_async(self.lims.aget_entity(artifact))
+        assert mocked_get.call_count == 1
+        assert [span.name for span in tracer.spans][-1] == 'Artifact.get'
+
+    @patch('requests.Session.post')
+    def test_aget_batch(self, mocked_post):
+        mocked_post.return_value = Mock(content=self.batch_xml, status_code=200)
+        artifacts = [Artifact(self.lims, id='a1'), Artifact(self.lims, id='a2')]
+        self.run_async(self.lims.aget_batch(artifacts))
+        assert mocked_post.call_count == 1
+        assert artifacts[0].name == 'art1'
+        assert artifacts[1].name == 'art2'
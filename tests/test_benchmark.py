@@ -0,0 +1,50 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from genologics import benchmark
+
+
+class TestBenchmark(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_report(self):
+        path = os.path.join(self.directory, 'results.json')
+        report = benchmark.main(['--sizes', '4', '8', '--repeat', '2', '--output', path])
+        with open(path) as f:
+            assert json.load(f) == report
+        assert len(report['results']) == 2 * len(benchmark.BENCHMARKS)
+        for result in report['results']:
+            assert result['size'] in (4, 8)
+            if result['error'] is None:
+                assert len(result['times']) == 2
+                assert result['min'] <= result['median']
+        assert [r for r in report['results'] if r['error'] is not None] == []
+
+    def test_prerendered(self):
+        fixture = benchmark.Fixture(4)
+        try:
+            for function in benchmark.list_pages, benchmark.get_batch_assign, benchmark.sample_history:
+                benchmark.measure(function, fixture, 1)
+                counts = dict(fixture.server.request_counts)
+                rendered = len(fixture.prerendered.responses)
+                function(fixture)()
+                # Served without the stand-in
+                assert fixture.server.request_counts == counts
+                assert len(fixture.prerendered.responses) == rendered
+        finally:
+            fixture.close()
+
+    def test_compare(self):
+        path = os.path.join(self.directory, 'baseline.json')
+        benchmark.main(['--sizes', '4', '--repeat', '1', '--only', 'list_pages', '--output', path])
+        output = os.path.join(self.directory, 'new.json')
+        report = benchmark.main(['--sizes', '4', '--repeat', '1', '--only', 'list_pages',
+                                 '--output', output, '--compare', path])
+        assert [r['name'] for r in report['results']] == ['list_pages']
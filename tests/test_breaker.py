@@ -0,0 +1,65 @@
+from sys import version_info
+from unittest import TestCase
+
+import requests
+
+from genologics.breaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+from genologics.lims import Lims
+
+if version_info[0] == 2:
+    from mock import patch, Mock
+else:
+    from unittest.mock import patch, Mock
+
+
+class TestCircuitBreaker(TestCase):
+    url = 'http://testgenologics.com:4040/api/v2/samples/s1'
+    sample_xml = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<smp:sample xmlns:smp="http://genologics.com/ri/sample" uri="http://testgenologics.com:4040/api/v2/samples/s1"/>
+"""
+
+    def setUp(self):
+        self.changes = []
+        self.breaker = CircuitBreaker(failure_threshold=2, cooldown=10,
+                                      on_state_change=lambda b, old, new: self.changes.append((old, new)))
+        self.lims = Lims('http://testgenologics.com:4040', 'test', 'password', circuit_breaker=self.breaker)
+
+    @patch('time.time', return_value=1000)
+    def test_opens_after_consecutive_failures(self, mocked_time):
+        with patch('requests.Session.get', side_effect=requests.exceptions.ReadTimeout()) as mocked_get:
+            for i in range(2):
+                self.assertRaises(requests.exceptions.ReadTimeout, self.lims.get, self.url)
+            assert self.breaker.state == OPEN
+            self.assertRaises(CircuitOpenError, self.lims.get, self.url)
+            assert mocked_get.call_count == 2
+        assert self.changes == [(CLOSED, OPEN)]
+
+    def test_success_resets_count(self):
+        responses = [Mock(status_code=503, content=''), Mock(status_code=200, content=self.sample_xml, headers={}),
+                     Mock(status_code=503, content='')]
+        with patch('requests.Session.get', side_effect=responses):
+            for i in range(3):
+                try:
+                    self.lims.get(self.url)
+                except requests.exceptions.HTTPError:
+                    pass
+        assert self.breaker.state == CLOSED
+        assert self.breaker.failures == 1
+
+    def test_half_open_probe(self):
+        with patch('time.time', return_value=1000):
+            self.breaker.failure()
+            self.breaker.failure()
+        with patch('time.time', return_value=1011):
+            self.breaker.before()
+            assert self.breaker.state == HALF_OPEN
+            # Only one probe at a time
+            self.assertRaises(CircuitOpenError, self.breaker.before)
+            self.breaker.failure()
+            assert self.breaker.state == OPEN
+        with patch('time.time', return_value=1022):
+            self.breaker.before()
+            self.breaker.success()
+        assert self.breaker.state == CLOSED
+        assert self.changes == [(CLOSED, OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, OPEN),
+                                (OPEN, HALF_OPEN), (HALF_OPEN, CLOSED)]
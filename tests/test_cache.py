@@ -0,0 +1,226 @@
+import shutil
+import tempfile
+from sys import version_info
+from unittest import TestCase
+
+import gc
+from concurrent.futures import ThreadPoolExecutor
+
+from genologics.cache import PersistentCache, LRUIdentityMap, IdentityMap, estimate_size, CachePolicy, \
+    FOREVER, NEVER
+from genologics.entities import Processtype, Artifact, Entity, StepActions
+from genologics.lims import Lims
+
+if version_info[0] == 2:
+    from mock import patch, Mock
+else:
+    from unittest.mock import patch, Mock
+
+url = 'http://testgenologics.com:4040'
+
+processtype_xml = """<?xml version='1.0' encoding='utf-8'?>
+<ptp:process-type xmlns:ptp="http://genologics.com/ri/processtype" uri="{url}/api/v2/processtypes/1" name="Sequencing"/>
+""".format(url=url)
+
+
+artifact_xml = """<?xml version='1.0' encoding='utf-8'?>
+<art:artifact xmlns:art="http://genologics.com/ri/artifact" uri="{url}/api/v2/artifacts/a1" limsid="a1">
+<name>test</name>
+</art:artifact>
+""".format(url=url)
+
+step_actions_xml = """<?xml version='1.0' encoding='utf-8'?>
+<stp:actions xmlns:stp="http://genologics.com/ri/step" uri="{url}/api/v2/steps/s1/actions">
+<next-actions>
+<next-action artifact-uri="{url}/api/v2/artifacts/a1" action="requeue"/>
+</next-actions>
+</stp:actions>
+""".format(url=url)
+
+
+class TestIdentityMap(TestCase):
+    def test_default(self):
+        lims = Lims(url, 'test', 'password')
+        assert isinstance(lims.cache, IdentityMap)
+        a = Artifact(lims, id='a1')
+        assert Artifact(lims, id='a1') is a
+        assert lims.cache.stats['Artifact'] == dict(hits=1, misses=1, evictions=0, bytes=0)
+
+    def test_plain_dict(self):
+        for lims in Lims(url, 'test', 'password', cache=dict()), Lims(url, 'test', 'password'):
+            lims.cache = {}
+            assert isinstance(lims.cache, IdentityMap)
+            artifact = Artifact(lims, id='a1')
+            with patch('requests.Session.get', return_value=Mock(content=artifact_xml, status_code=200)):
+                assert artifact.name == 'test'
+            assert Artifact(lims, id='a1') is artifact
+
+    def test_lru_eviction(self):
+        lims = Lims(url, 'test', 'password', cache=LRUIdentityMap(max_entities=2))
+        artifacts = [Artifact(lims, id='a{0}'.format(i)) for i in range(3)]
+        with patch('requests.Session.get', return_value=Mock(content=artifact_xml, status_code=200)) as mocked_get:
+            for artifact in artifacts:
+                assert artifact.name == 'test'
+            assert artifacts[0].root is None
+            assert artifacts[1].root is not None
+            # Evicted data is fetched again
+            assert artifacts[0].name == 'test'
+            assert mocked_get.call_count == 4
+            assert artifacts[1].root is None
+        stats = lims.cache.stats['Artifact']
+        assert stats['evictions'] == 2
+        assert stats['bytes'] == lims.cache.bytes == 2 * estimate_size(artifacts[0].root)
+        # Identity is kept while the instance is in use
+        assert Artifact(lims, id='a1') is artifacts[1]
+
+    def test_lru_max_bytes(self):
+        lims = Lims(url, 'test', 'password', cache=LRUIdentityMap(max_bytes=1))
+        artifact = Artifact(lims, id='a1')
+        with patch('requests.Session.get', return_value=Mock(content=artifact_xml, status_code=200)):
+            with patch('requests.Session.post', return_value=Mock(content=artifact_xml, status_code=200)):
+                with lims.unit_of_work():
+                    artifact.name = 'renamed'
+                    Artifact(lims, id='a2').get()
+                    # Modified data is not released within a unit of work
+                    assert artifact.root is not None
+            Artifact(lims, id='a3').get()
+            assert artifact.root is None
+
+    def test_lru_keeps_modified_and_in_use(self):
+        lims = Lims(url, 'test', 'password', cache=LRUIdentityMap(max_entities=2))
+        with patch('requests.Session.get', return_value=Mock(content=artifact_xml, status_code=200)):
+            artifact = Artifact(lims, id='a1')
+            artifact.name = 'edited'
+            for i in range(2, 5):
+                Artifact(lims, id='a{0}'.format(i)).get()
+            # Unsaved changes are never released
+            assert artifact.name == 'edited'
+
+            # Nor the data another thread used last
+            other = Artifact(lims, id='a5')
+            executor = ThreadPoolExecutor(max_workers=1)
+            executor.submit(other.get).result()
+            for i in range(6, 9):
+                Artifact(lims, id='a{0}'.format(i)).get()
+            assert other.root is not None
+            executor.shutdown()
+
+            # A UDF dictionary outliving the release of the data restores it when changed
+            kept = Artifact(lims, id='a9')
+            udf = kept.udf
+            for i in range(10, 13):
+                Artifact(lims, id='a{0}'.format(i)).get()
+            assert kept.root is None
+            udf['Concentration'] = 1.5
+            assert kept.root is not None
+            assert kept.udf['Concentration'] == 1.5
+            assert kept.xml().count(b'Concentration') == 1
+
+    def test_lru_keeps_step_edits(self):
+        lims = Lims(url, 'test', 'password', cache=LRUIdentityMap(max_entities=1))
+        actions = StepActions(lims, uri=lims.get_uri('steps', 's1', 'actions'))
+        with patch('requests.Session.get', return_value=Mock(content=step_actions_xml, status_code=200)):
+            next_actions = actions.next_actions
+        next_actions[0]['action'] = 'complete'
+        actions.next_actions = next_actions
+        with patch('requests.Session.get', return_value=Mock(content=artifact_xml, status_code=200)):
+            for i in range(3):
+                Artifact(lims, id='a{0}'.format(i)).get()
+        # The edited actions are kept and saved
+        assert actions.root is not None
+        with patch('requests.Session.put', return_value=Mock(content=step_actions_xml, status_code=200)) as mocked_put:
+            actions.put()
+            assert b'action="complete"' in mocked_put.call_args[1]['data']
+
+        # Released data cannot be saved, it is fetched again to be serialized
+        with patch('requests.Session.get', return_value=Mock(content=artifact_xml, status_code=200)):
+            Artifact(lims, id='a3').get()
+        assert actions.root is None
+        self.assertRaises(ValueError, actions.put)
+        with patch('requests.Session.get', return_value=Mock(content=step_actions_xml, status_code=200)):
+            assert b'next-actions' in actions.xml()
+
+    def test_lru_weak_stubs(self):
+        lims = Lims(url, 'test', 'password', cache=LRUIdentityMap(max_entities=10))
+        Artifact(lims, id='a1')
+        gc.collect()
+        assert len(lims.cache) == 0
+
+
+class TestCachePolicy(TestCase):
+    def test_ttl(self):
+        policy = CachePolicy({Entity: 5, Artifact: NEVER})
+        assert policy.ttl(Artifact) == NEVER
+        assert policy.ttl(Processtype) == 5
+        policy.set(Processtype, FOREVER)
+        assert policy.ttl(Processtype) is FOREVER
+        assert CachePolicy().ttl(Artifact) is FOREVER
+
+    def test_entity_get_honors_policy(self):
+        lims = Lims(url, 'test', 'password', cache_policy=CachePolicy({Artifact: 10}))
+        artifact = Artifact(lims, id='a1')
+        with patch('requests.Session.get', return_value=Mock(content=artifact_xml, status_code=200)) as mocked_get:
+            with patch('time.time', return_value=1000):
+                artifact.get()
+            with patch('time.time', return_value=1005):
+                assert artifact.name == 'test'
+                assert mocked_get.call_count == 1
+            with patch('time.time', return_value=1011):
+                assert artifact.name == 'test'
+                assert mocked_get.call_count == 2
+            with patch('time.time', return_value=1015):
+                assert artifact.name == 'test'
+                assert mocked_get.call_count == 2
+
+    def test_udf_edit_after_reload(self):
+        lims = Lims(url, 'test', 'password', cache_policy=CachePolicy(default=0))
+        artifact = Artifact(lims, id='a1')
+        changed_xml = artifact_xml.replace('<name>test</name>', '<name>changed</name>')
+        with patch('requests.Session.get', side_effect=[Mock(content=artifact_xml, status_code=200),
+                                                        Mock(content=changed_xml, status_code=200)]):
+            udf = artifact.udf
+            old = artifact.root
+            # Expired: read again
+            assert artifact.name == 'changed'
+            assert artifact.root is not old
+            udf['Concentration'] = 3
+        assert artifact._dirty
+        assert artifact.udf['Concentration'] == 3
+        assert artifact.xml().count(b'Concentration') == 1
+
+
+class TestPersistentCache(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_put_get(self):
+        cache = PersistentCache(self.directory, ttls={'Processtype': None, 'Lab': 10})
+        cache.put('uri1', 'Processtype', b'<a/>')
+        cache.put('uri2', 'Artifact', b'<b/>')
+        assert cache.get('uri1', 'Processtype') == b'<a/>'
+        assert cache.get('uri2', 'Artifact') is None
+        cache.discard('uri1')
+        assert cache.get('uri1', 'Processtype') is None
+
+    def test_ttl(self):
+        cache = PersistentCache(self.directory, ttls={'Lab': 10})
+        with patch('time.time', return_value=1000):
+            cache.put('uri1', 'Lab', b'<a/>')
+        with patch('time.time', return_value=1005):
+            assert cache.get('uri1', 'Lab') == b'<a/>'
+        with patch('time.time', return_value=1011):
+            assert cache.get('uri1', 'Lab') is None
+
+    def test_shared_between_lims(self):
+        with patch('requests.Session.get', return_value=Mock(content=processtype_xml, status_code=200)) as mocked_get:
+            for i in range(2):
+                lims = Lims(url, 'test', 'password', persistent_cache=PersistentCache(self.directory))
+                assert Processtype(lims, id='1').name == 'Sequencing'
+            assert mocked_get.call_count == 1
+            # Artifacts are not cached by default
+            for i in range(2):
+                Artifact(lims, id='a1').get(force=True)
+            assert mocked_get.call_count == 3
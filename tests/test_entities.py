@@ -205,7 +205,7 @@ class TestStepActions(TestEntities):
     def test_escalation(self):
         s = StepActions(uri=self.lims.get_uri('steps', 'step_id', 'actions'), lims=self.lims)
         with patch('requests.Session.get', return_value=Mock(content=self.step_actions_xml, status_code=200)):
-            with patch('requests.post', return_value=Mock(content=self.dummy_xml, status_code=200)):
+            with patch('requests.Session.post', return_value=Mock(content=self.dummy_xml, status_code=200)):
                 r = Researcher(uri='http://testgenologics.com:4040/researchers/r1', lims=self.lims)
                 a = Artifact(uri='http://testgenologics.com:4040/artifacts/r1', lims=self.lims)
                 expected_escalation = {
@@ -324,7 +324,7 @@ class TestReagentKits(TestEntities):
             assert r.archived == False
 
     def test_create_entity(self):
-        with patch('genologics.lims.requests.post', return_value=Mock(content=self.reagentkit_xml, status_code=201)):
+        with patch('requests.Session.post', return_value=Mock(content=self.reagentkit_xml, status_code=201)):
             r = ReagentKit.create(self.lims, name='regaentkitname', supplier='reagentProvider',
                                   website='www.reagentprovider.com', archived=False)
         self.assertRaises(TypeError, ReagentKit.create, self.lims, error='test')
@@ -345,7 +345,7 @@ class TestReagentLots(TestEntities):
     def test_create_entity(self):
         with patch('requests.Session.get', return_value=Mock(content=self.reagentkit_xml, status_code=200)):
             r = ReagentKit(uri=self.lims.get_uri('reagentkits', 'r1'), lims=self.lims)
-        with patch('genologics.lims.requests.post',
+        with patch('requests.Session.post',
                    return_value=Mock(content=self.reagentlot_xml, status_code=201)) as patch_post:
             l = ReagentLot.create(
                 self.lims,
@@ -364,7 +364,7 @@ class TestSample(TestEntities):
     sample_creation = generic_sample_creation_xml.format(url=url)
 
     def test_create_entity(self):
-        with patch('genologics.lims.requests.post',
+        with patch('requests.Session.post',
                    return_value=Mock(content=self.sample_creation, status_code=201)) as patch_post:
             l = Sample.create(
                 self.lims,
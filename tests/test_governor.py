@@ -0,0 +1,85 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sys import version_info
+from unittest import TestCase
+
+import requests
+
+from genologics.governor import Governor, TokenBucket
+from genologics.lims import Lims
+
+if version_info[0] == 2:
+    from mock import patch, Mock
+else:
+    from unittest.mock import patch, Mock
+
+
+class TestTokenBucket(TestCase):
+    def test_rate(self):
+        bucket = TokenBucket(rate=10, capacity=1)
+        with patch('time.time', return_value=100.0):
+            bucket._last = 100.0
+            assert bucket.acquire() == 0.0
+        with patch('time.time', side_effect=[100.05, 100.2]), patch('time.sleep') as mocked_sleep:
+            bucket.acquire()
+            assert abs(mocked_sleep.call_args[0][0] - 0.05) < 1e-6
+
+
+class TestGovernor(TestCase):
+    url = 'http://testgenologics.com:4040'
+
+    def test_concurrency_per_verb(self):
+        governor = Governor(concurrency={'GET': 2})
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def slow_get(*args, **kwargs):
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.01)
+            with lock:
+                active.pop()
+            return Mock(content='<a/>', status_code=200, headers={})
+
+        lims = Lims(self.url, 'test', 'password', governor=governor)
+        assert lims.transport.governor is governor
+        with patch('requests.Session.get', side_effect=slow_get):
+            executor = ThreadPoolExecutor(max_workers=6)
+            list(executor.map(lambda i: lims.get(self.url + '/api/v2/samples/%s' % i), range(12)))
+            executor.shutdown()
+        assert max(peak) == 2
+        assert governor._semaphore('PUT') is None
+
+    def test_adaptive_rate(self):
+        governor = Governor(rate=100, p95_target=0.5, window=10, min_rate=10)
+        for i in range(10):
+            governor.record(1.0)
+        assert governor.rate == 50
+        for i in range(20):
+            governor.record(1.0)
+        assert governor.rate == 12.5
+        for i in range(10):
+            governor.record(0.1)
+        assert governor.rate == 22.5
+        for i in range(200):
+            governor.record(0.1)
+        assert governor.rate == 100
+
+    def test_adaptive_rate_on_timeouts(self):
+        governor = Governor(rate=1000, burst=10, p95_target=0.001, window=5, min_rate=10)
+
+        def timeout(*args, **kwargs):
+            time.sleep(0.01)
+            raise requests.exceptions.Timeout()
+
+        lims = Lims(self.url, 'test', 'password', governor=governor)
+        with patch('requests.Session.get', side_effect=timeout):
+            for i in range(5):
+                self.assertRaises(requests.exceptions.Timeout, lims.get, self.url + '/api/v2/samples/%s' % i)
+        assert governor.rate == 500
+
+    def test_adaptive_needs_rate(self):
+        self.assertRaises(ValueError, Governor, p95_target=1)
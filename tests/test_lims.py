@@ -1,9 +1,18 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
 import xml
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from unittest import TestCase
 
 from requests.exceptions import HTTPError
 
-from genologics.lims import Lims
+from genologics.lims import Lims, BatchError, DownloadError
+from genologics.entities import Sample, Artifact, Process, File
+from genologics.standin import StandInServer
 try:
     callable(1)
 except NameError: # callable() doesn't exist in Python 3.0 and 3.1
@@ -71,10 +80,10 @@ class TestLims(TestCase):
     def test_put(self):
         lims = Lims(self.url, username=self.username, password=self.password)
         uri = '{url}/api/v2/samples/test_sample'.format(url=self.url)
-        with patch('requests.put', return_value=Mock(content = self.sample_xml, status_code=200)) as mocked_put:
+        with patch('requests.Session.put', return_value=Mock(content = self.sample_xml, status_code=200)) as mocked_put:
             response = lims.put(uri=uri, data=self.sample_xml)
             assert mocked_put.call_count == 1
-        with patch('requests.put', return_value=Mock(content = self.error_xml, status_code=400)) as mocked_put:
+        with patch('requests.Session.put', return_value=Mock(content = self.error_xml, status_code=400)) as mocked_put:
             self.assertRaises(HTTPError, lims.put, uri=uri, data=self.sample_xml)
             assert mocked_put.call_count == 1
 
@@ -82,10 +91,10 @@ class TestLims(TestCase):
     def test_post(self):
         lims = Lims(self.url, username=self.username, password=self.password)
         uri = '{url}/api/v2/samples'.format(url=self.url)
-        with patch('requests.post', return_value=Mock(content = self.sample_xml, status_code=200)) as mocked_put:
+        with patch('requests.Session.post', return_value=Mock(content = self.sample_xml, status_code=200)) as mocked_put:
             response = lims.post(uri=uri, data=self.sample_xml)
             assert mocked_put.call_count == 1
-        with patch('requests.post', return_value=Mock(content = self.error_xml, status_code=400)) as mocked_put:
+        with patch('requests.Session.post', return_value=Mock(content = self.error_xml, status_code=400)) as mocked_put:
             self.assertRaises(HTTPError, lims.post, uri=uri, data=self.sample_xml)
             assert mocked_put.call_count == 1
 
@@ -103,22 +112,24 @@ class TestLims(TestCase):
         file_end = """</file:file>"""
         glsstorage_xml = '\n'.join([xml_intro,file_start, attached, upload, content_loc, file_end]).format(url=self.url)
         file_post_xml = '\n'.join([xml_intro, file_start2, attached, upload, content_loc, file_end]).format(url=self.url)
-        with patch('requests.post', side_effect=[Mock(content=glsstorage_xml, status_code=200),
+        with patch('requests.Session.post', side_effect=[Mock(content=glsstorage_xml, status_code=200),
                                                  Mock(content=file_post_xml, status_code=200),
                                                  Mock(content="", status_code=200)]):
 
             file = lims.upload_new_file(Mock(uri=self.url+"/api/v2/samples/test_sample"),
                                         'filename_to_upload')
             assert file.id == "40-3501"
+            # The file is closed after the upload
+            assert mocked_open.return_value.__exit__.call_count == 1
 
-        with patch('requests.post', side_effect=[Mock(content=self.error_xml, status_code=400)]):
+        with patch('requests.Session.post', side_effect=[Mock(content=self.error_xml, status_code=400)]):
 
           self.assertRaises(HTTPError,
                             lims.upload_new_file,
                             Mock(uri=self.url+"/api/v2/samples/test_sample"),
                             'filename_to_upload')
 
-    @patch('requests.post', return_value=Mock(content = sample_xml, status_code=200))
+    @patch('requests.Session.post', return_value=Mock(content = sample_xml, status_code=200))
     def test_route_artifact(self, mocked_post):
         lims = Lims(self.url, username=self.username, password=self.password)
         artifact = Mock(uri=self.url+"/artifact/2")
@@ -127,6 +138,377 @@ class TestLims(TestCase):
 
 
 
+    def test_get_instances_read_ahead(self):
+        page1 = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<smp:samples xmlns:smp="http://genologics.com/ri/sample">
+    <sample uri="{url}/api/v2/samples/s1" limsid="s1"/>
+    <next-page uri="{url}/api/v2/samples?start-index=1"/>
+</smp:samples>""".format(url=self.url)
+        page2 = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<smp:samples xmlns:smp="http://genologics.com/ri/sample">
+    <sample uri="{url}/api/v2/samples/s2" limsid="s2"/>
+</smp:samples>""".format(url=self.url)
+        for read_ahead in (0, 1, 3):
+            lims = Lims(self.url, username=self.username, password=self.password, page_read_ahead=read_ahead)
+            with patch('requests.Session.get', side_effect=[Mock(content=page1, status_code=200),
+                                                            Mock(content=page2, status_code=200)]):
+                samples = lims.get_samples()
+            assert [s.id for s in samples] == ['s1', 's2']
+            assert len(lims.page_timings) == 2
+            assert lims.page_timings[1]['uri'] == '{url}/api/v2/samples?start-index=1'.format(url=self.url)
+
+    def test_get_instances_read_ahead_error(self):
+        lims = Lims(self.url, username=self.username, password=self.password, page_read_ahead=2)
+        with patch('requests.Session.get', return_value=Mock(content=self.error_xml, status_code=400)):
+            self.assertRaises(HTTPError, lims.get_samples)
+
+    def test_get_samples_stream(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        with patch('requests.Session.get', return_value=Mock(content=self.sample_xml, status_code=200)) as mocked_get:
+            samples = lims.get_samples(stream=True)
+            assert mocked_get.call_count == 0
+            assert next(samples).id == 'test_sample'
+            assert mocked_get.call_count == 1
+            self.assertRaises(StopIteration, next, samples)
+
+        with patch('requests.Session.get', return_value=Mock(content=self.sample_xml, status_code=200)):
+            result = list(lims._get_instances(Sample, add_info=True, stream=True))
+            assert result[0][0].id == 'test_sample'
+            assert 'limsid' in result[0][1]
+
+    def test_get_batch_chunks(self):
+        from xml.etree import ElementTree as ET
+        lims = Lims(self.url, username=self.username, password=self.password)
+
+        def batch_retrieve(uri, data=None, **kwargs):
+            links = ET.fromstring(data).findall('link')
+            arts = ''.join('<art:artifact limsid="{0}" uri="{1}"><name>{0}</name></art:artifact>'.format(
+                link.attrib['uri'].split('/')[-1], link.attrib['uri']) for link in links)
+            content = '<art:details xmlns:art="http://genologics.com/ri/artifact">{0}</art:details>'.format(arts)
+            return Mock(content=content, status_code=200)
+
+        for max_workers in (1, 3):
+            artifacts = [Artifact(lims, id='a{0}_{1}'.format(max_workers, i)) for i in range(5)]
+            with patch('requests.Session.post', side_effect=batch_retrieve) as mocked_post:
+                result = lims.get_batch(artifacts + artifacts[:1], chunk_size=2, max_workers=max_workers)
+                assert mocked_post.call_count == 3
+            assert sorted(a.id for a in result) == sorted(a.id for a in artifacts)
+            assert all(a.name == a.id for a in artifacts)
+
+        # A failing chunk raises once the others running are done
+        def failing_retrieve(uri, data=None, **kwargs):
+            if b'b_0' in data:
+                # Once the other chunk is running
+                time.sleep(0.05)
+                return Mock(content=self.error_xml, status_code=400)
+            time.sleep(0.2)
+            return batch_retrieve(uri, data=data)
+
+        artifacts = [Artifact(lims, id='b_{0}'.format(i)) for i in range(4)]
+        with patch('requests.Session.post', side_effect=failing_retrieve):
+            self.assertRaises(HTTPError, lims.get_batch, artifacts, chunk_size=2, max_workers=2)
+        assert [a.root is None for a in artifacts] == [True, True, False, False]
+
+    def test_adapt_chunk_size(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        assert lims._adapt_chunk_size(100, lims.BATCH_TARGET_SECONDS) == 100
+        assert lims._adapt_chunk_size(100, 0) == 200
+        assert lims._adapt_chunk_size(100, lims.BATCH_TARGET_SECONDS * 10) == 50
+        assert lims._adapt_chunk_size(lims.BATCH_MAX_CHUNK_SIZE, 0) == lims.BATCH_MAX_CHUNK_SIZE
+
+    def test_put_batch_bisects_failures(self):
+        from xml.etree import ElementTree as ET
+        lims = Lims(self.url, username=self.username, password=self.password)
+        artifacts = []
+        for i in range(5):
+            artifact = Artifact(lims, id='p{0}'.format(i))
+            artifact.root = ET.fromstring('<art:artifact xmlns:art="http://genologics.com/ri/artifact" '
+                                          'limsid="p{0}" uri="{1}"/>'.format(i, artifact.uri))
+            artifacts.append(artifact)
+        error_xml = self.error_xml
+
+        def batch_update(uri, data=None, **kwargs):
+            limsids = [node.attrib['limsid'] for node in ET.fromstring(data)]
+            if 'p3' in limsids:
+                return Mock(content=error_xml, status_code=400)
+            return Mock(content='<ri:links xmlns:ri="http://genologics.com/ri"/>', status_code=200)
+
+        with patch('requests.Session.post', side_effect=batch_update) as mocked_post:
+            result = lims.put_batch(artifacts, chunk_size=2, max_workers=2, raise_errors=False)
+            # p0-p1, p2-p3 (rejected), p4, then p2 and p3 alone
+            assert mocked_post.call_count == 5
+        assert not result.ok
+        assert sorted(a.id for a in result.succeeded) == ['p0', 'p1', 'p2', 'p4']
+        assert [(a.id, type(e)) for a, e in result.failed] == [('p3', HTTPError)]
+        with patch('requests.Session.post', side_effect=batch_update):
+            # Still caught by the callers of the HTTPError raised before
+            with self.assertRaises(HTTPError) as context:
+                lims.put_batch(artifacts, chunk_size=2)
+        assert isinstance(context.exception, BatchError)
+        assert [a.id for a, e in context.exception.result.failed] == ['p3']
+        assert context.exception.response.status_code == 400
+
+        # Errors of the request as a whole fail the chunk without bisecting
+        for status_code in 403, 429, 503:
+            with patch('requests.Session.post',
+                       return_value=Mock(content=error_xml, status_code=status_code)) as mocked_post:
+                result = lims.put_batch(artifacts, chunk_size=2, raise_errors=False)
+                assert mocked_post.call_count == 3
+            assert len(result.failed) == 5
+
+    def test_unit_of_work(self):
+        from xml.etree import ElementTree as ET
+        lims = Lims(self.url, username=self.username, password=self.password)
+        artifacts = []
+        for i in range(3):
+            artifact = Artifact(lims, id='u{0}'.format(i))
+            artifact.root = ET.fromstring('<art:artifact xmlns:art="http://genologics.com/ri/artifact" '
+                                          'limsid="u{0}" uri="{1}"><name>a</name></art:artifact>'.format(i, artifact.uri))
+            artifacts.append(artifact)
+        process = Process(lims, id='p1')
+        process.root = ET.fromstring('<prc:process xmlns:prc="http://genologics.com/ri/process"/>')
+        with patch('requests.Session.post', return_value=Mock(content=self.sample_xml, status_code=200)) as mocked_post:
+            with patch('requests.Session.put', return_value=Mock(content=self.sample_xml, status_code=200)) as mocked_put:
+                with lims.unit_of_work() as unit:
+                    for artifact in artifacts:
+                        artifact.name = 'renamed'
+                    process.date_run = '2016-01-01'
+                    assert mocked_post.call_count == 0
+                assert mocked_post.call_count == 1
+                assert mocked_put.call_count == 1
+        assert len(unit.results[Artifact].succeeded) == 3
+        assert unit.failed == []
+        assert lims._unit_of_work is None
+        # Outside of a unit of work nothing is recorded
+        artifacts[0].name = 'again'
+        assert unit.modified == []
+
+        # Edits made on other threads are not recorded by the unit
+        with patch('requests.Session.post', return_value=Mock(content=self.error_xml, status_code=400)):
+            with self.assertRaises(BatchError) as context:
+                with lims.unit_of_work() as unit:
+                    ThreadPoolExecutor(max_workers=1).submit(setattr, artifacts[1], 'name', 'other').result()
+                    assert unit.modified == []
+                    artifacts[0].name = 'failing'
+        assert [a.id for a, e in context.exception.result.failed] == ['u0']
+        assert lims._unit_of_work is None
+
+        # The failures of an explicit flush are kept after a later one
+        with self.assertRaises(BatchError) as context:
+            with lims.unit_of_work() as unit:
+                artifacts[0].name = 'first'
+                with patch('requests.Session.post', return_value=Mock(content=self.error_xml, status_code=400)):
+                    unit.flush()
+                artifacts[1].name = 'second'
+                with patch('requests.Session.post', return_value=Mock(content=self.sample_xml, status_code=200)):
+                    unit.flush()
+        assert [a.id for a, e in context.exception.result.failed] == ['u0']
+        assert [a.id for a in context.exception.result.succeeded] == ['u1']
+        assert lims._unit_of_work is None
+
+    def test_get_revalidation(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        uri = '{url}/api/v2/samples/test_sample'.format(url=self.url)
+        # Validators are kept for the entities of the cache only
+        sample = Sample(lims, uri=uri)
+        with patch('requests.Session.get', return_value=Mock(content=self.sample_xml, status_code=200,
+                                                             headers={'ETag': '"v1"'})):
+            lims.get(uri + '/other')
+            assert list(lims.validators) == []
+            root = lims.get(uri)
+        with patch('requests.Session.get', return_value=Mock(content='', status_code=304, headers={})) as mocked_get:
+            assert lims.get(uri, current=root) is root
+            assert mocked_get.call_args[1]['headers']['If-None-Match'] == '"v1"'
+        with patch('requests.Session.get', return_value=Mock(content=self.sample_xml, status_code=200,
+                                                             headers={})):
+            assert lims.get(uri, current=root) is root
+        with patch('requests.Session.get', return_value=Mock(content=self.error_no_msg_xml, status_code=200,
+                                                             headers={})):
+            assert lims.get(uri, current=root) is not root
+        assert lims.revalidation_stats == dict(requests=3, not_modified=1, unchanged=1)
+        assert lims.revalidation_hit_rate == 2.0 / 3
+
+    def test_entity_get_force(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        sample = Sample(lims, id='test_sample')
+        with patch('requests.Session.get', return_value=Mock(content=self.sample_xml, status_code=200,
+                                                             headers={'Last-Modified': 'yesterday'})):
+            sample.get()
+        root = sample.root
+        with patch('requests.Session.get', return_value=Mock(content='', status_code=304, headers={})) as mocked_get:
+            sample.get(force=True)
+            assert mocked_get.call_args[1]['headers']['If-Modified-Since'] == 'yesterday'
+        assert sample.root is root
+        # Forcing discards unsaved changes: the reload is not conditional
+        name = sample.name
+        sample.name = 'LOCAL EDIT'
+        with patch('requests.Session.get', return_value=Mock(content=self.sample_xml, status_code=200,
+                                                             headers={'Last-Modified': 'yesterday'})) as mocked_get:
+            sample.get()
+            assert mocked_get.call_count == 0
+            sample.get(force=True)
+            assert 'If-Modified-Since' not in mocked_get.call_args[1]['headers']
+        assert sample.name == name
+
+    def test_get_single_flight(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        uri = self.url + '/api/v2/samples/test_sample'
+
+        def slow_get(*args, **kwargs):
+            # Hold the request until the other caller waits on it
+            deadline = time.time() + 5
+            while lims.coalesced_requests < 1 and time.time() < deadline:
+                time.sleep(0.001)
+            return Mock(content=self.sample_xml, status_code=200, headers={})
+
+        with patch('requests.Session.get', side_effect=slow_get) as mocked_get:
+            executor = ThreadPoolExecutor(max_workers=2)
+            roots = list(executor.map(lambda i: lims.get(uri), range(2)))
+            executor.shutdown()
+            assert mocked_get.call_count == 1
+        assert roots[0] is roots[1]
+        assert lims.coalesced_requests == 1
+        assert not lims._in_flight
+        with patch('requests.Session.get', return_value=Mock(content=self.error_xml, status_code=400)):
+            self.assertRaises(HTTPError, lims.get, uri)
+        assert not lims._in_flight
+
+    def test_stream_parse(self):
+        server = StandInServer(page_size=3)
+        for i in range(7):
+            server.add('samples/S%s' % i, """<smp:sample xmlns:smp="http://genologics.com/ri/sample" """
+                       """uri="{base}api/v2/samples/S{i}" limsid="S{i}"><name>s{i}</name></smp:sample>"""
+                       .format(base=server.baseuri, i=i))
+        lims = Lims(server.baseuri, self.username, self.password, transport=server.transport(),
+                    stream_parse=True)
+        samples = lims.get_samples()
+        assert [s.id for s in samples] == ['S%s' % i for i in range(7)]
+        assert server.request_counts['GET samples'] == 3
+        first = next(iter(lims.get_samples(stream=True)))
+        assert first.id == 'S0'
+        assert server.request_counts['GET samples'] == 4
+
+        samples = list(lims.get_batch(samples, chunk_size=4))
+        assert sorted(s.name for s in samples) == ['s%s' % i for i in range(7)]
+        assert len(lims.get_batch(samples[:2], force=True)) == 2
+        server.inject_errors(1, status=500)
+        self.assertRaises(HTTPError, lims.get_samples)
+        server.stop()
+
+    def test_stream_resolve_chunks(self):
+        server = StandInServer()
+        for i in range(5):
+            server.add('artifacts/A%s' % i, """<art:artifact xmlns:art="http://genologics.com/ri/artifact" """
+                       """uri="{base}api/v2/artifacts/A{i}" limsid="A{i}"><name>a{i}</name>"""
+                       """<type>Analyte</type></art:artifact>""".format(base=server.baseuri, i=i))
+        lims = Lims(server.baseuri, self.username, self.password, transport=server.transport())
+        lims.BATCH_CHUNK_SIZE = 2
+        artifacts = list(lims.get_artifacts(stream=True, resolve=True))
+        assert sorted(a.name for a in artifacts) == ['a%s' % i for i in range(5)]
+        assert server.request_counts['POST artifacts/batch/retrieve'] == 3
+        server.stop()
+
+    def test_download_file(self):
+        server = StandInServer()
+        content = bytes(bytearray(range(256))) * 40
+        for i in range(3):
+            server.add('files/40-%s' % i, """<file:file xmlns:file="http://genologics.com/ri/file" """
+                       """uri="{base}api/v2/files/40-{i}" limsid="40-{i}"><original-location>"""
+                       """/data/run{i}.csv</original-location></file:file>""".format(base=server.baseuri, i=i))
+            server.files['40-%s' % i] = content
+        transport = server.transport()
+        send = transport._send
+        interrupted = []
+
+        sent = []
+
+        def truncated_send(method, uri, **kwargs):
+            sent.append(kwargs.get('headers') or {})
+            response = send(method, uri, **kwargs)
+            if not interrupted:
+                interrupted.append(uri)
+                response.raw = BytesIO(response.raw.read(1000))
+            return response
+        transport._send = truncated_send
+        lims = Lims(server.baseuri, self.username, self.password, transport=transport)
+        lims.transport.backoff = lambda attempt: 0
+        out = BytesIO()
+        assert lims.download_file(out, id='40-0', chunk_size=256) == len(content)
+        assert out.getvalue() == content
+        assert server.request_counts['GET files/{id}/download'] == 2
+        etag = '"%s"' % hashlib.sha1(content).hexdigest()
+        assert sent[-1]['Range'] == 'bytes=1000-' and sent[-1]['If-Range'] == etag
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'run.csv')
+            # Resumed with the validator kept next to it
+            with open(path + '.part', 'wb') as partial:
+                partial.write(content[:3000])
+            with open(path + '.part.validator', 'w') as f:
+                f.write(etag)
+            lims.download_file(path, id='40-0')
+            assert sent[-1]['Range'] == 'bytes=3000-'
+            assert not os.path.exists(path + '.part')
+            assert not os.path.exists(path + '.part.validator')
+            with open(path, 'rb') as f:
+                assert f.read() == content
+            # Restarted without it, or when the content changed since
+            for validator in None, '"stale"':
+                with open(path + '.part', 'wb') as partial:
+                    partial.write(b'x' * 3000)
+                if validator is not None:
+                    with open(path + '.part.validator', 'w') as f:
+                        f.write(validator)
+                lims.download_file(path, id='40-0')
+                assert sent[-1].get('If-Range') == validator
+                with open(path, 'rb') as f:
+                    assert f.read() == content
+
+            files = [File(lims, uri=server.api_root + 'files/40-%s' % i) for i in range(3)]
+            result = lims.download_files(files, directory, max_workers=2)
+            assert not result.failed and len(result.succeeded) == 3
+            with open(os.path.join(directory, '40-2_run2.csv'), 'rb') as f:
+                assert f.read() == content
+            del server.files['40-1']
+            result = lims.download_files(files, directory)
+            assert [f.id for f, error in result.failed] == ['40-1']
+        finally:
+            shutil.rmtree(directory)
+        server.stop()
+
+    def test_download_restart(self):
+        server = StandInServer()
+        content = b'abcdef' * 500
+        server.files['40-0'] = content
+        transport = server.transport()
+        send = transport._send
+        interrupted = []
+
+        def truncated_send(method, uri, **kwargs):
+            response = send(method, uri, **kwargs)
+            # Without a validator the download restarts from the start
+            response.headers.pop('ETag', None)
+            response.headers.pop('Last-Modified', None)
+            if not interrupted:
+                interrupted.append(uri)
+                response.raw = BytesIO(response.raw.read(1000))
+            return response
+        transport._send = truncated_send
+        lims = Lims(server.baseuri, self.username, self.password, transport=transport)
+        lims.transport.backoff = lambda attempt: 0
+        out = BytesIO()
+        out.write(b'HEADER:')
+        assert lims.download_file(out, id='40-0', chunk_size=256) == len(content)
+        assert out.getvalue() == b'HEADER:' + content
+
+        class Pipe(BytesIO):
+            def seekable(self):
+                return False
+        del interrupted[:]
+        self.assertRaises(DownloadError, lims.download_file, Pipe(), id='40-0', chunk_size=256)
+        server.stop()
+
     def test_tostring(self):
         lims = Lims(self.url, username=self.username, password=self.password)
         from xml.etree import ElementTree as ET
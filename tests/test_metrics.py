@@ -0,0 +1,117 @@
+import json
+from io import StringIO
+from sys import version_info
+from unittest import TestCase
+
+import requests
+
+from genologics.entities import Sample
+from genologics.lims import Lims
+from genologics.metrics import MetricsRegistry, uri_template, entity_name
+from genologics.standin import StandInServer
+from genologics.transport import Transport
+
+if version_info[0] == 2:
+    from mock import patch, Mock
+else:
+    from unittest.mock import patch, Mock
+
+url = 'http://testgenologics.com:4040'
+
+sample_xml = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<smp:sample xmlns:smp="http://genologics.com/ri/sample" uri="{url}/api/v2/samples/s1" limsid="s1">
+<name>test</name>
+</smp:sample>
+""".format(url=url)
+
+artifact_xml = """<?xml version='1.0' encoding='utf-8'?>
+<art:artifact xmlns:art="http://genologics.com/ri/artifact" uri="{base}api/v2/artifacts/A{i}" limsid="A{i}">
+<name>artifact {i}</name>
+<type>Analyte</type>
+<udf:field xmlns:udf="http://genologics.com/ri/userdefined" type="Numeric" name="Concentration">1.5</udf:field>
+</art:artifact>
+"""
+
+
+class TestUriTemplate(TestCase):
+    def test_template(self):
+        prefix = url + '/api/v2/'
+        assert uri_template(url + '/api/v2/samples/ADM123A1?x=1', prefix) == 'samples/{id}'
+        assert uri_template(url + '/api/v2/steps/24-1/details', prefix) == 'steps/{id}/details'
+        assert uri_template(url + '/api/v2/artifacts/batch/retrieve', prefix) == 'artifacts/batch/retrieve'
+        # Outside of the API root, the host and port are left out
+        assert uri_template(url + '/api', prefix) == 'api'
+        assert uri_template('https://other:8443/api/v2/samples/S1', prefix) == 'api/{id}/samples/{id}'
+
+    def test_entity_name(self):
+        assert entity_name('samples/{id}') == 'Sample'
+        assert entity_name('configuration/udfs/{id}') == 'Udfconfig'
+        assert entity_name('route/artifacts') is None
+
+
+class TestHooks(TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.lims = Lims(url, 'test', 'password', metrics=self.registry)
+
+    def test_events(self):
+        events = []
+        self.lims.add_hook('before', lambda e: events.append(('before', e.status)))
+        self.lims.add_hook('after', lambda e: events.append(('after', e.status, e.entity, e.bytes)))
+        with patch('requests.Session.get', return_value=Mock(content=sample_xml, status_code=200, headers={})):
+            Sample(self.lims, id='s1').get()
+        assert events == [('before', None), ('after', 200, 'Sample', len(sample_xml))]
+
+    def test_registry(self):
+        with patch('requests.Session.get', return_value=Mock(content=sample_xml, status_code=200, headers={})):
+            for i in range(3):
+                self.lims.get(url + '/api/v2/samples/s%s' % i)
+        with patch('requests.Session.get', return_value=Mock(content='<a/>', status_code=404, headers={})):
+            self.assertRaises(requests.exceptions.HTTPError, self.lims.get, url + '/api/v2/samples/s9')
+        endpoint = self.registry.endpoints[('GET', 'samples/{id}')]
+        assert endpoint['count'] == 4
+        assert endpoint['errors'] == 1
+        assert endpoint['statuses'] == {200: 3, 404: 1}
+        assert sum(endpoint['histogram']) == 4
+        assert endpoint['entity'] == 'Sample'
+
+        out = StringIO()
+        self.registry.dump(out, format='json')
+        snapshot = json.loads(out.getvalue())
+        assert snapshot['endpoints'][0]['template'] == 'samples/{id}'
+        out = StringIO()
+        self.registry.dump(out)
+        assert 'samples/{id}' in out.getvalue()
+
+
+class TestByteAccounting(TestCase):
+    def test_wire_bytes(self):
+        registry = MetricsRegistry()
+        with StandInServer(compress_min_size=100) as server:
+            for i in range(20):
+                server.add('artifacts/A%s' % i, artifact_xml.format(base=server.baseuri, i=i))
+            lims = Lims(server.baseuri, 'test', 'password', metrics=registry,
+                        transport=Transport(compress_min_size=100))
+            artifacts = lims.get_artifacts()
+            lims.get_batch(artifacts)
+            for artifact in artifacts:
+                artifact.name = 'renamed'
+            assert lims.put_batch(artifacts).ok
+            assert b'renamed' in server.entities['artifacts/A3']
+            lims.stream_parse = True
+            assert len(lims.get_artifacts()) == 20
+            lims.transport.close()
+
+        endpoint = registry.endpoints[('GET', 'artifacts')]
+        assert endpoint['count'] == 2
+        assert 0 < endpoint['wire_bytes'] < endpoint['bytes']
+        retrieve = registry.endpoints[('POST', 'artifacts/batch/retrieve')]
+        assert retrieve['wire_bytes'] < retrieve['bytes']
+        assert retrieve['sent_wire_bytes'] == retrieve['sent_bytes'] > 0
+        update = registry.endpoints[('POST', 'artifacts/batch/update')]
+        assert 0 < update['sent_wire_bytes'] < update['sent_bytes']
+        totals = registry.snapshot()['totals']
+        assert totals['wire_bytes'] < totals['bytes']
+        out = StringIO()
+        registry.dump(out)
+        assert 'on the wire' in out.getvalue()
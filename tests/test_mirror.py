@@ -0,0 +1,141 @@
+import os
+import shutil
+import tempfile
+import time
+from sys import version_info
+from unittest import TestCase
+from xml.etree import ElementTree
+
+from genologics.cache import CachePolicy, NEVER
+from genologics.entities import Project, Container, Sample
+from genologics.lims import Lims
+from genologics.metrics import MetricsRegistry
+from genologics.mirror import LimsMirror
+from genologics.tracing import Tracer
+
+if version_info[0] == 2:
+    from mock import patch, Mock
+else:
+    from unittest.mock import patch, Mock
+
+url = 'http://testgenologics.com:4040'
+
+projects_xml = """<?xml version='1.0' encoding='utf-8'?>
+<prj:projects xmlns:prj="http://genologics.com/ri/project">
+<project uri="{url}/api/v2/projects/p1" limsid="p1"><name>first</name></project>
+<project uri="{url}/api/v2/projects/p2" limsid="p2"><name>second</name></project>
+</prj:projects>
+""".format(url=url)
+
+project_xml = """<?xml version='1.0' encoding='utf-8'?>
+<prj:project xmlns:prj="http://genologics.com/ri/project" uri="{{url}}/api/v2/projects/{id}" limsid="{id}">
+<name>{name}</name>
+</prj:project>
+"""
+
+
+def project_response(uri, params=None, **kwargs):
+    "Fake GET of the project list and of single projects."
+    if uri.endswith('/projects'):
+        return Mock(content=projects_xml, status_code=200, headers={})
+    id = uri.rsplit('/', 1)[1]
+    xml = project_xml.format(id=id, name='project ' + id).replace('{url}', url)
+    return Mock(content=xml, status_code=200, headers={})
+
+
+class TestLimsMirror(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.lims = Lims(url, 'test', 'password')
+        self.mirror = LimsMirror(self.lims, os.path.join(self.directory, 'mirror.sqlite'), classes=[Project])
+
+    def tearDown(self):
+        self.mirror.close()
+        shutil.rmtree(self.directory)
+
+    def test_unsupported_class(self):
+        self.assertRaises(ValueError, LimsMirror, self.lims, os.path.join(self.directory, 'x.sqlite'),
+                          classes=[Sample])
+
+    def test_sync_and_read(self):
+        with patch('requests.Session.get', side_effect=project_response) as mocked_get:
+            assert self.mirror.sync() == {'Project': 2}
+            first_params = mocked_get.call_args_list[0][1]['params']
+            assert 'last-modified' not in first_params
+        assert self.mirror.count(Project) == 2
+        assert self.mirror.watermark(Project) is not None
+        other = Lims(url, 'test', 'password')
+        reader = LimsMirror(other, self.mirror.path, classes=[Project])
+        with patch('requests.Session.get') as mocked_get:
+            project = reader.get(Project, id='p2')
+            assert project.name == 'project p2'
+            assert sorted(p.id for p in reader.all(Project)) == ['p1', 'p2']
+            assert reader.get(Project, id='p3') is None
+            assert mocked_get.call_count == 0
+        reader.close()
+
+    def test_sync_instrumented(self):
+        registry = MetricsRegistry()
+        tracer = Tracer()
+        lims = Lims(url, 'test', 'password', metrics=registry, tracer=tracer)
+        mirror = LimsMirror(lims, os.path.join(self.directory, 'other.sqlite'), classes=[Project])
+        with patch('requests.Session.get', side_effect=project_response):
+            mirror.sync()
+        mirror.close()
+        assert registry.endpoints[('GET', 'projects')]['count'] == 1
+        assert registry.endpoints[('GET', 'projects/{id}')]['count'] == 2
+        assert any(span['name'] == 'GET projects' for span in tracer.chrome_trace()['traceEvents'])
+
+    def test_reads_ignore_cache_policy(self):
+        with patch('requests.Session.get', side_effect=project_response):
+            self.mirror.sync()
+        other = Lims(url, 'test', 'password', cache_policy=CachePolicy(default=NEVER))
+        reader = LimsMirror(other, self.mirror.path, classes=[Project])
+        with patch('requests.Session.get') as mocked_get:
+            for project in reader.all(Project) + [reader.get(Project, id='p1')]:
+                assert project.name.startswith('project ')
+            assert mocked_get.call_count == 0
+        reader.close()
+
+    def test_leaves_live_instances_alone(self):
+        project = Project(self.lims, id='p1')
+        with patch('requests.Session.get', side_effect=project_response):
+            project.name = 'unsaved'
+            self.mirror.sync()
+            assert project.name == 'unsaved'
+            mirrored = self.mirror.get(Project, id='p1')
+            assert mirrored is not project and mirrored is not self.mirror.get(Project, id='p1')
+            assert mirrored.name == 'project p1'
+            assert project.name == 'unsaved'
+        # The data is dated from the sync, to the second
+        assert time.time() - 60 < mirrored._fetched <= time.time()
+        assert mirrored._fetched == int(mirrored._fetched)
+
+    def test_sync_in_chunks(self):
+        self.mirror.reader.BATCH_CHUNK_SIZE = 1
+        with patch.object(self.mirror, '_store', wraps=self.mirror._store) as mocked_store:
+            with patch('requests.Session.get', side_effect=project_response):
+                assert self.mirror.sync() == {'Project': 2}
+            assert mocked_store.call_count == 2
+        assert len(self.mirror.reader.cache) == 0
+
+    def test_delta_sync(self):
+        with patch('requests.Session.get', side_effect=project_response):
+            self.mirror.sync()
+        watermark = self.mirror.watermark(Project)
+        with patch('requests.Session.get', side_effect=project_response) as mocked_get:
+            self.mirror.sync()
+            assert mocked_get.call_args_list[0][1]['params']['last-modified'] == watermark
+        assert self.mirror.count(Project) == 2
+
+    def test_batch_classes(self):
+        mirror = LimsMirror(self.lims, os.path.join(self.directory, 'c.sqlite'), classes=[Container])
+        containers = [Container(mirror.reader, id='c1')]
+        with patch.object(mirror.reader, 'get_containers', return_value=iter(containers)) as mocked_list:
+            with patch.object(mirror.reader, 'get_batch') as mocked_batch:
+                containers[0].root = ElementTree.fromstring('<container/>')
+                mirror.sync(since='2020-01-01T00:00:00.000Z')
+                mocked_list.assert_called_once_with(last_modified='2020-01-01T00:00:00.000Z', stream=True)
+                mocked_batch.assert_called_once_with(containers, force=True)
+        assert mirror.count(Container) == 1
+        mirror.close()
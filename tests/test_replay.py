@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+from sys import version_info
+from unittest import TestCase
+
+from genologics.entities import Sample
+from genologics.lims import Lims
+from genologics.replay import RecordingTransport, ReplayTransport, ReplayError
+
+if version_info[0] == 2:
+    from mock import patch, Mock
+else:
+    from unittest.mock import patch, Mock
+
+url = 'http://testgenologics.com:4040'
+
+samples_xml = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<smp:samples xmlns:smp="http://genologics.com/ri/sample">
+    <sample uri="{url}/api/v2/samples/s1" limsid="s1"/>
+</smp:samples>
+""".format(url=url)
+
+sample_xml = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<smp:sample xmlns:smp="http://genologics.com/ri/sample" uri="{url}/api/v2/samples/s1" limsid="s1">
+<name>{name}</name>
+</smp:sample>
+"""
+
+
+class TestRecordReplay(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'traffic.jsonl.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def record(self):
+        lims = Lims(url, 'test', 'password', transport=RecordingTransport(self.path))
+        with patch('requests.Session.get', return_value=Mock(content=samples_xml, status_code=200,
+                                                             headers={'Content-Type': 'application/xml'})):
+            lims.get_samples(name='s1')
+        sample = Sample(lims, id='s1')
+        with patch('requests.Session.get', return_value=Mock(content=sample_xml.format(url=url, name='old'),
+                                                             status_code=200, headers={})):
+            sample.get()
+        with patch('requests.Session.put', return_value=Mock(content=sample_xml.format(url=url, name='new'),
+                                                             status_code=200, headers={})):
+            sample.name = 'new'
+            sample.put()
+        with patch('requests.Session.get', return_value=Mock(content=sample_xml.format(url=url, name='new'),
+                                                             status_code=200, headers={})):
+            lims.get(sample.uri)
+        lims.transport.close()
+
+    def test_replay(self):
+        self.record()
+        transport = ReplayTransport(self.path)
+        lims = Lims(url, 'test', 'password', transport=transport)
+        with patch('requests.Session.get') as mocked_get, patch('requests.Session.put') as mocked_put:
+            samples = lims.get_samples(name='s1')
+            assert [s.id for s in samples] == ['s1']
+            assert samples[0].name == 'old'
+            samples[0].name = 'new'
+            samples[0].put()
+            assert lims.get(samples[0].uri).find('name').text == 'new'
+            assert mocked_get.call_count == 0
+            assert mocked_put.call_count == 0
+        self.assertRaises(ReplayError, lims.get_samples, name='s2')
+
+    @patch('time.sleep')
+    def test_replay_latency(self, mocked_sleep):
+        self.record()
+        lims = Lims(url, 'test', 'password', transport=ReplayTransport(self.path, latency=2))
+        lims.get_samples(name='s1')
+        assert mocked_sleep.call_count == 1
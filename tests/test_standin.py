@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import requests
+
+from genologics.entities import Artifact, Sample, Step
+from genologics.lims import Lims
+from genologics.standin import StandInServer
+from genologics.transport import Transport
+
+sample_xml = """<?xml version='1.0' encoding='utf-8'?>
+<smp:sample xmlns:smp="http://genologics.com/ri/sample" uri="{base}api/v2/samples/S{i}" limsid="S{i}">
+<name>sample {i}</name>
+</smp:sample>
+"""
+
+artifact_xml = """<?xml version='1.0' encoding='utf-8'?>
+<art:artifact xmlns:art="http://genologics.com/ri/artifact" uri="{base}api/v2/artifacts/A{i}" limsid="A{i}">
+<name>artifact {i}</name>
+</art:artifact>
+"""
+
+
+class TestStandInServer(TestCase):
+    def setUp(self):
+        self.server = StandInServer(page_size=2).start()
+        base = 'http://lims.example.com/'
+        xml_dict = dict()
+        for i in range(5):
+            xml_dict[base + 'api/v2/samples/S%s' % i] = sample_xml.format(base=base, i=i)
+            xml_dict[base + 'api/v2/artifacts/A%s' % i] = artifact_xml.format(base=base, i=i)
+        self.server.load(xml_dict, baseuri=base)
+        self.lims = Lims(self.server.baseuri, 'test', 'password')
+
+    def tearDown(self):
+        self.lims.transport.close()
+        self.server.stop()
+
+    def test_paging_and_get(self):
+        self.lims.check_version()
+        samples = self.lims.get_samples()
+        assert [s.id for s in samples] == ['S%s' % i for i in range(5)]
+        assert self.server.request_counts['GET samples'] == 3
+        assert samples[3].name == 'sample 3'
+        assert [s.id for s in self.lims.get_samples(name='sample 1')] == ['S1']
+
+    def test_put_and_revalidate(self):
+        sample = Sample(self.lims, id='S1')
+        sample.get()
+        sample.get(force=True)
+        assert self.lims.revalidation_stats['not_modified'] == 1
+        sample.name = 'renamed'
+        sample.put()
+        other = Lims(self.server.baseuri, 'test', 'password')
+        assert Sample(other, id='S1').name == 'renamed'
+
+    def test_batch(self):
+        artifacts = [Artifact(self.lims, id='A%s' % i) for i in range(5)]
+        self.lims.get_batch(artifacts)
+        assert artifacts[4].name == 'artifact 4'
+        for artifact in artifacts:
+            artifact.name = 'updated'
+        assert self.lims.put_batch(artifacts).ok
+        assert b'updated' in self.server.entities['artifacts/A2']
+        self.lims.route_artifacts(artifacts[:1], workflow_uri=self.server.api_root + 'configuration/workflows/1')
+        assert len(self.server.routed) == 1
+
+    def test_files(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'report.txt')
+            with open(path, 'wb') as f:
+                f.write(b'file content')
+            file = self.lims.upload_new_file(Sample(self.lims, id='S1'), path)
+        finally:
+            shutil.rmtree(directory)
+        assert self.lims.get_file_contents(id=file.id).read() == b'file content'
+
+    def test_errors(self):
+        self.server.inject_errors(1)
+        self.assertRaises(requests.exceptions.HTTPError, self.lims.get_samples)
+        lims = Lims(self.server.baseuri, 'test', 'password', transport=Transport(retries=2, backoff_factor=0))
+        self.server.inject_errors(2)
+        assert len(lims.get_samples()) == 5
+
+    def test_in_process_and_filters(self):
+        lims = Lims(self.server.baseuri, 'test', 'password', transport=self.server.transport())
+        sample = Sample(lims, id='S1')
+        sample.get()
+        sample.get(force=True)
+        assert lims.revalidation_stats['not_modified'] == 1
+        self.server.add('artifacts/A1', artifact_xml.format(base=self.server.baseuri, i=1).replace(
+            '</name>', '</name><type>Analyte</type><sample limsid="S1" uri="%sapi/v2/samples/S1"/>'
+            % self.server.baseuri))
+        artifacts = lims.get_artifacts(sample_name='sample 1', type='Analyte')
+        assert [a.id for a in artifacts] == ['A1']
+        assert lims.get_artifacts(samplelimsid='S2') == []
+
+    def test_step_advance(self):
+        uri = self.server.api_root + 'steps/24-1'
+        self.server.add('steps/24-1', '<stp:step xmlns:stp="http://genologics.com/ri/step" '
+                                      'uri="%s" limsid="24-1" current-state="Record Details"/>' % uri)
+        step = Step(self.lims, id='24-1')
+        step.advance()
+        assert step.root.attrib['uri'] == uri
+        assert step.id == '24-1'
+        assert not [path for path in self.server.entities if path.startswith('steps/24-1/')]
+        # Acting on an unknown entity creates nothing
+        self.assertRaises(requests.exceptions.HTTPError, self.lims.post,
+                          self.server.api_root + 'steps/24-2/advance', step.xml())
+        assert 'steps/24-2' not in self.server.entities
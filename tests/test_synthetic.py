@@ -0,0 +1,101 @@
+import re
+from sys import version_info
+from unittest import TestCase
+
+from genologics import test_utils
+from genologics.entities import Sample, Process, Step, ReagentType, Workflow, Queue
+from genologics.lims import Lims
+from genologics.standin import StandInServer
+from genologics.synthetic import generate_dataset, well_names
+
+if version_info[0] == 2:
+    from mock import patch
+else:
+    from unittest.mock import patch
+
+url = 'http://testgenologics.com:4040'
+
+
+class TestSynthetic(TestCase):
+    def test_wells(self):
+        assert well_names(96)[:2] == ['A:1', 'A:2']
+        assert well_names(384)[-1] == 'P:24'
+
+    def test_scale(self):
+        dataset = generate_dataset(url, projects=2, samples_per_project=100, steps=2,
+                                   replicates=2, pool_size=8, container_wells=384)
+        uris = [uri for uri in dataset if '/samples/' in uri]
+        assert len(uris) == 200
+        # 100 root analytes, 200 + 400 step outputs and 50 pools per project
+        analytes = [uri for uri in dataset if '/artifacts/' in uri and b'<type>Analyte' in dataset[uri]]
+        assert len(analytes) == 2 * (100 + 200 + 400 + 50)
+        assert generate_dataset(url, seed=3) == generate_dataset(url, seed=3)
+
+    def test_consistent_with_entities(self):
+        test_utils.XML_DICT = generate_dataset(url, samples_per_project=12, steps=2, pool_size=4)
+        lims = Lims(url, 'test', 'password')
+        with patch('genologics.lims.Lims.get', side_effect=test_utils.patched_get):
+            sample = Sample(lims, id='ADM1A3')
+            assert sample.project.name == 'Project 1'
+            container, well = sample.artifact.location
+            assert well == 'A:3'
+            assert container.type.name == '96 well plate'
+            assert container.placements[well] == sample.artifact
+
+            pooling = Process(lims, id='24-3')
+            outputs = pooling.all_outputs()
+            assert len(outputs) == 3
+            pool = outputs[0]
+            assert len(pool.samples) == 4
+            assert len(pool.reagent_labels) == 4
+            first_input = pooling.all_inputs()[0]
+            assert first_input.parent_process.type.name == 'Step 2'
+            assert first_input.parent_process.parent_processes()[0].type.name == 'Step 1'
+
+            step = Step(lims, id='24-1')
+            assert step.current_state == 'Completed'
+            assert len(step.details.input_output_maps) == 24
+            assert step.configuration.type.name == 'Step 1'
+            assert [a['action'] for a in step.actions.next_actions] == ['nextstep'] * 12
+            artifact, (container, well) = step.placements.placement_list[0]
+            assert artifact.location == (container, well)
+            assert step.placements.selected_containers == [container]
+            assert step.program_status.status == 'OK'
+            assert step.reagent_lots[0].lot_number == 'LOT0001'
+            assert ReagentType(lims, id='1').sequence is not None
+
+            pools = Step(lims, id='24-3').step_pools.pools
+            assert len(pools) == 3
+            for entry in pools:
+                assert entry['output'] in outputs
+                assert set(entry['inputs']) == set(i['uri'] for i, o in pooling.input_output_maps
+                                                   if o['uri'] == entry['output'])
+            assert Step(lims, id='24-3').actions.next_actions[0]['action'] == 'complete'
+
+            stage = Workflow(lims, id='1').stages[1]
+            assert stage.index == 2
+            assert stage.step.type.name == 'Step 2'
+            assert stage.protocol.steps[1] == stage.step
+            assert Queue(lims, id='2').artifacts == []
+            assert sample.project.files[0].original_location == '/data/P1/samplesheet.csv'
+            assert Sample(lims, id='ADM1A1').notes[0].content == 'Received with low volume'
+        test_utils.XML_DICT = {}
+
+    def test_links_resolve(self):
+        dataset = generate_dataset(url, samples_per_project=12, steps=2, pool_size=4)
+        for uri, xml in dataset.items():
+            for link in re.findall(br'[a-z-]*uri="([^"]*)"', xml):
+                assert link.decode('utf-8') in dataset, (uri, link)
+
+    def test_feeds_standin(self):
+        dataset = generate_dataset(url, samples_per_project=20, steps=1, pool_size=0)
+        with StandInServer(page_size=10) as server:
+            server.load(dataset, baseuri=url)
+            lims = Lims(server.baseuri, 'test', 'password')
+            assert len(lims.get_samples()) == 20
+            assert len(lims.get_processes()) == 1
+            assert lims.get_projects()[0].name == 'Project 1'
+            step = Step(lims, id='24-1')
+            assert step.actions.next_actions[0]['action'] == 'complete'
+            assert step.configuration.name == 'Step 1'
+            lims.transport.close()
@@ -0,0 +1,114 @@
+import json
+import os
+import shutil
+import tempfile
+from sys import version_info
+from unittest import TestCase
+
+from genologics.entities import Sample, Artifact
+from genologics.lims import Lims
+from genologics.standin import StandInServer
+from genologics.tracing import Tracer
+
+if version_info[0] == 2:
+    from mock import patch, Mock
+else:
+    from unittest.mock import patch, Mock
+
+url = 'http://testgenologics.com:4040'
+
+samples_xml = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<smp:samples xmlns:smp="http://genologics.com/ri/sample">
+    <sample uri="{url}/api/v2/samples/s1" limsid="s1"/>
+</smp:samples>
+""".format(url=url)
+
+sample_xml = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<smp:sample xmlns:smp="http://genologics.com/ri/sample" uri="{url}/api/v2/samples/s1" limsid="s1">
+<name>test</name>
+</smp:sample>
+""".format(url=url)
+
+batch_xml = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<art:details xmlns:art="http://genologics.com/ri/artifact">
+<art:artifact uri="{url}/api/v2/artifacts/a1" limsid="a1"><name>art1</name></art:artifact>
+</art:details>
+""".format(url=url)
+
+
+class TestTracer(TestCase):
+    def setUp(self):
+        self.tracer = Tracer()
+        self.lims = Lims(url, 'test', 'password', tracer=self.tracer)
+
+    def test_untraced_by_default(self):
+        assert Lims(url, 'test', 'password').tracer is None
+
+    def test_nested_spans(self):
+        with patch('requests.Session.get', return_value=Mock(content=samples_xml, status_code=200, headers={})):
+            samples = self.lims.get_samples()
+        with patch('requests.Session.get', return_value=Mock(content=sample_xml, status_code=200, headers={})):
+            assert samples[0].name == 'test'
+        names = [span.name for span in self.tracer.spans]
+        assert names == ['GET samples', 'Lims.get_samples', 'GET samples/{id}', 'Sample.get']
+        request, listing, load_request, load = self.tracer.spans
+        assert request.parent is listing
+        assert load_request.parent is load
+        assert load.tags == dict(entity='Sample', id='s1', lazy=True)
+        assert load_request.tags['status'] == 200
+
+    def test_stream_span(self):
+        with patch('requests.Session.get', return_value=Mock(content=samples_xml, status_code=200, headers={})):
+            samples = self.lims.get_samples(stream=True)
+            assert self.tracer.spans == []
+            assert [s.id for s in samples] == ['s1']
+        request, listing = self.tracer.spans
+        assert listing.name == 'Lims.get_samples'
+        assert listing.tags == dict(stream=True)
+        assert request.parent is listing
+        assert self.tracer._stack() == []
+
+        # A request streamed across the items stays nested in the list span
+        server = StandInServer(page_size=2)
+        for i in range(3):
+            server.add('samples/S%s' % i, """<smp:sample xmlns:smp="http://genologics.com/ri/sample" """
+                       """uri="{base}api/v2/samples/S{i}" limsid="S{i}"/>""".format(base=server.baseuri, i=i))
+        tracer = Tracer()
+        lims = Lims(server.baseuri, 'test', 'password', transport=server.transport(), tracer=tracer,
+                    stream_parse=True)
+        for sample in lims.get_samples(stream=True):
+            with tracer.span('consumer'):
+                assert tracer._stack()[0].name == 'consumer'
+        names = [span.name for span in tracer.spans]
+        assert names.count('consumer') == 3 and names.count('GET samples') == 2
+        listing = tracer.spans[-1]
+        assert listing.name == 'Lims.get_samples'
+        assert all(span.parent is listing for span in tracer.spans if span.name == 'GET samples')
+        assert all(span.parent is None for span in tracer.spans if span.name == 'consumer')
+        assert tracer._stack() == []
+
+    def test_get_batch_tags(self):
+        with patch('requests.Session.post', return_value=Mock(content=batch_xml, status_code=200, headers={})):
+            self.lims.get_batch([Artifact(self.lims, id='a1')])
+        span = [s for s in self.tracer.spans if s.name == 'Lims.get_batch'][0]
+        assert span.tags == dict(entity='Artifact', instances=1)
+
+    def test_error_tag(self):
+        with patch('requests.Session.get', return_value=Mock(content='<a/>', status_code=500, headers={})):
+            self.assertRaises(Exception, Sample(self.lims, id='s1').get)
+        assert all('error' in span.tags for span in self.tracer.spans)
+
+    def test_export(self):
+        with patch('requests.Session.get', return_value=Mock(content=sample_xml, status_code=200, headers={})):
+            Sample(self.lims, id='s1').get()
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'trace.json')
+            self.tracer.export(path)
+            with open(path) as f:
+                trace = json.load(f)
+        finally:
+            shutil.rmtree(directory)
+        events = trace['traceEvents']
+        assert [e['name'] for e in events] == ['Sample.get', 'GET samples/{id}']
+        assert all(e['ph'] == 'X' and e['dur'] >= 0 for e in events)
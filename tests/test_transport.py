@@ -0,0 +1,113 @@
+import zlib
+from io import BytesIO
+from sys import version_info
+from unittest import TestCase
+
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from genologics.lims import Lims
+from genologics.transport import Transport
+
+if version_info[0] == 2:
+    from mock import patch, Mock
+else:
+    from unittest.mock import patch, Mock
+
+
+class TestTransport(TestCase):
+    url = 'http://testgenologics.com:4040/api/v2/samples'
+
+    def test_mounted_for_both_schemes(self):
+        transport = Transport(pool_size=7)
+        assert transport.session.get_adapter('http://example.com') is transport.adapter
+        assert transport.session.get_adapter('https://example.com') is transport.adapter
+
+    def test_lims_uses_transport(self):
+        transport = Transport()
+        lims = Lims('http://testgenologics.com:4040', 'test', 'password', transport=transport)
+        assert lims.request_session is transport.session
+        with patch('requests.Session.put', return_value=Mock(content='<a/>', status_code=200)) as mocked_put:
+            lims.put(self.url, '<a/>')
+            assert mocked_put.call_count == 1
+            assert mocked_put.call_args[1]['timeout'] is None
+
+    @patch('time.sleep')
+    def test_retry_idempotent(self, mocked_sleep):
+        transport = Transport(retries=2)
+        responses = [Mock(status_code=503), Mock(status_code=503), Mock(status_code=200)]
+        with patch('requests.Session.get', side_effect=responses) as mocked_get:
+            r = transport.request('GET', self.url)
+            assert r.status_code == 200
+            assert mocked_get.call_count == 3
+            assert mocked_get.call_args[1]['timeout'] == 16
+        assert mocked_sleep.call_count == 2
+
+    @patch('time.sleep')
+    def test_retries_exhausted(self, mocked_sleep):
+        transport = Transport(retries=1)
+        with patch('requests.Session.get', side_effect=requests.exceptions.ReadTimeout()) as mocked_get:
+            self.assertRaises(requests.exceptions.ReadTimeout, transport.request, 'GET', self.url)
+            assert mocked_get.call_count == 2
+
+    @patch('time.sleep')
+    def test_no_retry_post(self, mocked_sleep):
+        transport = Transport(retries=3)
+        with patch('requests.Session.post', return_value=Mock(status_code=503)) as mocked_post:
+            assert transport.request('POST', self.url).status_code == 503
+            assert mocked_post.call_count == 1
+        with patch('requests.Session.post', side_effect=requests.exceptions.ReadTimeout()) as mocked_post:
+            self.assertRaises(requests.exceptions.ReadTimeout, transport.request, 'POST', self.url)
+            assert mocked_post.call_count == 1
+        with patch('requests.Session.post', side_effect=[requests.exceptions.ConnectTimeout(),
+                                                         Mock(status_code=200)]) as mocked_post:
+            assert transport.request('POST', self.url).status_code == 200
+            assert mocked_post.call_count == 2
+        with patch('requests.Session.post', side_effect=[Mock(status_code=503),
+                                                         Mock(status_code=200)]) as mocked_post:
+            assert transport.request('POST', self.url, idempotent=True).status_code == 200
+        refused = requests.exceptions.ConnectionError(MaxRetryError(
+            None, self.url, NewConnectionError(None, 'Connection refused')))
+        with patch('requests.Session.post', side_effect=[refused, Mock(status_code=200)]) as mocked_post:
+            assert transport.request('POST', self.url).status_code == 200
+            assert mocked_post.call_count == 2
+        # The file would be sent empty the second time
+        with patch('requests.Session.post', side_effect=[refused, Mock(status_code=200)]) as mocked_post:
+            self.assertRaises(requests.exceptions.ConnectionError, transport.request, 'POST', self.url,
+                              files={'file': ('run.csv', BytesIO(b'content'))})
+            assert mocked_post.call_count == 1
+        with patch('requests.Session.put', side_effect=[Mock(status_code=503),
+                                                        Mock(status_code=200)]) as mocked_put:
+            assert transport.request('PUT', self.url, data=BytesIO(b'<a/>')).status_code == 503
+            assert mocked_put.call_count == 1
+
+    @patch('time.sleep')
+    def test_retried_response_closed(self, mocked_sleep):
+        transport = Transport(retries=1)
+        responses = [Mock(status_code=503), Mock(status_code=200)]
+        with patch('requests.Session.get', side_effect=responses):
+            assert transport.request('GET', self.url, stream=True) is responses[1]
+        assert responses[0].close.call_count == 1
+        assert responses[1].close.call_count == 0
+
+    def test_backoff(self):
+        transport = Transport(backoff_factor=1, backoff_max=5)
+        for attempt in range(6):
+            assert 0 <= transport.backoff(attempt) <= min(5, 2 ** attempt)
+
+    def test_compression(self):
+        transport = Transport(compress_min_size=100)
+        assert transport.session.headers['Accept-Encoding'] == 'gzip, deflate'
+        data = b'<art:details>' + b'<art:artifact/>' * 100 + b'</art:details>'
+        with patch('requests.Session.post', return_value=Mock(status_code=200)) as mocked_post:
+            transport.request('POST', self.url, data=data, compress=True,
+                              headers={'content-type': 'application/xml'})
+            kwargs = mocked_post.call_args[1]
+            assert kwargs['headers'] == {'content-type': 'application/xml', 'Content-Encoding': 'gzip'}
+            assert zlib.decompress(kwargs['data'], 16 + zlib.MAX_WBITS) == data
+            transport.request('POST', self.url, data=data)
+            assert mocked_post.call_args[1]['data'] is data
+            transport.request('POST', self.url, data=b'<a/>', compress=True)
+            assert mocked_post.call_args[1]['data'] == b'<a/>'
+        transport = Transport(accept_encoding='identity')
+        assert transport.session.headers['Accept-Encoding'] == 'identity'
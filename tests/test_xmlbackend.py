@@ -0,0 +1,95 @@
+from unittest import TestCase, skipIf
+from io import BytesIO
+from xml.etree import ElementTree
+
+from genologics.entities import Artifact, Sample
+from genologics.lims import Lims
+from genologics.standin import StandInServer
+from genologics.xmlbackend import SubElement, StdlibBackend, get_backend, iter_children, lxml_etree
+
+url = 'http://testgenologics.com:4040/'
+
+sample_xml = """<?xml version='1.0' encoding='utf-8'?>
+<smp:sample xmlns:smp="http://genologics.com/ri/sample" uri="{url}api/v2/samples/S1" limsid="S1">
+<name>sample 1</name>
+</smp:sample>
+""".format(url=url)
+
+artifact_xml = """<?xml version='1.0' encoding='utf-8'?>
+<art:artifact xmlns:art="http://genologics.com/ri/artifact" uri="{url}api/v2/artifacts/A{i}" limsid="A{i}">
+<name>artifact {i}</name>
+<type>Analyte</type>
+</art:artifact>
+"""
+
+
+class TestXmlBackend(TestCase):
+    def test_get_backend(self):
+        assert get_backend().name == 'stdlib'
+        assert get_backend('auto').name == ('lxml' if lxml_etree is not None else 'stdlib')
+        backend = StdlibBackend()
+        assert get_backend(backend) is backend
+        self.assertRaises(ValueError, get_backend, 'expat')
+
+    def test_stdlib(self):
+        lims = Lims(url, 'test', 'password')
+        root = lims.xml.fromstring(sample_xml.encode('utf-8'))
+        SubElement(root, 'date-received').text = '2020-01-01'
+        data = lims.tostring(ElementTree.ElementTree(root))
+        assert data.startswith(b"<?xml version='1.0' encoding='utf-8'?>")
+        assert b'<date-received>2020-01-01</date-received>' in data
+        assert lims.tostring(root) == data
+
+    def test_iter_children(self):
+        source = BytesIO(b'<root><a>1</a><b><c>2</c></b><a>3</a></root>')
+        backend = get_backend()
+        tags = []
+        for node in iter_children(backend, source):
+            tags.append(node.tag)
+        assert tags == ['a', 'b', 'a']
+        assert node.text == '3'
+
+
+@skipIf(lxml_etree is None, 'lxml is not installed')
+class TestLxmlBackend(TestCase):
+    def setUp(self):
+        self.server = StandInServer()
+        xml_dict = {url + 'api/v2/samples/S1': sample_xml}
+        for i in range(3):
+            xml_dict[url + 'api/v2/artifacts/A%s' % i] = artifact_xml.format(url=url, i=i)
+        self.server.load(xml_dict, baseuri=url)
+        self.lims = Lims(self.server.baseuri, 'test', 'password', transport=self.server.transport(),
+                         xml_backend='lxml')
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_entities(self):
+        sample = Sample(self.lims, id='S1')
+        sample.get()
+        assert isinstance(sample.root, lxml_etree._Element)
+        sample.name = 'renamed'
+        sample.udf['Concentration'] = 1.5
+        sample.put()
+        stored = ElementTree.fromstring(self.server.entities['samples/S1'])
+        assert stored.findtext('name') == 'renamed'
+        assert stored.find('{http://genologics.com/ri/userdefined}field').text == '1.5'
+
+    def test_batch(self):
+        artifacts = [Artifact(self.lims, id='A%s' % i) for i in range(3)]
+        self.lims.get_batch(artifacts)
+        # The roots do not hold on to the batch response
+        assert all(artifact.root.getparent() is None for artifact in artifacts)
+        for artifact in artifacts:
+            artifact.name = 'updated'
+        assert self.lims.put_batch(artifacts).ok
+        assert all(artifact.root.getparent() is None for artifact in artifacts)
+        assert artifacts[0].name == 'updated'
+        assert b'updated' in self.server.entities['artifacts/A2']
+        data = artifacts[0].xml()
+        assert data.startswith(b"<?xml version='1.0' encoding='utf-8'?>")
+        assert ElementTree.fromstring(data).findtext('name') == 'updated'
+
+    def test_parse_error(self):
+        self.server.add('samples/S2', b'not xml')
+        self.assertRaises(self.lims.xml.ParseError, self.lims.get, self.server.api_root + 'samples/S2')